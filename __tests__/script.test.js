@@ -73,3 +73,46 @@ describe('grabOne', () => {
         expect(forms.length).toBe(1);
     });
 });
+
+function updateVoteCounts(kind, id, data) {
+    const upvotes = document.getElementById(`${kind}-upvotes-${id}`);
+    const downvotes = document.getElementById(`${kind}-downvotes-${id}`);
+    if (upvotes) {
+        upvotes.textContent = data.upvotes;
+    }
+    if (downvotes) {
+        downvotes.textContent = data.downvotes;
+    }
+    document.querySelectorAll(`[data-vote="${kind}-${id}-up"]`)
+        .forEach(function (button) {
+            button.setAttribute('aria-pressed', data.user_vote === true);
+        });
+    document.querySelectorAll(`[data-vote="${kind}-${id}-down"]`)
+        .forEach(function (button) {
+            button.setAttribute('aria-pressed', data.user_vote === false);
+        });
+}
+
+describe('updateVoteCounts', () => {
+    beforeEach(() => {
+        document.body.innerHTML = `
+            <button data-vote="comment-3-up"></button>
+            <button data-vote="comment-3-down"></button>
+            <span id="comment-upvotes-3">0</span>
+            <span id="comment-downvotes-3">0</span>
+        `;
+    });
+
+    test('should patch the counters and mark the voted button', () => {
+        updateVoteCounts('comment', 3, {upvotes: 4, downvotes: 1, user_vote: true});
+        expect(document.getElementById('comment-upvotes-3').textContent).toBe('4');
+        expect(document.getElementById('comment-downvotes-3').textContent).toBe('1');
+        expect(document.querySelector('[data-vote="comment-3-up"]').getAttribute('aria-pressed')).toBe('true');
+        expect(document.querySelector('[data-vote="comment-3-down"]').getAttribute('aria-pressed')).toBe('false');
+    });
+
+    test('should unmark both buttons when the vote was removed', () => {
+        updateVoteCounts('comment', 3, {upvotes: 3, downvotes: 1, user_vote: null});
+        expect(document.querySelectorAll('[aria-pressed="true"]').length).toBe(0);
+    });
+});
@@ -10,6 +10,10 @@ Registered Models:
             structure for nested comments.
     Category: Registered with the default admin interface.
     UserGroup: Registered with the default admin interface.
+
+The Post and Comment changelists number their pages with the estimated
+count paginator of post_hub/paginators.py, and skip the second count of the
+unfiltered table, so they stay fast on large tables.
 """
 from django.contrib import admin
 
@@ -17,6 +21,7 @@ from django_summernote.admin import SummernoteModelAdmin
 from mptt.admin import MPTTModelAdmin
 
 from .models import Category, Comment, Post, UserGroup
+from .paginators import EstimatedCountPaginator
 
 
 @admin.register(Post)
@@ -39,10 +44,14 @@ class PostAdmin(SummernoteModelAdmin):
     list_filter = ('status', 'created_at')
     prepopulated_fields = {'slug': ('title',)}
     summernote_fields = ('content',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # Register your models here.
-admin.site.register(Comment, MPTTModelAdmin)
+admin.site.register(Comment, MPTTModelAdmin,
+                    paginator=EstimatedCountPaginator,
+                    show_full_result_count=False)
 
 admin.site.register(Category)
 
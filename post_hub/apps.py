@@ -15,6 +15,16 @@ class PostHubConfig(AppConfig):
         default_auto_field (str): The default auto field type for
                             the app's models.
         name (str): The name of the app.
+
+    Methods:
+        ready(): Connects the signal receivers of the sidebar cache, the
+                autocomplete indexes and the upload queue.
     """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'post_hub'
+
+    def ready(self):
+        from . import autocomplete, sidebar, uploads  # noqa: F401
+# Importing the modules connects their receivers, which drop the cached
+# sidebar widgets and autocomplete indexes when their data changes, and
+# queue the images staged on a saved instance.
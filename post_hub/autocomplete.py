@@ -0,0 +1,311 @@
+"""
+This module contains the in-memory autocomplete of category and group
+names.
+
+Each process builds an AutocompleteIndex of the names of each kind the
+first time it is used, with one query, and keeps it in memory:
+
+- Prefix matches are found by binary search in a sorted array holding the
+  name from each of its words on, so "dev" finds "Web Development".
+- Fuzzy matches are found with a SymSpell delete index, which maps every
+  string made by deleting up to max_distance characters from the start of
+  a name to the names it came from. The same deletes of a query look up
+  the candidates, which are then checked with the edit distance, so a
+  misspelled name is matched without comparing it to every name.
+
+A saved or deleted category or group stores a new version of its kind in
+the cache, and each process rebuilds its index when it next sees that the
+version changed. The version is only seen by every process if the cache is
+shared, as the CACHES setting is. With a per-process cache the other
+processes would keep their stale index until they restart.
+
+Constants:
+    KINDS: The autocompleted kinds with their model and name field.
+    VERSION_KEY: The cache key of the version of a kind's names.
+    PAGE_SIZE: The number of names on a page of the autocomplete endpoint.
+
+Classes:
+    Entry: The primary key, name and slug of an indexed name.
+    AutocompleteIndex: The prefix and delete index of a list of names.
+
+Functions:
+    normalize: Returns the form of a name that is matched.
+    edit_distance: Returns the edit distance of two strings.
+    get_index: Returns the current index of a kind.
+    invalidate_index: Marks the index of a kind as stale.
+    refresh_index: Marks the index of a saved or deleted row as stale.
+"""
+import threading
+import uuid
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, UserGroup
+
+KINDS = {
+    'category': (Category, 'category_name'),
+    'group': (UserGroup, 'name'),
+}
+VERSION_KEY = 'post_hub:autocomplete:{}'
+PAGE_SIZE = 20
+
+Entry = namedtuple('Entry', 'pk name slug')
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def normalize(name):
+    """
+    Returns the form of a name that is matched, in lower case with single
+    spaces.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        str: The normalized name.
+    """
+    return ' '.join((name or '').casefold().split())
+
+
+def edit_distance(first, second, limit):
+    """
+    Returns the number of insertions, deletions, substitutions and swaps of
+    adjacent characters that turn one string into the other.
+
+    Args:
+        first (str): The first string.
+        second (str): The second string.
+        limit (int): The largest distance of interest.
+
+    Returns:
+        int: The distance, or limit + 1 if it is larger than limit.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    over = limit + 1
+    before, previous = None, [j if j <= limit else over
+                              for j in range(len(second) + 1)]
+    for i, char in enumerate(first, 1):
+        current = [i if i <= limit else over] + [over] * len(second)
+        for j in range(max(1, i - limit), min(len(second), i + limit) + 1):
+            other = second[j - 1]
+            cost = previous[j - 1] + (char != other)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if (before is not None and j > 1 and char == second[j - 2]
+                    and first[i - 2] == other and before[j - 2] + 1 < cost):
+                cost = before[j - 2] + 1
+            current[j] = cost if cost < over else over
+        if min(current) > limit:
+            return over
+        before, previous = previous, current
+    return previous[-1]
+# Only the cells within limit of the diagonal can stay within limit, so the
+# others are left at limit + 1.
+
+
+def _deletes(word, distance):
+    found = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {item[:index] + item[index + 1:]
+                for item in edge for index in range(len(item))} - found
+        found |= edge
+    return found
+
+
+class AutocompleteIndex:
+    """
+    The prefix and delete index of a list of names.
+
+    Attributes:
+        entries (list): The Entry (pk, name, slug) of each name.
+        max_distance (int): The largest edit distance of a fuzzy match.
+        prefix_length (int): The number of leading characters the delete
+                            index is built from.
+
+    Methods:
+        find(name): Returns the entries with the same normalized name.
+        prefix(query, limit, offset): Returns the entries with a word
+                                    starting with the query.
+        fuzzy(query, limit, offset): Returns the entries close to the query.
+        suggest(query, limit, offset): Returns the prefix matches, or the
+                                    fuzzy matches if there are none.
+    """
+    def __init__(self, entries, max_distance=2, prefix_length=7):
+        self.entries = list(entries)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._names = [normalize(entry.name) for entry in self.entries]
+        keys = []
+        self._exact = {}
+        self._deletes = {}
+        for index, name in enumerate(self._names):
+            self._exact.setdefault(name, []).append(index)
+            words = name.split(' ')
+            keys.extend((' '.join(words[start:]), index)
+                        for start in range(len(words)))
+            for delete in _deletes(name[:prefix_length], max_distance):
+                self._deletes.setdefault(delete, []).append(index)
+        keys.sort()
+        self._order = sorted(range(len(self._names)),
+                             key=self._names.__getitem__)
+        self._keys = [key for key, _ in keys]
+        self._key_entries = [index for _, index in keys]
+# The sorted keys are kept in a plain list next to their entries so that
+# bisect compares strings only.
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, name):
+        """
+        Returns the entries whose normalized name equals the name's.
+
+        Args:
+            name (str): The name.
+
+        Returns:
+            list: The entries.
+        """
+        return [self.entries[index]
+                for index in self._exact.get(normalize(name), [])]
+
+    def prefix(self, query, limit=10, offset=0):
+        """
+        Returns the entries with a word from which the name starts with the
+        query, in alphabetical order of the matched words. An empty query
+        matches every entry, in alphabetical order.
+
+        Args:
+            query (str): The typed text.
+            limit (int): The largest number of entries returned.
+            offset (int): The number of matching entries skipped.
+
+        Returns:
+            list: The entries.
+        """
+        query = normalize(query)
+        if not query:
+            return [self.entries[index]
+                    for index in self._order[offset:offset + limit]]
+        found, seen = [], set()
+        position = bisect_left(self._keys, query)
+        while (position < len(self._keys) and len(found) < offset + limit
+               and self._keys[position].startswith(query)):
+            if self._key_entries[position] not in seen:
+                seen.add(self._key_entries[position])
+                found.append(self._key_entries[position])
+            position += 1
+        return [self.entries[index] for index in found[offset:]]
+
+    def fuzzy(self, query, limit=10, offset=0):
+        """
+        Returns the entries within the edit distance of the query, closest
+        first. Queries of up to seven characters allow one edit.
+
+        Args:
+            query (str): The typed text.
+            limit (int): The largest number of entries returned.
+            offset (int): The number of matching entries skipped.
+
+        Returns:
+            list: The entries.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        distance = min(self.max_distance, 1 if len(query) <= 7 else 2)
+        candidates = set()
+        for delete in _deletes(query[:self.prefix_length], distance):
+            candidates.update(self._deletes.get(delete, ()))
+        ranked = []
+        for index in candidates:
+            found = edit_distance(query, self._names[index], distance)
+            if found <= distance:
+                ranked.append((found, self._names[index], index))
+        ranked.sort()
+        return [self.entries[index]
+                for _, _, index in ranked[offset:offset + limit]]
+
+    def suggest(self, query, limit=10, offset=0):
+        """
+        Returns the prefix matches of the query, or its fuzzy matches if
+        there are none.
+
+        Args:
+            query (str): The typed text.
+            limit (int): The largest number of entries returned.
+            offset (int): The number of matching entries skipped.
+
+        Returns:
+            tuple: The entries, and whether they are fuzzy matches.
+        """
+        if not normalize(query) or self.prefix(query, 1):
+            return self.prefix(query, limit, offset), False
+        return self.fuzzy(query, limit, offset), True
+
+
+def get_index(kind):
+    """
+    Returns the index of a kind's names, building it when this process has
+    none or its names changed since it was built.
+
+    Args:
+        kind (str): A key of KINDS.
+
+    Returns:
+        AutocompleteIndex: The index.
+    """
+    key = VERSION_KEY.format(kind)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    built = _indexes.get(kind)
+    if built is not None and built[0] == version:
+        return built[1]
+    with _indexes_lock:
+        built = _indexes.get(kind)
+        if built is None or built[0] != version:
+            model, field = KINDS[kind]
+            index = AutocompleteIndex(
+                Entry(*row) for row in model.objects.order_by().values_list(
+                    'pk', field, 'slug'))
+            built = _indexes[kind] = (version, index)
+    return built[1]
+# The version is read before the names, so names saved while the index is
+# built bump the version again and the next call rebuilds it.
+
+
+def invalidate_index(kind):
+    """
+    Marks the index of a kind as stale in every process.
+
+    Args:
+        kind (str): A key of KINDS.
+    """
+    cache.set(VERSION_KEY.format(kind), uuid.uuid4().hex, None)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=UserGroup)
+@receiver(post_delete, sender=UserGroup)
+def refresh_index(sender, **_kwargs):
+    """
+    Marks the index of a saved or deleted category or group as stale.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        **_kwargs: Additional keyword arguments.
+    """
+    invalidate_index('category' if sender is Category else 'group')
@@ -0,0 +1,31 @@
+"""
+This module contains the template context processors of the application.
+
+Functions:
+    sidebar: Adds the data of the sidebar widgets to every template.
+"""
+from django.utils.functional import SimpleLazyObject
+
+from . import sidebar as widgets
+
+
+def sidebar(request):
+    """
+    Adds the data of the sidebar widgets to every template, see
+    post_hub/sidebar.py.
+
+    The data is only read when a template uses it, so pages without the
+    widgets do not touch the cache.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        dict: The top categories, top groups and suggested categories.
+    """
+    return {
+        'top_categories': SimpleLazyObject(widgets.top_categories),
+        'top_groups': SimpleLazyObject(widgets.top_groups),
+        'suggested_categories': SimpleLazyObject(
+            widgets.suggested_categories),
+    }
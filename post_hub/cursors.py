@@ -0,0 +1,236 @@
+"""
+This module contains the keyset (cursor) pagination of listings.
+
+Django's Paginator selects a page with OFFSET, so the database reads and
+skips every row before the page, and it counts the whole listing to number
+the pages. A cursor page instead filters on the ordering columns of the
+last row of the previous page, so with an index on those columns any page
+costs the same as the first, and nothing is counted unless the count is
+asked for.
+
+Cursors are opaque, signed tokens holding the ordering values of a row and
+the direction to read in. A cursor that was tampered with, was made for
+another ordering, or cannot be read starts the listing from the top, as
+Paginator.get_page() does with an invalid page number.
+
+The ordering of a paginated queryset must be on non-null field names, and
+is completed with the primary key so every row has a distinct position.
+
+Constants:
+    CURSOR_SALT: The salt of the cursor signatures.
+    LAST: The direction of the cursor of the last page.
+
+Classes:
+    CursorPage: A page of a cursor paginated listing.
+    CursorPaginator: Splits an ordered queryset into cursor pages.
+
+Functions:
+    cursor_page: Returns the page of a queryset named in a request.
+"""
+from functools import reduce
+from operator import or_
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+CURSOR_SALT = 'post_hub.cursors'
+LAST = 'last'
+
+
+class CursorPage:
+    """
+    A page of a cursor paginated listing.
+
+    Attributes:
+        object_list (list): The rows on the page.
+        paginator (CursorPaginator): The paginator of the listing.
+        next_cursor (str): The cursor of the next page, or None.
+        previous_cursor (str): The cursor of the previous page, or None.
+
+    Methods:
+        has_next(): Returns whether there is a next page.
+        has_previous(): Returns whether there is a previous page.
+        has_other_pages(): Returns whether there is another page.
+    """
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} rows>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Splits an ordered queryset into cursor pages.
+
+    Attributes:
+        queryset (QuerySet): The ordered rows to paginate.
+        per_page (int): The number of rows on a page.
+        ordering (tuple): The ordering of the rows, ending with the primary
+                        key.
+        first_cursor (str): The cursor of the first page.
+        last_cursor (str): The cursor of the last page.
+
+    Methods:
+        count: The number of rows, only counted when it is used.
+        page(cursor): Returns the page of a cursor.
+        get_page(cursor): Returns the page of a cursor, or the first page
+                        if the cursor is invalid.
+    """
+    def __init__(self, queryset, per_page):
+        ordering = list(queryset.query.order_by or
+                        queryset.model._meta.ordering)
+        if not ordering or ordering[-1].lstrip('-') not in (
+                'pk', queryset.model._meta.pk.name):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.first_cursor = None
+        self.last_cursor = self._sign(LAST, None)
+        self._count = None
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = self.queryset.count()
+        return self._count
+
+    def page(self, cursor):
+        """
+        Returns the page of a cursor.
+
+        Args:
+            cursor (str): A cursor of this listing, or None for the first
+                        page.
+
+        Returns:
+            CursorPage: The page.
+
+        Raises:
+            signing.BadSignature: If the cursor is invalid.
+        """
+        if cursor is None:
+            direction, values = 'next', None
+        else:
+            token = signing.loads(cursor, salt=CURSOR_SALT)
+            if token['o'] != list(self.ordering):
+                raise signing.BadSignature('The cursor has another ordering.')
+            direction, values = token['d'], token['v']
+            if values is not None:
+                values = [self._field(name).to_python(value)
+                          for name, value in zip(self.ordering, values)]
+        backwards = direction in ('previous', LAST)
+        rows = self.queryset
+        if values is not None:
+            rows = rows.filter(self._after(values, backwards))
+        if backwards:
+            rows = rows.reverse()
+        rows = list(rows[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows, self, None, None)
+        has_next = more if not backwards else direction == 'previous'
+        has_previous = more if backwards else values is not None
+        return CursorPage(
+            rows, self,
+            self._sign('next', rows[-1]) if has_next else None,
+            self._sign('previous', rows[0]) if has_previous else None)
+
+    def get_page(self, cursor):
+        """
+        Returns the page of a cursor, or the first page if the cursor is
+        invalid.
+
+        Args:
+            cursor (str): A cursor of this listing, or None.
+
+        Returns:
+            CursorPage: The page.
+        """
+        try:
+            return self.page(cursor or None)
+        except (signing.BadSignature, KeyError, TypeError, ValueError,
+                ValidationError):
+            return self.page(None)
+
+    def _field(self, name):
+        meta = self.queryset.model._meta
+        name = name.lstrip('-')
+        return meta.pk if name == 'pk' else meta.get_field(name)
+
+    def _sign(self, direction, row):
+        values = None
+        if row is not None:
+            values = [self._field(name).value_to_string(row)
+                      for name in self.ordering]
+        return signing.dumps({'o': list(self.ordering), 'd': direction,
+                              'v': values}, salt=CURSOR_SALT)
+
+    def _after(self, values, backwards):
+        """
+        Returns a filter matching the rows after the given ordering values,
+        or before them when reading backwards.
+
+        Args:
+            values (list): The ordering values of a row.
+            backwards (bool): Whether to match the rows before it.
+
+        Returns:
+            Q: The filter.
+        """
+        conditions = []
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-') != backwards
+            lookup = 'lt' if descending else 'gt'
+            equal = {other.lstrip('-'): value for other, value in zip(
+                self.ordering[:index], values)}
+            conditions.append(Q(**equal, **{
+                f'{name.lstrip("-")}__{lookup}': values[index]}))
+        return reduce(or_, conditions)
+# (a, b, pk) > (x, y, z) is written as a > x OR (a = x AND b > y) OR
+# (a = x AND b = y AND pk > z), which the database can answer from an index
+# on the ordering columns.
+
+
+def cursor_page(request, queryset, per_page, param='cursor'):
+    """
+    Returns the page of a queryset named by a cursor in the query string.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        queryset (QuerySet): The ordered rows to paginate.
+        per_page (int): The number of rows on a page.
+        param (str): The query string parameter holding the cursor.
+
+    Returns:
+        CursorPage: The page.
+    """
+    return CursorPaginator(queryset, per_page).get_page(
+        request.GET.get(param))
@@ -7,21 +7,87 @@ Forms:
     GroupAdminForm: A form for managing user groups.
     ProfileForm: A form for updating user profiles.
 
+Widgets:
+    AutocompleteSelect: A select that only renders its selected option and
+                    loads the others from the autocomplete endpoint.
+
+Functions:
+    spell_checker: Returns the spell checker shared by the forms.
+
 Utilities:
-    Handles image uploads to Cloudinary and integrates
+    Queues image uploads to Cloudinary, see uploads.py, and integrates
     Summernote for rich text editing.
 """
-from cloudinary.uploader import upload
-from cloudinary.exceptions import Error
+from functools import cache
+
 from spellchecker import SpellChecker
 
 from django import forms
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import UploadedFile
+from django.urls import reverse, reverse_lazy
 from django_summernote.widgets import SummernoteWidget
 
 from mptt.forms import TreeNodeChoiceField
 
+from .autocomplete import get_index
 from .models import Comment, Post, Category, UserGroup, Profile
+from .uploads import stage_upload
+
+
+@cache
+def spell_checker():
+    """
+    Returns the spell checker shared by the forms of this process.
+
+    Returns:
+        SpellChecker: The spell checker.
+    """
+    return SpellChecker()
+# Loading the word frequency dictionary takes far longer than checking a
+# word, so it is loaded once per process instead of once per form.
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    A select that only renders the empty and the selected option of a
+    ModelChoiceField. The other options are loaded by script.js from the
+    autocomplete endpoint of the kind as the user searches, so the page
+    does not grow with the table.
+
+    Attributes:
+        kind (str): The autocomplete kind, "category" or "group".
+
+    Methods:
+        build_attrs(base_attrs, extra_attrs): Adds the endpoint URL.
+        optgroups(name, value, attrs): Returns the rendered options.
+    """
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse(
+            'autocomplete', args=[self.kind])
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [item for item in value if item not in (None, '')]
+        options = [self.create_option(
+            name, '', self.choices.field.empty_label or '', not selected, 0)]
+        field = self.choices.field
+        try:
+            rows = list(self.choices.queryset.filter(pk__in=selected))
+        except (ValueError, forms.ValidationError):
+            rows = []
+        for index, obj in enumerate(rows, 1):
+            options.append(self.create_option(
+                name, field.prepare_value(obj),
+                field.label_from_instance(obj), True, index))
+        return [(None, options, 0)]
+# The selected option is looked up by primary key, the same single query
+# the field runs to validate a submitted value. A submitted value that is
+# not a primary key renders as no selection.
 
 
 class CommentForm(forms.ModelForm):
@@ -42,7 +108,7 @@ class CommentForm(forms.ModelForm):
 
     Methods:
         save(*_args, **kwargs): Saves the comment instance,
-                            handling image upload to Cloudinary.
+                            queuing its image upload to Cloudinary.
     """
     parent = TreeNodeChoiceField(
         queryset=Comment.objects.all(),
@@ -69,38 +135,38 @@ class CommentForm(forms.ModelForm):
 
     def save(self, *_args, **kwargs):
         """
-        Saves the comment instance, handling image upload to Cloudinary.
+        Saves the comment instance, queuing its image upload to Cloudinary.
 
         Args:
             *_args: Additional positional arguments.
-            **kwargs: Additional keyword arguments.
+            **kwargs: Additional keyword arguments, author sets the comment
+                    author and commit=False skips saving to the database.
 
         Returns:
             Comment: The saved comment instance.
         """
         author = kwargs.pop('author', None)
+        commit = kwargs.pop('commit', True)
         comment = super().save(commit=False)
         if author:
             comment.author = author
         image = self.cleaned_data.get('image')
 
-        # Handle comment image upload to cloudinary
-        if image:
-            try:
-                upload_result = upload(
-                    image,
-                    resource_type='image',
-                    folder='groups/',
-                    allowed_formats=['jpg', 'jpeg', 'png'],
-                    transformation={'quality': 'auto:good',
-                                    'fetch_format': 'auto'},
-                    eager=[{'width': 700, 'height': 700, 'crop': 'limit'}]
-                )
-                comment.image = upload_result['url']
-            except Error as e:
-                print(f'Error uploading image: {e}')
-        comment.save()
-        Comment.objects.rebuild()
+        # Queue the comment image upload to cloudinary
+        if image and isinstance(image, UploadedFile):
+            stage_upload(
+                comment, 'image', image, self.initial.get('image'),
+                resource_type='image',
+                folder='groups/',
+                allowed_formats=['jpg', 'jpeg', 'png'],
+                transformation={'quality': 'auto:good',
+                                'fetch_format': 'auto'},
+                eager=[{'width': 700, 'height': 700, 'crop': 'limit'}]
+            )
+        if commit:
+            comment.save()
+# The comment is placed in its thread as it is inserted, so the comment
+# trees no longer need a full rebuild after every new comment.
         return comment
 
 
@@ -110,9 +176,10 @@ class PostForm(forms.ModelForm):
 
     Fields:
         new_category (CharField): A field for entering a new category name.
-        category (ModelChoiceField): A dropdown field for selecting
-                                an existing category.
-        group (ModelChoiceField): A dropdown field for selecting a user group.
+        category (ModelChoiceField): A searchable dropdown field for
+                                selecting an existing category.
+        group (ModelChoiceField): A searchable dropdown field for selecting
+                                a user group.
         content (CharField): A field for entering the main content of the post.
 
     Meta:
@@ -124,14 +191,20 @@ class PostForm(forms.ModelForm):
     Methods:
         clean(): Validates the form data and returns the cleaned data.
         save(commit=True): Saves the post instance, handling the new_category
-                        field and image upload to Cloudinary.
+                        field and queuing the image upload to Cloudinary.
     """
     new_category = forms.CharField(
-        required=False, max_length=100, label='New Category')
-    category = forms.ModelChoiceField(queryset=Category.objects.all(
-    ), required=False, widget=forms.Select(attrs={'class': 'form-control'}))
-    group = forms.ModelChoiceField(queryset=UserGroup.objects.all(
-    ), required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+        required=False, max_length=100, label='New Category',
+        widget=forms.TextInput(attrs={
+            'class': 'form-control', 'autocomplete': 'off',
+            'data-autocomplete-url': reverse_lazy(
+                'autocomplete', args=['category'])}))
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.all(), required=False,
+        widget=AutocompleteSelect('category', attrs={'class': 'form-control'}))
+    group = forms.ModelChoiceField(
+        queryset=UserGroup.objects.all(), required=False,
+        widget=AutocompleteSelect('group', attrs={'class': 'form-control'}))
     content = forms.CharField(widget=SummernoteWidget())
 
     class Meta:
@@ -197,17 +270,21 @@ class PostForm(forms.ModelForm):
                     ' categories with the same name.')
 # I raised a ValidationError with a message if there are
 # more than two categories with the same name.
-            spell = SpellChecker()
+            spell = spell_checker()
 # I reasearched a way to spell check my categories and came
-# across the spellchecker library. First, I imported the
-# SpellChecker class from the spellchecker module.
-# Then, I created a SpellChecker object called spell.
-            misspelled = spell.unknown([new_category_name])
+# across the spellchecker library. The SpellChecker object is
+# shared by every form, see spell_checker above.
+            categories = get_index('category')
+            misspelled = (not categories.find(new_category_name)
+                          and spell.unknown([new_category_name]))
 # I used the unknown method to check if the category name is misspelled.
+# The name of an existing category is never misspelled.
             if misspelled:
-                corrected = spell.correction(new_category_name)
-# If the category name is misspelled, I used the correction
-# method to get the correct spelling.
+                close = categories.fuzzy(new_category_name, limit=1)
+                corrected = (close[0].name if close
+                             else spell.correction(new_category_name))
+# If the category name is misspelled, the closest existing category is
+# suggested, and otherwise the correction method gives the correct spelling.
                 self.add_error('new_category', f"Did you mean '{corrected}'?")
 # I raised a ValidationError with a message that suggests the correct spelling.
 
@@ -216,7 +293,7 @@ class PostForm(forms.ModelForm):
     def save(self, commit=True):
         """
         Saves the post instance, handling the new_category field and
-        image upload to Cloudinary.
+        queuing the image upload to Cloudinary.
 
         Args:
             commit (bool): Whether to save the instance to the database.
@@ -245,21 +322,18 @@ class PostForm(forms.ModelForm):
 # If new_category_name is empty, I set the category of the post
 # to the selected category in dropdown menu.
 
-        # Handle banner image upload to Cloudinary
+        # Queue the banner image upload to Cloudinary
         banner_image = self.cleaned_data.get('banner_image')
-        if banner_image and isinstance(banner_image, InMemoryUploadedFile):
-            try:
-                upload_result = upload(
-                    banner_image,
-                    resource_type='image',
-                    folder='groups/',
-                    allowed_formats=['jpg', 'jpeg', 'png'],
-                    transformation={'quality': 'auto:good',
-                                    'fetch_format': 'auto'},
-                )
-                post.banner_image = upload_result['url']
-            except Error as e:
-                print(f'Error uploading image: {e}')
+        if banner_image and isinstance(banner_image, UploadedFile):
+            stage_upload(
+                post, 'banner_image', banner_image,
+                self.initial.get('banner_image'),
+                resource_type='image',
+                folder='groups/',
+                allowed_formats=['jpg', 'jpeg', 'png'],
+                transformation={'quality': 'auto:good',
+                                'fetch_format': 'auto'},
+            )
         if commit:
             post.save()
 # If commit is True, I save the post object to the database.
@@ -287,7 +361,7 @@ class GroupForm(forms.ModelForm):
 
     Methods:
         save(commit=True): Saves the group instance,
-                        handling image upload to Cloudinary.
+                        queuing its image upload to Cloudinary.
     """
     description = forms.CharField(widget=SummernoteWidget())
 
@@ -315,7 +389,7 @@ class GroupForm(forms.ModelForm):
 
     def save(self, commit=True):
         """
-        Saves the group instance, handling image upload to Cloudinary.
+        Saves the group instance, queuing its image upload to Cloudinary.
 
         Args:
             commit (bool): Whether to save the instance to the database.
@@ -325,20 +399,17 @@ class GroupForm(forms.ModelForm):
         """
         group = super().save(commit=False)
         group_image = self.cleaned_data.get('group_image')
-        if group_image and isinstance(group_image, InMemoryUploadedFile):
-            try:
-                upload_result = upload(
-                    group_image,
-                    resource_type='image',
-                    folder='groups/',
-                    allowed_formats=['jpg', 'jpeg', 'png'],
-                    transformation={'quality': 'auto:good',
-                                    'fetch_format': 'auto'},
-                    eager=[{'width': 700, 'height': 700, 'crop': 'limit'}]
-                )
-                group.group_image = upload_result['url']
-            except Error as e:
-                print(f'Error uploading image: {e}')
+        if group_image and isinstance(group_image, UploadedFile):
+            stage_upload(
+                group, 'group_image', group_image,
+                self.initial.get('group_image'),
+                resource_type='image',
+                folder='groups/',
+                allowed_formats=['jpg', 'jpeg', 'png'],
+                transformation={'quality': 'auto:good',
+                                'fetch_format': 'auto'},
+                eager=[{'width': 700, 'height': 700, 'crop': 'limit'}]
+            )
         if commit:
             group.save()
         return group
@@ -360,7 +431,7 @@ class GroupAdminForm(forms.ModelForm):
 
     Methods:
         save(commit=True): Saves the group instance,
-                        handling image upload to Cloudinary.
+                        queuing its image upload to Cloudinary.
     """
     admin_message = forms.CharField(
         label='A message to your group members',
@@ -391,7 +462,7 @@ class GroupAdminForm(forms.ModelForm):
 
     def save(self, commit=True):
         """
-        Saves the group instance, handling image upload to Cloudinary.
+        Saves the group instance, queuing its image upload to Cloudinary.
 
         Args:
             commit (bool): Whether to save the instance to the database.
@@ -401,19 +472,16 @@ class GroupAdminForm(forms.ModelForm):
         """
         group = super().save(commit=False)
         group_image = self.cleaned_data.get('group_image')
-        if group_image and isinstance(group_image, InMemoryUploadedFile):
-            try:
-                upload_result = upload(
-                    group_image,
-                    resource_type='image',
-                    folder='groups/',
-                    allowed_formats=['jpg', 'jpeg', 'png'],
-                    transformation={'quality': 'auto:good',
-                                    'fetch_format': 'auto'},
-                )
-                group.group_image = upload_result['url']
-            except Error as e:
-                print(f'Error uploading image: {e}')
+        if group_image and isinstance(group_image, UploadedFile):
+            stage_upload(
+                group, 'group_image', group_image,
+                self.initial.get('group_image'),
+                resource_type='image',
+                folder='groups/',
+                allowed_formats=['jpg', 'jpeg', 'png'],
+                transformation={'quality': 'auto:good',
+                                'fetch_format': 'auto'},
+            )
         if commit:
             group.save()
         return group
@@ -435,7 +503,7 @@ class ProfileForm(forms.ModelForm):
 
     Methods:
         save(commit=True): Saves the profile instance,
-                        handling image upload to Cloudinary.
+                        queuing its image upload to Cloudinary.
     """
     location = forms.CharField(required=False)
     bio = forms.CharField(
@@ -472,7 +540,7 @@ class ProfileForm(forms.ModelForm):
 
     def save(self, commit=True):
         """
-        Saves the profile instance, handling image upload to Cloudinary.
+        Saves the profile instance, queuing its image upload to Cloudinary.
 
         Args:
             commit (bool): Whether to save the instance to the database.
@@ -482,19 +550,16 @@ class ProfileForm(forms.ModelForm):
         """
         profile = super().save(commit=False)
         user_image = self.cleaned_data.get('user_image')
-        if user_image and isinstance(user_image, InMemoryUploadedFile):
-            try:
-                upload_result = upload(
-                    user_image,
-                    resource_type='image',
-                    folder='profiles/',
-                    allowed_formats=['jpg', 'jpeg', 'png'],
-                    transformation={'quality': 'auto:good',
-                                    'fetch_format': 'auto'},
-                )
-                profile.user_image = upload_result['url']
-            except Error as e:
-                print(f'Error uploading image: {e}')
+        if user_image and isinstance(user_image, UploadedFile):
+            stage_upload(
+                profile, 'user_image', user_image,
+                self.initial.get('user_image'),
+                resource_type='image',
+                folder='profiles/',
+                allowed_formats=['jpg', 'jpeg', 'png'],
+                transformation={'quality': 'auto:good',
+                                'fetch_format': 'auto'},
+            )
         if commit:
             profile.save()
         return profile
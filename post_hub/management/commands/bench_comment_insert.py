@@ -0,0 +1,158 @@
+"""
+Management command that benchmarks comment insert latency.
+
+The comments table is seeded with synthetic threads up to each requested
+size, then new top level comments and replies are inserted through the
+normal Comment.save() path and timed. With --compare-rebuild the cost of the
+old insert path, which rebuilt every comment tree after each insert, is
+measured as well. Everything runs inside a transaction that is rolled back,
+so no benchmark data is left behind.
+
+Usage:
+    python manage.py bench_comment_insert
+    python manage.py bench_comment_insert --sizes 10000 --compare-rebuild
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post_hub.models import Category, Comment, Post
+
+
+class Rollback(Exception):
+    """
+    Raised at the end of the benchmark to roll the seeded data back.
+    """
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks comment insert latency at increasing table sizes.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Seeds the table and times the inserts.
+        report(size, label, timings): Writes a line of results.
+        seed(post, author, count, thread_size): Bulk inserts synthetic threads.
+        time_inserts(post, author, count, reply, rebuild): Times inserts.
+    """
+    help = 'Benchmarks comment insert latency at increasing table sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+',
+            default=[10_000, 100_000, 1_000_000],
+            help='Existing comment counts to benchmark at.')
+        parser.add_argument(
+            '--inserts', type=int, default=50,
+            help='Timed inserts per size and comment type.')
+        parser.add_argument(
+            '--thread-size', type=int, default=20,
+            help='Comments per seeded thread.')
+        parser.add_argument(
+            '--compare-rebuild', action='store_true',
+            help='Also time the old insert-then-rebuild path.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                author = User.objects.create_user(username='bench-comments')
+                category = Category.objects.create(
+                    category_name='bench-comments')
+                post = Post.objects.create(
+                    title='Bench comments', content='Bench',
+                    author=author, category=category)
+                seeded = Comment.objects.count()
+                for size in sorted(options['sizes']):
+                    if size > seeded:
+                        seed_start = time.perf_counter()
+                        self.seed(post, author, size - seeded,
+                                  options['thread_size'])
+                        seeded = size
+                        self.stdout.write(
+                            f'Seeded {size} comments in '
+                            f'{time.perf_counter() - seed_start:.1f}s')
+                    self.report(size, 'new thread', self.time_inserts(
+                        post, author, options['inserts'], reply=False))
+                    self.report(size, 'reply', self.time_inserts(
+                        post, author, options['inserts'], reply=True))
+                    if options['compare_rebuild']:
+                        self.report(size, 'reply + rebuild', self.time_inserts(
+                            post, author, 1, reply=True, rebuild=True))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, size, label, timings):
+        """
+        Writes the median and worst latency of a set of timings.
+
+        Args:
+            size (int): The number of existing comments.
+            label (str): The kind of insert that was timed.
+            timings (list): Insert durations in seconds.
+        """
+        self.stdout.write(
+            f'{size:>10} comments | {label:<16} | '
+            f'median {statistics.median(timings) * 1000:8.2f} ms | '
+            f'max {max(timings) * 1000:8.2f} ms')
+
+    def seed(self, post, author, count, thread_size):
+        """
+        Bulk inserts synthetic threads with valid tree fields.
+
+        Each thread is a root comment followed by direct replies, so the
+        tree values can be computed without touching the database.
+
+        Args:
+            post (Post): The post the comments belong to.
+            author (User): The author of the comments.
+            count (int): The number of comments to insert.
+            thread_size (int): The number of comments per thread.
+        """
+        tree_id = Comment.objects._get_next_tree_id()
+        while count > 0:
+            size = min(thread_size, count)
+            root = Comment.objects.create(
+                post=post, author=author, content='bench root',
+                lft=1, rght=size * 2, level=0, tree_id=tree_id)
+            Comment.objects.bulk_create([
+                Comment(post=post, author=author, content='bench reply',
+                        parent=root, lft=index * 2, rght=index * 2 + 1,
+                        level=1, tree_id=tree_id)
+                for index in range(1, size)], batch_size=1000)
+            tree_id += 1
+            count -= size
+
+    def time_inserts(self, post, author, count, reply, rebuild=False):
+        """
+        Times inserting comments through Comment.save().
+
+        Args:
+            post (Post): The post the comments belong to.
+            author (User): The author of the comments.
+            count (int): The number of comments to insert.
+            reply (bool): Whether to reply to a random existing thread.
+            rebuild (bool): Whether to rebuild every tree after each insert,
+                        as the comment form used to.
+
+        Returns:
+            list: The duration of each insert in seconds.
+        """
+        roots = list(Comment.objects.filter(
+            post=post, parent__isnull=True).values_list('pk', flat=True))
+        timings = []
+        for _ in range(count):
+            comment = Comment(post=post, author=author, content='bench insert')
+            if reply:
+                comment.parent_id = random.choice(roots)
+            start = time.perf_counter()
+            comment.save()
+            if rebuild:
+                Comment.objects.rebuild()
+            timings.append(time.perf_counter() - start)
+        return timings
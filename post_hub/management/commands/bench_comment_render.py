@@ -0,0 +1,128 @@
+"""
+Management command that benchmarks rendering comment threads.
+
+Synthetic threads are built in memory, with valid tree fields and a saved
+looking author, so no database access is involved. Each thread is rendered
+with the comment_tree tag and with mptt's recursetree tag wrapped around
+the same comment_node.html template, as the comment templates used to, and
+both are timed.
+
+Usage:
+    python manage.py bench_comment_render
+    python manage.py bench_comment_render --sizes 1000 10000 --repeat 5
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.test import RequestFactory
+from django.utils import timezone
+
+from post_hub.models import Comment
+
+RENDERERS = {
+    'comment_tree': (
+        '{% load comment_tags %}{% comment_tree comments %}'),
+    'recursetree': (
+        '{% load mptt_tags %}{% recursetree comments %}'
+        "{% include 'post_hub/comment_node.html' %}{% endrecursetree %}"),
+}
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks rendering comment threads of increasing size.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Builds the threads and times the renders.
+        build_thread(size, max_level): Builds one thread in memory.
+    """
+    help = 'Benchmarks rendering comment threads of increasing size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1_000, 10_000, 50_000],
+            help='Comments per rendered thread.')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Timed renders per size and renderer.')
+        parser.add_argument(
+            '--max-level', type=int, default=3,
+            help='The deepest reply level of the threads.')
+        parser.add_argument(
+            '--skip-recursetree', action='store_true',
+            help='Only time the comment_tree tag.')
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        engine = engines['django']
+        for size in options['sizes']:
+            comments = self.build_thread(size, options['max_level'])
+            for name, source in RENDERERS.items():
+                if name == 'recursetree' and options['skip_recursetree']:
+                    continue
+                template = engine.from_string(source)
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    html = template.render({'comments': comments}, request)
+                    timings.append(time.perf_counter() - start)
+                self.stdout.write(
+                    f'{size:>8} comments | {name:<12} | '
+                    f'median {statistics.median(timings) * 1000:10.1f} ms | '
+                    f'max {max(timings) * 1000:10.1f} ms | '
+                    f'{len(html) / 1_000_000:.1f} MB')
+
+    def build_thread(self, size, max_level):
+        """
+        Builds one thread of comments in memory.
+
+        Every comment replies to a random earlier comment above max_level,
+        then the tree fields are numbered with a depth first walk. The
+        attributes the views set on loaded comments are set as well.
+
+        Args:
+            size (int): The number of comments in the thread.
+            max_level (int): The deepest reply level.
+
+        Returns:
+            list: The comments ordered by level, as comment_tree expects.
+        """
+        author = User(pk=1, username='bench-render')
+        now = timezone.now()
+        comments = [Comment(pk=1, author=author, content='bench root',
+                            level=0, tree_id=1, created_at=now)]
+        children = {1: []}
+        parents = [comments[0]]
+        for pk in range(2, size + 1):
+            parent = random.choice(parents)
+            comment = Comment(pk=pk, author=author, content='bench reply',
+                              parent_id=parent.pk, level=parent.level + 1,
+                              tree_id=1, created_at=now)
+            comments.append(comment)
+            children[parent.pk].append(comment)
+            children[pk] = []
+            if comment.level < max_level:
+                parents.append(comment)
+        counter = 0
+        stack = [(comments[0], False)]
+        while stack:
+            comment, done = stack.pop()
+            counter += 1
+            if done:
+                comment.rght = counter
+                continue
+            comment.lft = counter
+            stack.append((comment, True))
+            stack.extend((child, False)
+                         for child in reversed(children[comment.pk]))
+        for comment in comments:
+            comment._state.adding = False
+            comment.user_vote = None
+            comment.more_replies = 0
+        return sorted(comments, key=lambda comment: comment.level)
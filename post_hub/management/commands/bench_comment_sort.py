@@ -0,0 +1,197 @@
+"""
+Management command that benchmarks the comment sort modes.
+
+A post is seeded with synthetic threads of comments with random votes, and
+their rankings are stored with refresh_comment_scores(). The first page of
+threads is then fetched in every sort mode through thread_roots() and
+load_threads() and built into a tree, the way the post page renders it.
+With --compare-python the old approach of loading every comment and
+sorting the siblings in Python is timed as well. Everything runs inside a
+transaction that is rolled back, so no benchmark data is left behind.
+
+Usage:
+    python manage.py bench_comment_sort
+    python manage.py bench_comment_sort --comments 50000 --compare-python
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+from mptt.utils import get_cached_trees
+
+from post_hub.models import Category, Comment, Post
+from post_hub.ranking import (COMMENT_SORTS, controversy_score,
+                              refresh_comment_scores, wilson_score)
+from post_hub.threads import load_threads, thread_roots
+
+
+class Rollback(Exception):
+    """
+    Raised at the end of the benchmark to roll the seeded data back.
+    """
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks fetching a page of comments in every sort mode.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Seeds the comments and times the sorts.
+        seed(post, author, count, thread_size): Bulk inserts synthetic threads.
+        fetch_page(post, sort, page_size): Fetches and builds one page.
+        python_sort(post, sort): Sorts the whole tree in Python.
+    """
+    help = 'Benchmarks fetching a page of comments in every sort mode.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--comments', type=int, default=50_000,
+            help='Comments seeded on the benchmark post.')
+        parser.add_argument(
+            '--thread-size', type=int, default=25,
+            help='Comments per seeded thread.')
+        parser.add_argument(
+            '--page-size', type=int, default=10,
+            help='Threads fetched per page.')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Timed fetches per sort mode.')
+        parser.add_argument(
+            '--compare-python', action='store_true',
+            help='Also time sorting the whole tree in Python.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                author = User.objects.create_user(username='bench-sort')
+                category = Category.objects.create(category_name='bench-sort')
+                post = Post.objects.create(
+                    title='Bench sort', content='Bench',
+                    author=author, category=category)
+                start = time.perf_counter()
+                self.seed(post, author, options['comments'],
+                          options['thread_size'])
+                self.stdout.write(
+                    f'Seeded {options["comments"]} comments in '
+                    f'{time.perf_counter() - start:.1f}s')
+                start = time.perf_counter()
+                changed = refresh_comment_scores(post.comments.all())
+                self.stdout.write(
+                    f'Ranked {changed} comments in '
+                    f'{time.perf_counter() - start:.1f}s')
+                for sort in COMMENT_SORTS:
+                    timings = []
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        self.fetch_page(post, sort, options['page_size'])
+                        timings.append(time.perf_counter() - start)
+                    self.report(sort, 'database', timings)
+                    if options['compare_python']:
+                        start = time.perf_counter()
+                        self.python_sort(post, sort)
+                        self.report(sort, 'python',
+                                    [time.perf_counter() - start])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, sort, label, timings):
+        """
+        Writes the median and worst latency of a set of timings.
+
+        Args:
+            sort (str): The sort mode that was timed.
+            label (str): Where the comments were sorted.
+            timings (list): Fetch durations in seconds.
+        """
+        self.stdout.write(
+            f'{sort:<14} | {label:<8} | '
+            f'median {statistics.median(timings) * 1000:8.2f} ms | '
+            f'max {max(timings) * 1000:8.2f} ms')
+
+    def seed(self, post, author, count, thread_size):
+        """
+        Bulk inserts synthetic threads with valid tree fields and random
+        votes.
+
+        Each thread is a root comment followed by direct replies, so the
+        tree values can be computed without touching the database.
+
+        Args:
+            post (Post): The post the comments belong to.
+            author (User): The author of the comments.
+            count (int): The number of comments to insert.
+            thread_size (int): The number of comments per thread.
+        """
+        def votes():
+            upvotes = random.randint(0, 100)
+            downvotes = random.randint(0, 40)
+            return {'upvote_count': upvotes, 'downvote_count': downvotes,
+                    'score': upvotes - downvotes}
+
+        tree_id = Comment.objects._get_next_tree_id()
+        while count > 0:
+            size = min(thread_size, count)
+            root = Comment.objects.create(
+                post=post, author=author, content='bench root',
+                lft=1, rght=size * 2, level=0, tree_id=tree_id, **votes())
+            Comment.objects.bulk_create([
+                Comment(post=post, author=author, content='bench reply',
+                        parent=root, lft=index * 2, rght=index * 2 + 1,
+                        level=1, tree_id=tree_id, **votes())
+                for index in range(1, size)], batch_size=1000)
+            tree_id += 1
+            count -= size
+
+    def fetch_page(self, post, sort, page_size):
+        """
+        Fetches the first page of threads in a sort mode and builds it
+        into a tree.
+
+        Args:
+            post (Post): The post the comments belong to.
+            sort (str): A key of COMMENT_SORTS.
+            page_size (int): The number of threads on the page.
+
+        Returns:
+            list: The top level comments of the page.
+        """
+        comments = post.comments.filter(status=True)
+        page = Paginator(thread_roots(comments, sort), page_size).page(1)
+        return get_cached_trees(load_threads(page, comments, sort))
+
+    def python_sort(self, post, sort):
+        """
+        Loads every comment of the post and sorts each set of siblings in
+        Python, the approach the stored rankings replace.
+
+        Args:
+            post (Post): The post the comments belong to.
+            sort (str): A key of COMMENT_SORTS.
+
+        Returns:
+            list: The sorted top level comments.
+        """
+        def key(comment):
+            upvotes = comment.upvote_count
+            downvotes = comment.downvote_count
+            return {
+                'best': (-wilson_score(upvotes, downvotes),
+                         comment.created_at),
+                'top': (-comment.score, comment.created_at),
+                'new': (-comment.created_at.timestamp(),),
+                'controversial': (-controversy_score(upvotes, downvotes),
+                                  comment.created_at),
+            }[sort]
+
+        children = {}
+        for comment in post.comments.filter(status=True):
+            children.setdefault(comment.parent_id, []).append(comment)
+        for siblings in children.values():
+            siblings.sort(key=key)
+        return children.get(None, [])
@@ -0,0 +1,187 @@
+"""
+Management command that benchmarks concurrent replies to a single thread
+with each comment tree backend.
+
+For every backend a busy thread is seeded, then worker threads, each with
+its own database connection, reply to random comments of that thread
+through Comment.save(), as the comment form does. Afterwards the stored tree
+is checked, the nested sets must cover every comment of the thread and the
+closure table must hold one link per comment and ancestor, and the
+benchmark rows are deleted again.
+
+Usage:
+    python manage.py bench_comment_tree_writes
+    python manage.py bench_comment_tree_writes --threads 20 --replies 10
+"""
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import F, Sum
+from django.test import override_settings
+
+from post_hub.models import Category, Comment, CommentClosure, Post
+
+BACKENDS = {
+    'mptt': 'post_hub.tree_backends.MPTTTreeBackend',
+    'closure': 'post_hub.tree_backends.ClosureTreeBackend',
+}
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks concurrent replies to a single thread with each tree backend.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Runs the benchmark for each backend.
+        run(name, post, author, options): Seeds a thread, runs the workers
+                                        and checks the stored tree.
+        check_tree(name, root): Checks the stored tree of a thread.
+        worker(post_id, author_id, targets, options, stats, lock): Posts
+                                                replies from one thread.
+    """
+    help = ('Benchmarks concurrent replies to a single thread with each '
+            'comment tree backend.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends', nargs='+', choices=list(BACKENDS),
+            default=list(BACKENDS),
+            help='The tree backends to benchmark.')
+        parser.add_argument(
+            '--threads', type=int, default=100,
+            help='Concurrent replying threads.')
+        parser.add_argument(
+            '--replies', type=int, default=20,
+            help='Replies posted per thread.')
+        parser.add_argument(
+            '--seed', type=int, default=200,
+            help='Comments in the thread before the workers start.')
+        parser.add_argument(
+            '--retries', type=int, default=50,
+            help='Retries of a reply that hit a locked database.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError(
+                'An in-memory SQLite database cannot be shared by threads.')
+        author = User.objects.create_user(username='bench-tree-writes')
+        category = Category.objects.create(category_name='bench-tree-writes')
+        post = Post.objects.create(title='Bench tree writes', content='Bench',
+                                   author=author, category=category)
+        try:
+            for name in options['backends']:
+                with override_settings(COMMENT_TREE_BACKEND=BACKENDS[name]):
+                    self.run(name, post, author, options)
+        finally:
+            Comment.objects.filter(post=post).delete()
+            post.delete()
+            category.delete()
+            author.delete()
+
+    def run(self, name, post, author, options):
+        """
+        Seeds a thread with one backend, replies to it from the worker
+        threads and checks the stored tree.
+
+        Args:
+            name (str): The key of the backend in BACKENDS.
+            post (Post): The post the thread belongs to.
+            author (User): The author of the comments.
+            options (dict): The parsed command options.
+        """
+        root = Comment(post=post, author=author, content='bench root')
+        root.save()
+        targets = [root.pk]
+        for _ in range(options['seed']):
+            reply = Comment(post=post, author=author, content='bench reply',
+                            parent_id=random.choice(targets))
+            reply.save()
+            targets.append(reply.pk)
+        stats = {'replies': 0, 'retries': 0, 'errors': 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self.worker, args=(
+                post.pk, author.pk, targets, options, stats, lock))
+            for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{connection.vendor} {name:<8}: {stats["replies"]} replies from '
+            f'{options["threads"]} threads in {elapsed:.2f}s '
+            f'({stats["replies"] / elapsed:.0f} replies/s), '
+            f'{stats["retries"]} retries, {stats["errors"]} errors')
+        self.check_tree(name, root)
+
+    def check_tree(self, name, root):
+        """
+        Checks that the stored tree of a thread covers all of its comments.
+
+        Args:
+            name (str): The key of the backend in BACKENDS.
+            root (Comment): The top level comment of the thread.
+
+        Raises:
+            CommandError: If the stored tree does not match the comments.
+        """
+        thread = Comment.objects.filter(tree_id=root.tree_id)
+        comments = thread.count()
+        if name == 'mptt':
+            root.refresh_from_db()
+            stored = (root.rght - root.lft + 1) // 2
+        else:
+            stored = CommentClosure.objects.filter(
+                descendant__tree_id=root.tree_id).count()
+            comments = thread.aggregate(
+                links=Sum(F('level') + 1))['links'] or 0
+        if stored != comments:
+            raise CommandError(
+                f'The {name} tree drifted: {stored} stored for {comments}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'The {name} tree matches the thread.'))
+
+    def worker(self, post_id, author_id, targets, options, stats, lock):
+        """
+        Posts replies to random comments of the thread from one thread.
+
+        A reply that hits a locked database is retried with a short backoff,
+        the way a client would resend it.
+
+        Args:
+            post_id (int): The post the thread belongs to.
+            author_id (int): The author of the replies.
+            targets (list): The ids of the comments to reply to.
+            options (dict): The parsed command options.
+            stats (dict): Shared reply, retry and error counters.
+            lock (Lock): Guards the shared counters.
+        """
+        replies = retries = errors = 0
+        try:
+            for _ in range(options['replies']):
+                parent_id = random.choice(targets)
+                for attempt in range(options['retries'] + 1):
+                    try:
+                        Comment(post_id=post_id, author_id=author_id,
+                                content='bench write',
+                                parent_id=parent_id).save()
+                        replies += 1
+                        break
+                    except OperationalError:
+                        retries += 1
+                        time.sleep(0.001 * 2 ** min(attempt, 6))
+                else:
+                    errors += 1
+        finally:
+            connection.close()
+            with lock:
+                stats['replies'] += replies
+                stats['retries'] += retries
+                stats['errors'] += errors
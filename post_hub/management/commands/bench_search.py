@@ -0,0 +1,153 @@
+"""
+Management command that benchmarks the full-text search against the
+substring scans it replaces.
+
+A few million posts of random words are inserted in batches, through the
+search triggers, then common, rare and multi-word queries are timed
+with the search backend, for the first page and the page after it, and with
+a content__icontains scan for comparison. The benchmark posts are deleted
+afterwards unless --keep is given, so a later run with --posts 0 can reuse
+them.
+
+Usage:
+    python manage.py bench_search
+    python manage.py bench_search --posts 200000 --repeat 5
+"""
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from post_hub.models import Category, Post
+from post_hub.search import SearchPaginator, get_search_backend
+
+WORDS = 5000
+QUERIES = {
+    'common': 'word1',
+    'rare': 'word4000',
+    'two words': 'word1 word2',
+    'rare pair': 'word49 word4000',
+}
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the full-text search against substring scans.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Seeds the posts and times the queries.
+        seed(count, author, category, batch_size): Inserts the posts.
+        report(name, query, repeat): Times one query both ways.
+        best_time(run, repeat): Returns the best time of a query.
+    """
+    help = 'Benchmarks the full-text search against substring scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts', type=int, default=2_000_000,
+            help='Posts inserted before the queries are timed.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Posts inserted per batch.')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Times each query is run, the best time is reported.')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the benchmark posts.')
+
+    def handle(self, *args, **options):
+        author, _ = User.objects.get_or_create(username='bench-search')
+        category, _ = Category.objects.get_or_create(
+            category_name='bench-search')
+        try:
+            self.seed(options['posts'], author, category,
+                      options['batch_size'])
+            total = Post.objects.filter(author=author).count()
+            self.stdout.write(f'{connection.vendor}: {total} posts')
+            for name, query in QUERIES.items():
+                self.report(name, query, options['repeat'])
+        finally:
+            if not options['keep']:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {Post._meta.db_table} '
+                        f'WHERE author_id = %s', [author.pk])
+                category.delete()
+                author.delete()
+# The benchmark posts have no comments or votes, so they are deleted with
+# one statement instead of being collected by the ORM.
+
+    def seed(self, count, author, category, batch_size):
+        """
+        Inserts posts of random words, the lower numbered words being the
+        most frequent.
+
+        Args:
+            count (int): The number of posts.
+            author (User): The author of the posts.
+            category (Category): The category of the posts.
+            batch_size (int): Posts inserted per batch.
+        """
+        words = [f'word{index}' for index in range(WORDS)]
+        weights = [1 / (index + 1) for index in range(WORDS)]
+        first = Post.objects.filter(author=author).count()
+        start = time.perf_counter()
+        for offset in range(first, first + count, batch_size):
+            size = min(batch_size, first + count - offset)
+            with transaction.atomic():
+                Post.objects.bulk_create([
+                    Post(title=' '.join(random.choices(words, weights, k=6)),
+                         slug=f'bench-search-{offset + index}',
+                         content=' '.join(
+                             random.choices(words, weights, k=80)),
+                         author=author, category=category)
+                    for index in range(size)])
+        if count:
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'Inserted {count} posts in {elapsed:.1f}s '
+                f'({count / elapsed:.0f} posts/s)')
+
+    def report(self, name, query, repeat):
+        """
+        Times a query with the search backend and with a substring scan.
+
+        Args:
+            name (str): The name of the query.
+            query (str): The searched words.
+            repeat (int): Times each query is run.
+        """
+        paginator = SearchPaginator(
+            query.split(), ['post'], 20, get_search_backend())
+        first = self.best_time(lambda: paginator.get_page(None), repeat)
+        cursor = paginator.get_page(None).next_cursor
+        second = self.best_time(lambda: paginator.get_page(cursor), repeat)
+        scan = Post.objects.filter(status=1).order_by('-created_at', '-id')
+        for word in query.split():
+            scan = scan.filter(content__icontains=word)
+        substring = self.best_time(lambda: list(scan[:20]), repeat)
+        self.stdout.write(
+            f'{name:<10}: search {first * 1000:.1f}ms, next page '
+            f'{second * 1000:.1f}ms, icontains {substring * 1000:.1f}ms')
+
+    def best_time(self, run, repeat):
+        """
+        Returns the best time of a query.
+
+        Args:
+            run (callable): Runs the query.
+            repeat (int): Times the query is run.
+
+        Returns:
+            float: The best time in seconds.
+        """
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,149 @@
+"""
+Management command that benchmarks concurrent voting on a single post.
+
+Worker threads, each with its own database connection, cast votes on one
+hot post through the same cast_vote() path the vote view uses. With
+--shared-users every thread votes as the same few users, which reproduces
+double clicks and retried requests racing each other. Afterwards the stored
+vote counts are checked against the Vote table and the benchmark rows are
+deleted again.
+
+Usage:
+    python manage.py bench_vote_concurrency
+    python manage.py bench_vote_concurrency --threads 16 --shared-users
+"""
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from post_hub.models import Category, Post, Vote
+from post_hub.votes import cast_vote, count_votes
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks concurrent voting on a single post.
+
+    Methods:
+        add_arguments(parser): Adds the benchmark options.
+        handle(*args, **options): Runs the workers and checks the counts.
+        worker(post_id, users, options, stats, lock): Casts votes from
+                                                one thread.
+    """
+    help = 'Benchmarks concurrent voting on a single post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Concurrent voting threads.')
+        parser.add_argument(
+            '--votes', type=int, default=200,
+            help='Votes cast per thread.')
+        parser.add_argument(
+            '--users', type=int, default=50,
+            help='Voting users per thread, or in total with --shared-users.')
+        parser.add_argument(
+            '--shared-users', action='store_true',
+            help='Let every thread vote as the same users.')
+        parser.add_argument(
+            '--retries', type=int, default=20,
+            help='Retries of a vote that hit a locked database.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError(
+                'An in-memory SQLite database cannot be shared by threads.')
+        author = User.objects.create_user(username='bench-votes')
+        category = Category.objects.create(category_name='bench-votes')
+        post = Post.objects.create(title='Bench votes', content='Bench',
+                                   author=author, category=category)
+        user_count = options['users'] * (
+            1 if options['shared_users'] else options['threads'])
+        User.objects.bulk_create([
+            User(username=f'bench-voter-{index}')
+            for index in range(user_count)])
+        users = list(User.objects.filter(username__startswith='bench-voter-')
+                     .order_by('pk'))
+        try:
+            stats = {'votes': 0, 'retries': 0, 'errors': 0}
+            lock = threading.Lock()
+            threads = []
+            for index in range(options['threads']):
+                if options['shared_users']:
+                    thread_users = users
+                else:
+                    thread_users = users[index * options['users']:
+                                         (index + 1) * options['users']]
+                threads.append(threading.Thread(target=self.worker, args=(
+                    post.pk, thread_users, options, stats, lock)))
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            post.refresh_from_db()
+            upvotes, downvotes = count_votes('post', [post.pk]).get(
+                post.pk, (0, 0))
+            total_votes = Vote.objects.filter(post=post).count()
+            voters = Vote.objects.filter(post=post).values(
+                'user_id').distinct().count()
+            self.stdout.write(
+                f'{connection.vendor}: {stats["votes"]} votes from '
+                f'{options["threads"]} threads in {elapsed:.2f}s '
+                f'({stats["votes"] / elapsed:.0f} votes/s), '
+                f'{stats["retries"]} retries, {stats["errors"]} errors')
+            stored = (post.upvote_count, post.downvote_count, post.score)
+            counted = (upvotes, downvotes, upvotes - downvotes)
+            if stored != counted or total_votes != voters:
+                raise CommandError(
+                    f'Counts drifted: stored {stored}, counted {counted}, '
+                    f'{total_votes} votes from {voters} users.')
+            self.stdout.write(self.style.SUCCESS(
+                f'Stored counts match the Vote table: {stored}.'))
+        finally:
+            Vote.objects.filter(post=post).delete()
+            post.delete()
+            category.delete()
+            User.objects.filter(username__startswith='bench-vot').delete()
+
+    def worker(self, post_id, users, options, stats, lock):
+        """
+        Casts votes on the post from one thread.
+
+        A vote that hits a locked database is retried with a short backoff,
+        the way a client would resend it.
+
+        Args:
+            post_id (int): The post to vote on.
+            users (list): The users this thread votes as.
+            options (dict): The parsed command options.
+            stats (dict): Shared vote, retry and error counters.
+            lock (Lock): Guards the shared counters.
+        """
+        votes = retries = errors = 0
+        try:
+            for _ in range(options['votes']):
+                user = random.choice(users)
+                is_upvote = random.random() < 0.7
+                for attempt in range(options['retries'] + 1):
+                    try:
+                        cast_vote(user, 'post', post_id, is_upvote)
+                        votes += 1
+                        break
+                    except OperationalError:
+                        retries += 1
+                        time.sleep(0.001 * 2 ** min(attempt, 6))
+                else:
+                    errors += 1
+        finally:
+            connection.close()
+            with lock:
+                stats['votes'] += votes
+                stats['retries'] += retries
+                stats['errors'] += errors
@@ -0,0 +1,103 @@
+"""
+Management command that converts the stored comment trees between the tree
+backends of post_hub/tree_backends.py.
+
+Converting to the closure table builds the CommentClosure links of every
+comment from its lft/rght values, one batch of trees per statement, and
+checks that every comment got a link to itself and to each ancestor.
+Converting back to nested sets rebuilds the lft/rght values from the parent
+links and drops the closure table rows, which would go stale.
+
+Run it while no comments are being posted, then switch the
+COMMENT_TREE_BACKEND setting.
+
+Usage:
+    python manage.py convert_comment_tree closure
+    python manage.py convert_comment_tree mptt
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+
+from post_hub.models import Comment, CommentClosure
+
+
+class Command(BaseCommand):
+    """
+    Converts the stored comment trees between tree backends.
+
+    Methods:
+        add_arguments(parser): Adds the target and batch size options.
+        handle(*args, **options): Runs the conversion.
+        to_closure(batch_size): Builds the closure table from the nested
+                                sets.
+        to_mptt(): Rebuilds the nested sets from the parent links.
+    """
+    help = 'Converts the stored comment trees between tree backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'target', choices=['closure', 'mptt'],
+            help='The tree backend to convert to.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Trees converted per statement.')
+
+    def handle(self, *args, **options):
+        if options['target'] == 'closure':
+            self.to_closure(options['batch_size'])
+        else:
+            self.to_mptt()
+
+    def to_closure(self, batch_size):
+        """
+        Builds the closure table from the lft/rght values of the comments.
+
+        A comment is linked to every comment of its tree whose lft/rght
+        range contains its own, which are its ancestors and itself.
+
+        Args:
+            batch_size (int): Trees converted per statement.
+
+        Raises:
+            CommandError: If the links do not match the comment levels,
+                        meaning the nested sets need repairing first.
+        """
+        comments = Comment._meta.db_table
+        closure = CommentClosure._meta.db_table
+        last_tree = Comment.objects.aggregate(last=Max('tree_id'))['last'] or 0
+        with transaction.atomic():
+            CommentClosure.objects.all().delete()
+            with connection.cursor() as cursor:
+                for first in range(1, last_tree + 1, batch_size):
+                    cursor.execute(
+                        f'INSERT INTO {closure} '
+                        f'(ancestor_id, descendant_id, depth) '
+                        f'SELECT a.id, d.id, d.level - a.level '
+                        f'FROM {comments} a JOIN {comments} d '
+                        f'ON d.tree_id = a.tree_id '
+                        f'AND d.lft BETWEEN a.lft AND a.rght '
+                        f'WHERE a.tree_id BETWEEN %s AND %s',
+                        [first, first + batch_size - 1])
+            links = CommentClosure.objects.count()
+            expected = Comment.objects.aggregate(
+                links=Sum(F('level') + 1))['links'] or 0
+            if links != expected:
+                raise CommandError(
+                    f'Built {links} links where the comment levels need '
+                    f'{expected}. Run repair_comment_trees and try again.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Linked {Comment.objects.count()} comments with {links} '
+            f'closure rows.'))
+
+    def to_mptt(self):
+        """
+        Rebuilds the lft/rght values of every tree from the parent links and
+        drops the closure table rows.
+        """
+        with transaction.atomic():
+            Comment.objects.rebuild()
+            deleted, _ = CommentClosure.objects.all().delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the nested sets of {Comment.objects.count()} comments '
+            f'and dropped {deleted} closure rows.'))
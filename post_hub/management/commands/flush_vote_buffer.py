@@ -0,0 +1,80 @@
+"""
+Management command that writes the votes waiting in the vote buffer to the
+Vote table.
+
+Votes are flushed oldest first in batches, each in its own transaction.
+For every batch the command reports its size, how many votes were applied
+(votes on deleted posts or comments are dropped) and the lag, which is how
+long the oldest vote of the batch waited in the buffer. With --loop it
+keeps running as a worker, flushing every --interval seconds.
+
+Usage:
+    python manage.py flush_vote_buffer
+    python manage.py flush_vote_buffer --loop --interval 2 --batch-size 1000
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from post_hub.vote_buffer import flush_vote_buffer, get_vote_buffer
+
+
+class Command(BaseCommand):
+    """
+    Writes buffered votes to the Vote table in bulk.
+
+    Methods:
+        add_arguments(parser): Adds the batch and worker options.
+        handle(*args, **options): Flushes the buffer once or in a loop.
+        flush(buffer, options): Flushes the buffer and reports the batches.
+    """
+    help = 'Writes buffered votes to the Vote table in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Buffered votes written per transaction.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep flushing until interrupted.')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds between flushes with --loop.')
+
+    def handle(self, *args, **options):
+        buffer = get_vote_buffer()
+        if buffer is None:
+            raise CommandError('The VOTE_BUFFER setting is not set.')
+        if not options['loop']:
+            self.flush(buffer, options)
+            return
+        try:
+            while True:
+                started = time.monotonic()
+                self.flush(buffer, options)
+                time.sleep(max(
+                    0, options['interval'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+    def flush(self, buffer, options):
+        """
+        Flushes the buffer until it is empty and reports the batches.
+
+        Args:
+            buffer (BaseVoteBuffer): The vote buffer.
+            options (dict): The parsed command options.
+        """
+        batches = flush_vote_buffer(buffer, options['batch_size'])
+        for size, applied, lag in batches:
+            self.stdout.write(
+                f'Flushed {size} vote(s), {applied} applied, '
+                f'lag {lag:.2f}s')
+        if batches or not options['loop']:
+            sizes = [size for size, _, _ in batches] or [0]
+            lags = [lag for _, _, lag in batches] or [0]
+            self.stdout.write(
+                f'{len(batches)} batch(es), {sum(sizes)} vote(s), '
+                f'median batch {statistics.median(sizes):g}, '
+                f'max lag {max(lags):.2f}s, {len(buffer)} left.')
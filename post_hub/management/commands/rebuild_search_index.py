@@ -0,0 +1,36 @@
+"""
+Management command that rebuilds the full-text search index.
+
+It drops the search columns, tables and triggers of post_hub/search.py and
+creates them again from the current rows. Run it after a migration altered
+a searchable table on SQLite, which drops the triggers of the table, or
+after a kind was added to SEARCHABLE.
+
+Usage:
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError, transaction
+
+from post_hub.search import get_search_backend
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text search index.
+
+    Methods:
+        handle(*args, **options): Drops and recreates the index.
+    """
+    help = 'Rebuilds the full-text search index.'
+
+    def handle(self, *args, **options):
+        try:
+            backend = get_search_backend()
+        except NotSupportedError as error:
+            raise CommandError(error)
+        with transaction.atomic():
+            backend.uninstall()
+            backend.install()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the search index with {type(backend).__name__}.'))
@@ -0,0 +1,109 @@
+"""
+Management command that recounts the stored vote counts of posts and
+comments from the Vote table.
+
+Rows are walked in primary key batches. Each batch is counted with one
+aggregate query, and only the rows whose stored counts drifted are written
+back, so the command is safe to run regularly on a live site.
+
+Usage:
+    python manage.py reconcile_votes
+    python manage.py reconcile_votes --check --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post_hub.models import Comment, Post
+from post_hub.votes import REFRESH_RANKINGS, count_votes
+
+
+class Command(BaseCommand):
+    """
+    Recounts the stored vote counts of posts and comments.
+
+    Methods:
+        add_arguments(parser): Adds the batch size and check options.
+        handle(*args, **options): Reconciles posts and then comments.
+        reconcile(model, field, batch_size, check): Reconciles one model.
+        fix(model, field, pks): Writes fresh counts to drifted rows.
+    """
+    help = 'Recounts the stored vote counts of posts and comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows counted and updated per batch.')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift, do not fix it.')
+
+    def handle(self, *args, **options):
+        for model, field in ((Post, 'post'), (Comment, 'comment')):
+            checked, drifted, drift = self.reconcile(
+                model, field, options['batch_size'], options['check'])
+            self.stdout.write(
+                f'{model.__name__}: {checked} checked, {drifted} drifted, '
+                f'total drift {drift} vote(s)'
+                f'{"" if options["check"] else ", fixed"}.')
+
+    def reconcile(self, model, field, batch_size, check):
+        """
+        Recounts the stored vote counts of every row of one model.
+
+        Args:
+            model (Model): Post or Comment.
+            field (str): The Vote field pointing at the model.
+            batch_size (int): Rows counted and updated per batch.
+            check (bool): Whether to only report drift.
+
+        Returns:
+            tuple: Rows checked, rows drifted and the summed absolute
+                difference between the stored and counted votes.
+        """
+        checked = drifted = drift = 0
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                         .only('upvote_count', 'downvote_count', 'score')
+                         [:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            counts = count_votes(field, [row.pk for row in batch])
+            changed = []
+            for row in batch:
+                upvotes, downvotes = counts.get(row.pk, (0, 0))
+                if (row.upvote_count, row.downvote_count, row.score) != (
+                        upvotes, downvotes, upvotes - downvotes):
+                    drift += (abs(row.upvote_count - upvotes)
+                              + abs(row.downvote_count - downvotes))
+                    changed.append(row.pk)
+            checked += len(batch)
+            drifted += len(changed)
+            if changed and not check:
+                self.fix(model, field, changed)
+        return checked, drifted, drift
+
+    def fix(self, model, field, pks):
+        """
+        Writes freshly counted votes to the drifted rows.
+
+        The rows are locked and recounted first, so a vote cast while the
+        batch was being checked is not overwritten.
+
+        Args:
+            model (Model): Post or Comment.
+            field (str): The Vote field pointing at the model.
+            pks (list): The ids of the drifted rows.
+        """
+        with transaction.atomic():
+            rows = list(model.objects.select_for_update().filter(pk__in=pks)
+                        .only('upvote_count', 'downvote_count', 'score'))
+            counts = count_votes(field, pks)
+            for row in rows:
+                row.upvote_count, row.downvote_count = counts.get(
+                    row.pk, (0, 0))
+                row.score = row.upvote_count - row.downvote_count
+            model.objects.bulk_update(
+                rows, ['upvote_count', 'downvote_count', 'score'])
+            REFRESH_RANKINGS[model](model.objects.filter(pk__in=pks))
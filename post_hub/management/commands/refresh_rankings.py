@@ -0,0 +1,78 @@
+"""
+Management command that recomputes the stored rankings of posts and
+comments.
+
+Votes refresh the rankings of the post or comment they are cast on, so this
+command only has to catch up rows whose counts changed some other way, such
+as an edit in the admin, or every row after a ranking formula changed. Rows
+are walked in primary key batches, each batch is computed from one query
+and written back with a single UPDATE.
+
+Usage:
+    python manage.py refresh_rankings
+    python manage.py refresh_rankings --since-days 7 --batch-size 5000
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post_hub.models import Comment, Post
+from post_hub.votes import REFRESH_RANKINGS
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the stored rankings of posts and comments in batches.
+
+    Methods:
+        add_arguments(parser): Adds the batch size and age options.
+        handle(*args, **options): Refreshes posts and then comments.
+        refresh(model, rows, batch_size): Refreshes the rows of one model.
+    """
+    help = 'Recomputes the stored rankings of posts and comments in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows computed and updated per batch.')
+        parser.add_argument(
+            '--since-days', type=int,
+            help='Only refresh rows created in the last N days.')
+
+    def handle(self, *args, **options):
+        for model, label in ((Post, 'post'), (Comment, 'comment')):
+            rows = model.objects.all()
+            if options['since_days']:
+                rows = rows.filter(created_at__gte=timezone.now() - timedelta(
+                    days=options['since_days']))
+            checked, changed = self.refresh(
+                model, rows, options['batch_size'])
+            self.stdout.write(
+                f'{checked} {label}(s) checked, {changed} ranking(s) '
+                f'updated.')
+
+    def refresh(self, model, rows, batch_size):
+        """
+        Recomputes the stored rankings of the selected rows of one model.
+
+        Args:
+            model (Model): Post or Comment.
+            rows (QuerySet): The rows to refresh.
+            batch_size (int): Rows computed and updated per batch.
+
+        Returns:
+            tuple: The number of rows checked and of rankings changed.
+        """
+        checked = changed = 0
+        last_pk = 0
+        while True:
+            pks = list(rows.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            changed += REFRESH_RANKINGS[model](
+                model.objects.filter(pk__in=pks))
+            checked += len(pks)
+        return checked, changed
@@ -0,0 +1,196 @@
+"""
+Management command that checks and repairs comment trees one at a time.
+
+Every top level comment owns a tree (tree_id). This command walks the
+selected trees, reports the ones whose lft/rght/level values no longer match
+their parent links and rebuilds only those trees, each in its own transaction,
+so the rest of the comments table is never locked.
+
+Usage:
+    python manage.py repair_comment_trees --all
+    python manage.py repair_comment_trees --post my-post-slug --check
+    python manage.py repair_comment_trees --tree-id 12 --tree-id 13 --force
+"""
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from post_hub.models import Comment
+
+
+def find_tree_problems(nodes):
+    """
+    Checks the nodes of a single tree against their parent links.
+
+    Args:
+        nodes (list): Dicts with pk, parent_id, lft, rght and level keys
+                    for every comment sharing one tree_id.
+
+    Returns:
+        list: Human readable descriptions of the problems found,
+            empty when the tree is valid.
+    """
+    pks = {node['pk'] for node in nodes}
+    roots = [node for node in nodes if node['parent_id'] is None]
+    if len(roots) != 1:
+        return [f'{len(roots)} root comments share the tree']
+    problems = [f'comment {node["pk"]} has its parent in another tree'
+                for node in nodes
+                if node['parent_id'] is not None
+                and node['parent_id'] not in pks]
+    if problems:
+        return problems
+
+    children = defaultdict(list)
+    for node in sorted(nodes, key=lambda node: node['lft']):
+        children[node['parent_id']].append(node)
+
+    expected = {}
+    counter = 1
+    stack = [(roots[0], 0, False)]
+    # Iterative depth first walk, a node is visited once on the way down
+    # (lft, level) and once on the way back up (rght).
+    while stack:
+        node, level, closing = stack.pop()
+        if closing:
+            expected[node['pk']] = (expected[node['pk']][0], counter, level)
+            counter += 1
+            continue
+        expected[node['pk']] = (counter, None, level)
+        counter += 1
+        stack.append((node, level, True))
+        for child in reversed(children[node['pk']]):
+            stack.append((child, level + 1, False))
+
+    problems = []
+    for node in nodes:
+        actual = (node['lft'], node['rght'], node['level'])
+        if actual != expected[node['pk']]:
+            problems.append(
+                f'comment {node["pk"]} has lft/rght/level {actual}, '
+                f'expected {expected[node["pk"]]}')
+    return problems
+
+
+class Command(BaseCommand):
+    """
+    Checks and repairs comment trees one tree at a time.
+
+    Methods:
+        add_arguments(parser): Adds the tree selection options.
+        handle(*args, **options): Checks and rebuilds the selected trees.
+        selected_tree_ids(options): Resolves the options to tree ids.
+        repair_tree(tree_id, nodes): Rebuilds a single tree.
+    """
+    help = 'Checks and repairs comment trees one tree at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tree-id', type=int, action='append', default=[],
+            help='Tree id to check, can be given more than once.')
+        parser.add_argument(
+            '--post', help='Slug of a post whose comment threads to check.')
+        parser.add_argument(
+            '--group', help='Slug of a group whose wall threads to check.')
+        parser.add_argument(
+            '--all', action='store_true', help='Check every comment tree.')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report broken trees, do not repair them.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild the selected trees even when they look valid.')
+
+    def handle(self, *args, **options):
+        tree_ids = self.selected_tree_ids(options)
+        broken = 0
+        for tree_id in tree_ids:
+            nodes = list(Comment.objects.filter(tree_id=tree_id).values(
+                'pk', 'parent_id', 'lft', 'rght', 'level'))
+            if not nodes:
+                continue
+            problems = find_tree_problems(nodes)
+            if problems:
+                broken += 1
+                self.stdout.write(
+                    f'Tree {tree_id}: {len(problems)} problem(s), '
+                    f'first: {problems[0]}')
+            if options['check'] or not (problems or options['force']):
+                continue
+            self.repair_tree(tree_id, nodes)
+            self.stdout.write(self.style.SUCCESS(f'Tree {tree_id} rebuilt.'))
+
+        self.stdout.write(
+            f'Checked {len(tree_ids)} tree(s), {broken} broken.')
+
+    def selected_tree_ids(self, options):
+        """
+        Resolves the command options to the tree ids to check.
+
+        Args:
+            options (dict): The parsed command options.
+
+        Returns:
+            list: The sorted tree ids.
+
+        Raises:
+            CommandError: If no trees were selected.
+        """
+        tree_ids = set(options['tree_id'])
+        if options['post']:
+            tree_ids.update(Comment.objects.thread_tree_ids(
+                post__slug=options['post']))
+        if options['group']:
+            tree_ids.update(Comment.objects.thread_tree_ids(
+                group__slug=options['group'], post__isnull=True))
+        if options['all']:
+            tree_ids.update(Comment.objects.values_list(
+                'tree_id', flat=True).distinct())
+        if not (tree_ids or options['post'] or options['group']
+                or options['all']):
+            raise CommandError(
+                'Select trees with --tree-id, --post, --group or --all.')
+        return sorted(tree_ids)
+
+    def repair_tree(self, tree_id, nodes):
+        """
+        Rebuilds a single tree from its parent links.
+
+        Extra root comments that ended up sharing the tree id are first moved
+        to a fresh tree of their own, and replies whose parent lives in
+        another tree are moved into the parent's tree, together with their
+        own replies.
+
+        Args:
+            tree_id (int): The tree to rebuild.
+            nodes (list): The node dicts loaded for the tree.
+        """
+        pks = {node['pk'] for node in nodes}
+        children = defaultdict(list)
+        for node in nodes:
+            children[node['parent_id']].append(node['pk'])
+
+        def subtree_of(pk):
+            subtree = [pk]
+            for node_pk in subtree:
+                subtree.extend(children[node_pk])
+            return subtree
+
+        with transaction.atomic():
+            roots = sorted(node['pk'] for node in nodes
+                           if node['parent_id'] is None)
+            for root_pk in roots[1:]:
+                new_tree_id = Comment.objects._get_next_tree_id()
+                Comment.objects.filter(pk__in=subtree_of(root_pk)).update(
+                    tree_id=new_tree_id)
+                Comment.objects.partial_rebuild(new_tree_id)
+            for node in nodes:
+                if node['parent_id'] is None or node['parent_id'] in pks:
+                    continue
+                parent_tree_id = Comment.objects.filter(
+                    pk=node['parent_id']).values_list('tree_id', flat=True)[0]
+                Comment.objects.filter(pk__in=subtree_of(node['pk'])).update(
+                    tree_id=parent_tree_id)
+                Comment.objects.partial_rebuild(parent_tree_id)
+            Comment.objects.partial_rebuild(tree_id)
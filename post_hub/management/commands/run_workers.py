@@ -0,0 +1,119 @@
+"""
+Management command that runs the workers of the image upload queue.
+
+Each worker takes a batch of due jobs, uploads their images with the
+configured storage client and sets the image fields, then takes the next
+batch, and waits --poll seconds when no job is due. Failed uploads are
+retried with backoff, see post_hub/uploads.py. With --once the workers
+stop as soon as no job is due.
+
+Usage:
+    python manage.py run_workers
+    python manage.py run_workers --workers 4 --batch-size 20
+    python manage.py run_workers --once --retry-failed
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from post_hub.models import UploadJob
+from post_hub.uploads import get_storage_client, run_pending_uploads
+
+
+class Command(BaseCommand):
+    """
+    Runs the workers of the image upload queue.
+
+    Methods:
+        add_arguments(parser): Adds the pool and retry options.
+        handle(*args, **options): Runs the pool of workers.
+        work(stop, options, threaded): Runs the jobs of one worker.
+    """
+    help = 'Runs the workers of the image upload queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Workers run at the same time, each in its own thread.')
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Jobs a worker takes at a time.')
+        parser.add_argument(
+            '--max-attempts', type=int,
+            default=getattr(settings, 'UPLOAD_MAX_ATTEMPTS', 5),
+            help='Attempts of a job before it is marked as failed.')
+        parser.add_argument(
+            '--poll', type=float, default=5,
+            help='Seconds a worker waits when no job is due.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop when no job is due.')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Queue the failed jobs again before starting.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive.')
+        if options['retry_failed']:
+            requeued = UploadJob.objects.filter(
+                status=UploadJob.FAILED).update(
+                    status=UploadJob.QUEUED, attempts=0, last_error='',
+                    run_at=timezone.now(), updated_at=timezone.now())
+            self.stdout.write(f'Queued {requeued} failed uploads again.')
+        stop = threading.Event()
+        if options['workers'] == 1:
+            totals = [self.work(stop, options)]
+        else:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                futures = [pool.submit(self.work, stop, options, True)
+                           for _ in range(options['workers'])]
+                try:
+                    totals = [future.result() for future in futures]
+                except KeyboardInterrupt:
+                    stop.set()
+                    raise
+        self.stdout.write(self.style.SUCCESS(
+            f'Uploaded {sum(done for done, _ in totals)} images, '
+            f'{sum(failed for _, failed in totals)} attempts failed.'))
+# A single worker runs in the command's own thread, so it uses the same
+# database connection as the command.
+
+    def work(self, stop, options, threaded=False):
+        """
+        Runs the due jobs of one worker until it is stopped, or until no job
+        is due with --once.
+
+        Args:
+            stop (Event): Set to stop the worker.
+            options (dict): The command options.
+            threaded (bool): Whether the worker runs in a thread of the pool,
+                        whose database connections are closed at the end.
+
+        Returns:
+            tuple: The number of succeeded and failed uploads.
+        """
+        client = get_storage_client()
+        succeeded = failed = 0
+        try:
+            while not stop.is_set():
+                done, errors = run_pending_uploads(
+                    options['batch_size'], client, options['max_attempts'])
+                succeeded += done
+                failed += errors
+                if done or errors:
+                    self.stdout.write(
+                        f'Uploaded {done} images, {errors} attempts failed.')
+                if options['once']:
+                    break
+                stop.wait(options['poll'])
+        except KeyboardInterrupt:
+            stop.set()
+        finally:
+            if threaded:
+                connections.close_all()
+        return succeeded, failed
@@ -0,0 +1,78 @@
+"""
+Management command that sends the emails of the outbox.
+
+The worker sends the due emails in batches over one connection, then waits
+--poll seconds when no email is due. Failed emails are retried with
+backoff, see post_hub/outbox.py. With --once it stops as soon as no email
+is due.
+
+Usage:
+    python manage.py send_outbox
+    python manage.py send_outbox --batch-size 100 --poll 10
+    python manage.py send_outbox --once --retry-failed
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from post_hub.models import OutboundEmail
+from post_hub.outbox import send_pending_emails
+
+
+class Command(BaseCommand):
+    """
+    Sends the emails of the outbox.
+
+    Methods:
+        add_arguments(parser): Adds the batch and retry options.
+        handle(*args, **options): Sends the due emails until stopped.
+    """
+    help = 'Sends the emails of the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Emails taken at a time.')
+        parser.add_argument(
+            '--max-attempts', type=int,
+            default=getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5),
+            help='Attempts of an email before it is marked as failed.')
+        parser.add_argument(
+            '--poll', type=float, default=5,
+            help='Seconds the worker waits when no email is due.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop when no email is due.')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Queue the failed emails again before starting.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        if options['retry_failed']:
+            requeued = OutboundEmail.objects.filter(
+                status=OutboundEmail.FAILED).update(
+                    status=OutboundEmail.QUEUED, attempts=0, last_error='',
+                    run_at=timezone.now(), updated_at=timezone.now())
+            self.stdout.write(f'Queued {requeued} failed emails again.')
+        sent = failed = 0
+        try:
+            while True:
+                done, errors = send_pending_emails(
+                    options['batch_size'],
+                    max_attempts=options['max_attempts'])
+                sent += done
+                failed += errors
+                if done or errors:
+                    self.stdout.write(
+                        f'Sent {done} emails, {errors} attempts failed.')
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {sent} emails, {failed} attempts failed.'))
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:43
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_vote_counts(apps, schema_editor):
+    Vote = apps.get_model('post_hub', 'Vote')
+
+    for model_name, field in (('Post', 'post'), ('Comment', 'comment')):
+        model = apps.get_model('post_hub', model_name)
+        rows = (Vote.objects.filter(**{f'{field}__isnull': False})
+                .values(f'{field}_id')
+                .annotate(up=Count('id', filter=Q(is_upvote=True)),
+                          down=Count('id', filter=Q(is_upvote=False))))
+        for row in rows.iterator():
+            model.objects.filter(pk=row[f'{field}_id']).update(
+                upvote_count=row['up'], downvote_count=row['down'],
+                score=row['up'] - row['down'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0015_alter_profile_user_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='downvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='upvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='downvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='upvote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_vote_counts, migrations.RunPython.noop),
+    ]
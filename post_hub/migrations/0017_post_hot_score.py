@@ -0,0 +1,72 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:55
+
+from datetime import datetime, timezone
+import math
+
+from django.db import migrations, models
+import django.utils.timezone
+
+EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=timezone.utc)
+DECAY_SECONDS = 45000
+BATCH_SIZE = 500
+
+
+def hot_score(score, created_at):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = (created_at - EPOCH).total_seconds()
+    return round(sign * order + seconds / DECAY_SECONDS, 7)
+# A copy of post_hub.ranking.hot_score as it was when this migration was
+# written, so later changes to the formula don't change this migration.
+
+
+def populate_hot_scores(apps, schema_editor):
+    Post = apps.get_model('post_hub', 'Post')
+
+    batch = []
+    posts = Post.objects.only('pk', 'score', 'created_at')
+    for post in posts.iterator(chunk_size=BATCH_SIZE):
+        post.hot_score = hot_score(post.score, post.created_at)
+        batch.append(post)
+        if len(batch) == BATCH_SIZE:
+            Post.objects.bulk_update(batch, ['hot_score'])
+            batch = []
+    Post.objects.bulk_update(batch, ['hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0016_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='created_at',
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(populate_hot_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-hot_score'], name='post_status_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-score'], name='post_status_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['category', '-hot_score'], name='post_category_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-hot_score'], name='post_group_hot_idx'),
+        ),
+    ]
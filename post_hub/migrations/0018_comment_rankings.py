@@ -0,0 +1,71 @@
+# Generated by Django 4.2.16 on 2026-10-17 18:59
+
+import math
+
+from django.db import migrations, models
+
+WILSON_Z = 1.281551565545
+BATCH_SIZE = 500
+
+
+def wilson_score(upvotes, downvotes):
+    total = upvotes + downvotes
+    if total <= 0:
+        return 0.0
+    ratio = upvotes / total
+    z_squared = WILSON_Z * WILSON_Z
+    return round((ratio + z_squared / (2 * total) - WILSON_Z * math.sqrt(
+        (ratio * (1 - ratio) + z_squared / (4 * total)) / total))
+        / (1 + z_squared / total), 9)
+
+
+def controversy_score(upvotes, downvotes):
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = (downvotes / upvotes if upvotes > downvotes
+               else upvotes / downvotes)
+    return round((upvotes + downvotes) ** balance, 9)
+# Copies of the post_hub.ranking formulas as they were when this migration
+# was written, so later changes to them don't change this migration.
+
+
+def populate_comment_rankings(apps, schema_editor):
+    Comment = apps.get_model('post_hub', 'Comment')
+
+    batch = []
+    comments = Comment.objects.filter(
+        upvote_count__gt=0) | Comment.objects.filter(downvote_count__gt=0)
+    comments = comments.only('pk', 'upvote_count', 'downvote_count')
+    for comment in comments.iterator(chunk_size=BATCH_SIZE):
+        comment.wilson_score = wilson_score(
+            comment.upvote_count, comment.downvote_count)
+        comment.controversy = controversy_score(
+            comment.upvote_count, comment.downvote_count)
+        batch.append(comment)
+        if len(batch) == BATCH_SIZE:
+            Comment.objects.bulk_update(
+                batch, ['wilson_score', 'controversy'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['wilson_score', 'controversy'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0017_post_hot_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='controversy',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='wilson_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(
+            populate_comment_rankings, migrations.RunPython.noop),
+    ]
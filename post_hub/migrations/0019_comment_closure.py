@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0018_comment_rankings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='post_hub.comment')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='post_hub.comment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='comment_closure_depth_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='commentclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='comment_closure_unique'),
+        ),
+    ]
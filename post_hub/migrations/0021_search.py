@@ -0,0 +1,126 @@
+from django.db import migrations
+
+SEARCH_CONFIG = 'english'
+SEARCHABLE = [
+    ('post_hub_category', ['category_name'], [], None),
+    ('post_hub_comment', [], ['content'], '{row}status'),
+    ('post_hub_usergroup', ['name'], ['description'], None),
+    ('post_hub_post', ['title'], ['blurb', 'content'], '{row}status = 1'),
+]
+FTS_TABLE = 'post_hub_search'
+# A copy of the searchable tables and of the SQL of post_hub.search as they
+# were when this migration was written, so later changes to the search
+# backends don't change this migration.
+
+
+def text(columns, row=''):
+    if not columns:
+        return "''"
+    return " || ' ' || ".join(
+        f"coalesce({row}{column}, '')" for column in columns)
+
+
+def vector(title, body, row=''):
+    return (f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+            f"{text(title, row)}), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+            f"{text(body, row)}), 'B')")
+
+
+def postgresql_install(cursor):
+    for table, title, body, condition in SEARCHABLE:
+        columns = ', '.join(title + body)
+        where = ' WHERE ' + condition.format(row='') if condition else ''
+        cursor.execute(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector')
+        cursor.execute(
+            f'CREATE FUNCTION {table}_search() RETURNS trigger '
+            f'LANGUAGE plpgsql AS $$ BEGIN '
+            f'NEW.search_vector := {vector(title, body, "NEW.")}; '
+            f'RETURN NEW; END $$')
+        cursor.execute(
+            f'CREATE TRIGGER {table}_search BEFORE INSERT OR UPDATE '
+            f'OF {columns} ON {table} FOR EACH ROW '
+            f'EXECUTE FUNCTION {table}_search()')
+        cursor.execute(
+            f'UPDATE {table} SET search_vector = {vector(title, body)}')
+        cursor.execute(
+            f'CREATE INDEX {table}_search_idx ON {table} '
+            f'USING gin (search_vector){where}')
+
+
+def postgresql_uninstall(cursor):
+    for table, *_ in SEARCHABLE:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search ON {table}')
+        cursor.execute(f'DROP FUNCTION IF EXISTS {table}_search()')
+        cursor.execute(
+            f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+def sqlite_install(cursor):
+    kinds = len(SEARCHABLE)
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, body, '
+        f"tokenize = 'porter unicode61 remove_diacritics 2')")
+    for code, (table, title, body, condition) in enumerate(SEARCHABLE):
+        columns = ', '.join(title + body)
+
+        def insert(row, where):
+            return (f'INSERT INTO {FTS_TABLE} (rowid, title, body) '
+                    f'SELECT {row}id * {kinds} + {code}, '
+                    f'{text(title, row)}, {text(body, row)}{where}')
+
+        def when(row):
+            return ' WHERE ' + condition.format(row=row) if condition else ''
+
+        delete = (f'DELETE FROM {FTS_TABLE} '
+                  f'WHERE rowid = OLD.id * {kinds} + {code};')
+        cursor.execute(
+            f'CREATE TRIGGER {table}_search_insert AFTER INSERT ON '
+            f'{table} BEGIN {insert("NEW.", when("NEW."))}; END')
+        cursor.execute(
+            f'CREATE TRIGGER {table}_search_update AFTER UPDATE OF '
+            f'{columns}{", status" if condition else ""} ON {table} '
+            f'BEGIN {delete} {insert("NEW.", when("NEW."))}; END')
+        cursor.execute(
+            f'CREATE TRIGGER {table}_search_delete AFTER DELETE ON '
+            f'{table} BEGIN {delete} END')
+        cursor.execute(insert('', f' FROM {table}{when("")}'))
+
+
+def sqlite_uninstall(cursor):
+    for table, *_ in SEARCHABLE:
+        for event in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_{event}')
+    cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+BACKENDS = {
+    'postgresql': (postgresql_install, postgresql_uninstall),
+    'sqlite': (sqlite_install, sqlite_uninstall),
+}
+
+
+def install(apps, schema_editor):
+    backend = BACKENDS.get(schema_editor.connection.vendor)
+    if backend:
+        with schema_editor.connection.cursor() as cursor:
+            backend[0](cursor)
+
+
+def uninstall(apps, schema_editor):
+    backend = BACKENDS.get(schema_editor.connection.vendor)
+    if backend:
+        with schema_editor.connection.cursor() as cursor:
+            backend[1](cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0020_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-17 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0023_outbox'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='uploadjob',
+            old_name='path',
+            new_name='name',
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='data',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post_hub', '0024_upload_job_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentTreeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_tree_id', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+    ]
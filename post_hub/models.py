@@ -9,10 +9,27 @@ Models:
           status, author, category, group, and timestamps.
     Comment: Represents a comment on a post with a parent comment, image, and
              a tree structure for nested comments.
+    CommentClosure: Represents a link between a comment and one of its
+                    ancestors, used by the closure table tree backend.
+    CommentTreeCounter: Holds the next tree id of the closure table tree
+                        backend.
     Vote: Represents a vote on a post or comment with a user, upvote status,
           and relationships to posts and comments.
     Profile: Represents a user profile with a one-to-one relationship
             to the User model, including bio, location, image, privacy.
+    UploadJob: Represents an image upload waiting for a worker, with the
+               row and field it is for, its attempts and next run time.
+    OutboundEmail: Represents an email waiting in the outbox, with its
+                   recipients, its attempts and next run time.
+
+Functions:
+    fields_except: Returns the fields a save writes, leaving some out.
+
+Managers:
+    UserGroupQuerySet: Query set for groups with the group index data.
+    PostQuerySet: Query set for posts with the listing sort modes.
+    CommentManager: Tree manager for comments that inserts new comments
+                    into their own tree without rebuilding the others.
 
 Signals:
     add_slug_to_group: Automatically generates a slug for a UserGroup
@@ -26,21 +43,72 @@ Signals:
     save_user_profile: Saves the Profile instance when a User
                     instance is saved.
 """
-import random
-
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.functions import Coalesce
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import slugify
 
 from cloudinary.models import CloudinaryField
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
 
+from .ranking import TOP_WINDOWS, hot_score
+from .tree_backends import get_tree_backend
+
 
 STATUS = ((0, "Blocked"), (1, "Approved"))
 
 
+def fields_except(instance, excluded):
+    """
+    Returns the names of the fields of an instance that a save writes,
+    leaving out some of them.
+
+    Args:
+        instance (Model): The instance.
+        excluded (tuple): The names of the fields left out.
+
+    Returns:
+        list: The names of the other concrete fields.
+    """
+    return [field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in excluded]
+
+
+class UserGroupQuerySet(models.QuerySet):
+    """
+    Query set for user groups.
+
+    Methods:
+        for_index(): Annotates what the group index shows of each group.
+    """
+    def for_index(self):
+        """
+        Annotates each group with its number of members and the id of its
+        latest approved post, in the same query as the groups.
+
+        Returns:
+            QuerySet: The groups, each with member_count and latest_post_id
+                    attributes.
+        """
+        members = UserGroup.members.through.objects.filter(
+            usergroup=models.OuterRef('pk')).order_by().values(
+                'usergroup').annotate(count=models.Count('pk')).values('count')
+        latest = Post.objects.filter(
+            group=models.OuterRef('pk'), status=1).order_by(
+                '-created_at', '-id').values('pk')[:1]
+        return self.annotate(
+            member_count=Coalesce(models.Subquery(members), 0),
+            latest_post_id=models.Subquery(latest))
+# Each subquery is a seek on an index, the membership table's group column
+# and post_group_new_idx, so the cost of a page of groups does not depend on
+# how many posts or members they have.
+
+
 class UserGroup(models.Model):
     """
     Represents a user group with a name, slug, image, description,
@@ -56,7 +124,7 @@ class UserGroup(models.Model):
         admin (ForeignKey): The admin of the group, linked to the User model.
         members (ManyToManyField): Members of the group, linked to User model.
         admin_message (TextField): Message from admin to the group members.
-        objects (Manager): The default manager for the model.
+        objects (UserGroupQuerySet): The default manager for the model.
     """
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -73,7 +141,7 @@ class UserGroup(models.Model):
     members = models.ManyToManyField(
         User, related_name='groups_members', blank=True)
     admin_message = models.TextField(blank=True)
-    objects = models.Manager()
+    objects = UserGroupQuerySet.as_manager()
 # Group model has a many to many relationship with the User model,
 # this is so groups can have multiple members, and users can be
 # in multiple groups. The admin field is a foreign key to the User model,
@@ -118,21 +186,6 @@ class Category(models.Model):
     def __str__(self):
         return str(self.category_name)
 
-    @staticmethod
-    def get_random_categories(count=5):
-        """
-        Returns a list of random categories.
-
-        Args:
-            count (int): The number of random categories to return.
-
-        Returns:
-            list: A list of random categories.
-        """
-        categories = list(Category.objects.all())
-        random.shuffle(categories)
-        return categories[:count]
-
 
 @receiver(pre_save, sender=Category)
 def add_slug_to_category(sender, instance, *_args, **_kwargs):
@@ -149,6 +202,62 @@ def add_slug_to_category(sender, instance, *_args, **_kwargs):
         instance.slug = slugify(instance.category_name)
 
 
+class PostQuerySet(models.QuerySet):
+    """
+    Query set for posts.
+
+    Methods:
+        ranked(sort, window): Orders the posts by a listing sort mode.
+        for_listing(): Loads what a post card shows in one query.
+    """
+    def ranked(self, sort='new', window='all'):
+        """
+        Orders the posts by a listing sort mode.
+
+        Every mode orders by stored, indexed columns: hot by the stored hot
+        ranking, top by the stored score within the window and new by the
+        creation date.
+
+        Args:
+            sort (str): 'hot', 'top' or 'new'.
+            window (str): For top, how far back to look, one of the keys
+                        of ranking.TOP_WINDOWS.
+
+        Returns:
+            QuerySet: The ordered posts.
+        """
+        if sort == 'hot':
+            return self.order_by('-hot_score', '-id')
+        if sort == 'top':
+            posts = self
+            if TOP_WINDOWS.get(window):
+                posts = posts.filter(
+                    created_at__gte=timezone.now() - TOP_WINDOWS[window])
+            return posts.order_by('-score', '-created_at')
+        return self.order_by('-created_at')
+
+    def for_listing(self):
+        """
+        Loads the posts with everything a post card shows, in one query.
+
+        The author, category and group are joined, the number of approved
+        comments is counted by a subquery, and the content, which cards do
+        not show, is left out. The vote counts are stored on the post, see
+        Post.total_upvotes.
+
+        Returns:
+            QuerySet: The posts, each with a comment_count attribute.
+        """
+        comments = Comment.objects.filter(
+            post=models.OuterRef('pk'), status=True).order_by().values(
+                'post').annotate(count=models.Count('pk')).values('count')
+        return self.select_related('author', 'category', 'group').defer(
+            'content').annotate(comment_count=Coalesce(
+                models.Subquery(comments), 0))
+# A subquery per post is cheaper than joining every comment and grouping,
+# and it only runs for the posts on the page.
+
+
 class Post(models.Model):
     """
     Represents a post with a title, slug, blurb, banner image, content,
@@ -167,7 +276,13 @@ class Post(models.Model):
                         linked to the UserGroup model.
         created_at (DateTimeField): Timestamp when the post was created.
         updated_at (DateTimeField): Timestamp when the post was last updated.
-        objects (Manager): The default manager for the model.
+        upvote_count (IntegerField): Stored number of upvotes on the post.
+        downvote_count (IntegerField): Stored number of downvotes on the post.
+        score (IntegerField): Stored upvotes minus downvotes.
+        hot_score (FloatField): Stored hot ranking, see ranking.hot_score.
+        objects (PostQuerySet): The default manager for the model.
+        VOTE_COLUMNS (tuple): The columns kept up to date by the vote code,
+                        which only an insert writes.
     """
     title = models.CharField(max_length=100)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -185,9 +300,40 @@ class Post(models.Model):
     group = models.ForeignKey(UserGroup, on_delete=models.CASCADE,
                               related_name='group_posts',
                               null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
-    objects = models.Manager()
+    upvote_count = models.IntegerField(default=0)
+    downvote_count = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+    hot_score = models.FloatField(default=0)
+    objects = PostQuerySet.as_manager()
+
+    VOTE_COLUMNS = ('upvote_count', 'downvote_count', 'score', 'hot_score')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-hot_score'],
+                         name='post_status_hot_idx'),
+            models.Index(fields=['status', '-score'],
+                         name='post_status_score_idx'),
+            models.Index(fields=['category', '-hot_score'],
+                         name='post_category_hot_idx'),
+            models.Index(fields=['group', '-hot_score'],
+                         name='post_group_hot_idx'),
+            models.Index(fields=['-created_at', '-id'],
+                         condition=models.Q(status=1),
+                         name='post_live_new_idx'),
+            models.Index(fields=['category', 'status', '-created_at'],
+                         name='post_category_new_idx'),
+            models.Index(fields=['group', 'status', '-created_at'],
+                         name='post_group_new_idx'),
+            models.Index(fields=['author', '-created_at'],
+                         name='post_author_new_idx'),
+        ]
+# Each listing filters and orders by the leading columns of one index: the
+# home page by the partial index over approved posts, the category and group
+# pages by their own, and profiles by author. The new sort of every listing
+# reads its pages in index order, without sorting.
 # Post model has a many to one relationship with the User and Category models,
 # this is to store the posts of the users in the categories.
 # Each Post belongs to a single User and Category.
@@ -197,7 +343,29 @@ class Post(models.Model):
     def __str__(self):
         return f"{self.title} by {self.author}"
 
-    # pylint: disable=no-member
+    def save(self, *args, **kwargs):
+        """
+        Saves the post, storing the hot ranking of a new post.
+
+        A stored post is saved without its VOTE_COLUMNS, which the vote code
+        updates with F() expressions, so saving a post loaded before a vote
+        does not undo the vote.
+
+        Args:
+            *args: Positional arguments passed to Model.save.
+            **kwargs: Keyword arguments passed to Model.save.
+        """
+        if self._state.adding:
+            self.created_at = self.created_at or timezone.now()
+            self.hot_score = hot_score(self.score, self.created_at)
+        elif kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = fields_except(self, self.VOTE_COLUMNS)
+        super().save(*args, **kwargs)
+# The hot ranking only changes with the score, which the vote code keeps
+# up to date, so it is computed on insert and never per request. A new
+# post takes its created_at before the ranking is computed, so both come
+# from the same time.
+
     def total_upvotes(self):
         """
         Returns the total number of upvotes for the post.
@@ -205,14 +373,10 @@ class Post(models.Model):
         Returns:
             Integer: The total number of upvotes for the post.
         """
-        return self.votes.filter(is_upvote=True).count()
-    # Pylint false positive with 'self.votes',
-    # this works as its a related model.
-
-# I learned that count() is a method that returns
-# the number of items in a queryset from
-# https://docs.djangoproject.com/en/5.1/ref/models/querysets/#count
-# "votes" is the related name of the ForeignKey in the Vote model.
+        return self.upvote_count
+# The counts are stored on the post and kept up to date by the vote view,
+# so listing pages can show them without counting the Vote table. The
+# reconcile_votes management command recounts them if they ever drift.
 
     def total_downvotes(self):
         """
@@ -221,8 +385,7 @@ class Post(models.Model):
         Returns:
             Integer: The total number of downvotes for the post.
         """
-        return self.votes.filter(is_upvote=False).count()
-    # pylint: disable=no-member
+        return self.downvote_count
 # I dont include a is_downvote field in the Vote model as I can
 # determine if a vote is a downvote by checking if is_upvote is False.
 
@@ -252,6 +415,83 @@ def add_slug_to_post(sender, instance, *_args, **_kwargs):
 # https://stackoverflow.com/questions/8170704/execute-code-on-model-creation-in-django#:~:text=You%20can%20use%20django%20signals%20%27%20post_save%3A%20%23,MyModel%28models.Model%29%3A%20pass%20def%20my_model_post_save%28sender%2C%20instance%2C%20created%2C%20%2Aargs%2C%20%2A%2Akwargs%29%3A
 
 
+class CommentManager(TreeManager):
+    """
+    Tree manager for the Comment model.
+
+    Every top level comment starts its own tree (tree_id), so a new thread is
+    appended as the last tree and a reply only shifts the lft/rght values of
+    the thread it belongs to. No other thread is touched by an insert.
+
+    Methods:
+        next_tree_id(): Takes the tree id of a new top level comment.
+        prepare_insert(comment): Sets the tree fields of an unsaved comment.
+        thread_tree_ids(**filters): Returns the tree ids of the threads
+                                matching the given filters.
+    """
+    def next_tree_id(self):
+        """
+        Takes the tree id of a new top level comment from the
+        CommentTreeCounter row, which stays locked until the transaction
+        ends, so two concurrent threads never get the same tree id.
+
+        Returns:
+            int: The tree id, above every stored and every taken tree id.
+        """
+        with transaction.atomic():
+            counter = CommentTreeCounter.objects.select_for_update()
+            row = counter.filter(pk=1).first()
+            if row is None:
+                CommentTreeCounter.objects.bulk_create(
+                    [CommentTreeCounter(pk=1)], ignore_conflicts=True)
+                row = counter.get(pk=1)
+            highest = self.aggregate(
+                highest=models.Max('tree_id'))['highest'] or 0
+            tree_id = max(row.next_tree_id, highest + 1)
+            counter.filter(pk=1).update(next_tree_id=tree_id + 1)
+        return tree_id
+# The maximum covers trees stored before the counter existed. A tree id
+# taken by a comment that is not saved yet is only known to the counter.
+
+    def _get_next_tree_id(self):
+        return self.next_tree_id()
+# django-mptt takes the tree ids of new roots from this method, so its
+# inserts and moves use the locked counter too.
+
+    def prepare_insert(self, comment):
+        """
+        Sets the tree fields of an unsaved comment so it becomes the last
+        reply of its parent, or the last tree when it has no parent.
+
+        Must be called inside a transaction, the parent row is locked so
+        concurrent replies to the same thread are applied one after another.
+
+        Args:
+            comment (Comment): The comment that is about to be inserted.
+        """
+        if comment.parent_id is None:
+            self.insert_node(comment, None, allow_existing_pk=True)
+            return
+        parent = self.select_for_update().get(pk=comment.parent_id)
+        self.insert_node(comment, parent, position='last-child',
+                         allow_existing_pk=True, refresh_target=False)
+# Replies are always newer than their siblings, so adding them as the last
+# child keeps the created_at order without looking the siblings up.
+
+    def thread_tree_ids(self, **filters):
+        """
+        Returns the tree ids of the threads matching the given filters.
+
+        Args:
+            **filters: Lookups applied to the root comments, e.g. post=post.
+
+        Returns:
+            list: The sorted tree ids.
+        """
+        return sorted(set(self.filter(parent__isnull=True, **filters)
+                          .values_list('tree_id', flat=True)))
+
+
 class Comment(MPTTModel):
     """
     Represents a comment on a post with a parent comment, image, and
@@ -269,7 +509,16 @@ class Comment(MPTTModel):
                         linked to the UserGroup model.
         parent (TreeForeignKey): Parent comment, allowing for nested comments.
         image (CloudinaryField): The image associated with the comment.
-        objects (Manager): The default manager for the model.
+        upvote_count (IntegerField): Stored number of upvotes on the comment.
+        downvote_count (IntegerField): Stored number of downvotes.
+        score (IntegerField): Stored upvotes minus downvotes.
+        wilson_score (FloatField): Stored best ranking, see
+                                ranking.wilson_score.
+        controversy (FloatField): Stored controversial ranking, see
+                                ranking.controversy_score.
+        objects (CommentManager): The default tree manager for the model.
+        VOTE_COLUMNS (tuple): The columns kept up to date by the vote code,
+                        which only an insert writes.
     """
     post = models.ForeignKey(
         Post, on_delete=models.CASCADE, related_name='comments',
@@ -286,6 +535,15 @@ class Comment(MPTTModel):
     parent = TreeForeignKey('self', on_delete=models.CASCADE,
                             null=True, blank=True, related_name='children')
     image = CloudinaryField('image', blank=True, null=True)
+    upvote_count = models.IntegerField(default=0)
+    downvote_count = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+    wilson_score = models.FloatField(default=0)
+    controversy = models.FloatField(default=0)
+    objects = CommentManager()
+
+    VOTE_COLUMNS = ('upvote_count', 'downvote_count', 'score',
+                    'wilson_score', 'controversy')
 # The parent field references the comment model iteself, the related
 # name allowes to access child comments, MPTTModel is used to create a tree
 # structure for the comments. This allows for easy retrieval of the comments
@@ -304,30 +562,199 @@ class Comment(MPTTModel):
         """
         order_insertion_by = ['created_at']
 
+    class Meta:
+        """
+        Meta options for the Comment model.
+
+        Attributes:
+            indexes (list): Indexes used to list the top level comments of a
+                        post in the best and new sorts, the threads of a
+                        group wall and the comments of a profile.
+        """
+        indexes = [
+            models.Index(fields=['post', 'level', '-wilson_score',
+                                 'created_at'],
+                         condition=models.Q(status=True),
+                         name='comment_post_best_idx'),
+            models.Index(fields=['post', 'level', '-created_at'],
+                         condition=models.Q(status=True),
+                         name='comment_post_new_idx'),
+            models.Index(fields=['group', 'level', '-created_at'],
+                         condition=models.Q(post__isnull=True),
+                         name='comment_wall_idx'),
+            models.Index(fields=['author', 'created_at'],
+                         name='comment_author_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the comment, inserting new comments into their tree
+        incrementally instead of rebuilding every tree. A stored comment is
+        saved without its VOTE_COLUMNS, as for Post.save.
+
+        Args:
+            *args: Positional arguments passed to MPTTModel.save.
+            **kwargs: Keyword arguments passed to MPTTModel.save.
+        """
+        if (self._state.adding and self.lft is None
+                and type(self)._mptt_updates_enabled):
+            backend = get_tree_backend()
+            with transaction.atomic():
+                backend.prepare_insert(self)
+                super().save(*args, **kwargs)
+                backend.after_insert(self)
+            return
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = fields_except(self, self.VOTE_COLUMNS)
+        super().save(*args, **kwargs)
+# New comments are placed in their tree by the backend selected by the
+# COMMENT_TREE_BACKEND setting, see post_hub/tree_backends.py.
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the comment and its replies.
+
+        The lft/rght gap left in the thread is only closed when the tree
+        backend keeps nested sets, other backends delete the rows as any
+        other model would.
+
+        Args:
+            *args: Positional arguments passed to Model.delete.
+            **kwargs: Keyword arguments passed to Model.delete.
+        """
+        if get_tree_backend().nested_sets:
+            return super().delete(*args, **kwargs)
+        return models.Model.delete(self, *args, **kwargs)
+
+    def get_descendants(self, include_self=False):
+        """
+        Returns the replies below the comment, at any level.
+
+        Args:
+            include_self (bool): Whether to include the comment itself.
+
+        Returns:
+            QuerySet: The replies.
+        """
+        return get_tree_backend().descendants(self, include_self=include_self)
+
+    def get_ancestors(self, ascending=False, include_self=False):
+        """
+        Returns the comments this comment replies to, up to its thread's
+        top level comment.
+
+        Args:
+            ascending (bool): Whether to order them from the parent up.
+            include_self (bool): Whether to include the comment itself.
+
+        Returns:
+            QuerySet: The ancestors.
+        """
+        return get_tree_backend().ancestors(
+            self, ascending=ascending, include_self=include_self)
+
+    def get_descendant_count(self):
+        """
+        Returns the number of replies below the comment, at any level.
+
+        Returns:
+            Integer: The number of replies.
+        """
+        return get_tree_backend().descendant_count(self)
+
+    def is_leaf_node(self):
+        """
+        Returns whether the comment has no replies.
+
+        Returns:
+            Boolean: True if the comment has no replies.
+        """
+        return not self.get_descendant_count()
+
     def total_upvotes(self):
         """
-        Returns the total number of upvotes for the post.
+        Returns the total number of upvotes for the comment.
 
         Returns:
-            Integer: The total number of upvotes for the post.
+            Integer: The total number of upvotes for the comment.
         """
-        return self.votes.filter(is_upvote=True).count()
-    # Pylint false positive with 'self.votes',
-    # this works as its a related model.
+        return self.upvote_count
 
     def total_downvotes(self):
         """
-        Returns the total number of downvotes for the post.
+        Returns the total number of downvotes for the comment.
 
         Returns:
-            Integer: The total number of downvotes for the post.
+            Integer: The total number of downvotes for the comment.
         """
-        return self.votes.filter(is_upvote=False).count()
+        return self.downvote_count
 
     def __str__(self):
         return f'Comment by {self.author} on {self.post}'
 
 
+class CommentClosure(models.Model):
+    """
+    Represents a link between a comment and one of its ancestors, used by
+    the closure table tree backend.
+
+    Attributes:
+        ancestor (ForeignKey): The ancestor comment.
+        descendant (ForeignKey): The comment below it.
+        depth (PositiveSmallIntegerField): The number of levels between the
+                        two comments, 0 for a comment's link to itself.
+        objects (Manager): The default manager for the model.
+    """
+    ancestor = models.ForeignKey(
+        Comment, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(
+        Comment, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+    objects = models.Manager()
+# Every comment has one link to itself and one to each of its ancestors, so
+# a reply inserts a few rows and never updates the rows of its thread.
+
+    class Meta:
+        """
+        Meta options for the CommentClosure model.
+
+        Attributes:
+            constraints (list): Each pair of comments is linked once.
+            indexes (list): Index used to find the replies of a comment to
+                        a given depth.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'],
+                                    name='comment_closure_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth'],
+                         name='comment_closure_depth_idx'),
+        ]
+
+    def __str__(self):
+        return f'Comment {self.ancestor_id} > {self.descendant_id}'
+
+
+class CommentTreeCounter(models.Model):
+    """
+    Holds the next tree id of the comment trees, see
+    CommentManager.next_tree_id.
+
+    Attributes:
+        next_tree_id (PositiveIntegerField): The tree_id of the next top
+                        level comment.
+        objects (Manager): The default manager for the model.
+    """
+    next_tree_id = models.PositiveIntegerField(default=1)
+    objects = models.Manager()
+# The table holds a single row, which a new top level comment locks while it
+# takes its tree_id, so two threads never get the same one.
+
+    def __str__(self):
+        return f'Next tree {self.next_tree_id}'
+
+
 class Vote(models.Model):
     """
     Represents a vote on a post or comment with a user and upvote status.
@@ -431,6 +858,127 @@ class Profile(models.Model):
     # All these methods are pylint false positives, they work as intended.
 
 
+class UploadJob(models.Model):
+    """
+    Represents an image upload waiting for a worker, see post_hub/uploads.py.
+
+    Attributes:
+        content_type (ForeignKey): The model of the row the image belongs to.
+        object_id (PositiveBigIntegerField): The primary key of the row.
+        field_name (CharField): The image field set when the upload finishes.
+        name (CharField): The file name the image is uploaded under.
+        data (BinaryField): The bytes of the image.
+        options (JSONField): The options passed to the storage client.
+        status (PositiveSmallIntegerField): Whether the job is queued,
+                        running or failed.
+        attempts (PositiveSmallIntegerField): The number of times a worker
+                        took the job.
+        run_at (DateTimeField): When the job is next taken, or when the
+                        worker running it is considered gone.
+        claimed_by (CharField): The token of the worker running the job.
+        last_error (TextField): The error of the last failed attempt.
+        created_at (DateTimeField): When the job was queued.
+        updated_at (DateTimeField): When the job last changed.
+        objects (Manager): The default manager for the model.
+    """
+    QUEUED, RUNNING, FAILED = 0, 1, 2
+    STATUSES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed'))
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    field_name = models.CharField(max_length=50)
+    name = models.CharField(max_length=255)
+    data = models.BinaryField()
+    options = models.JSONField(default=dict)
+    status = models.PositiveSmallIntegerField(
+        choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+# A finished job is deleted, so the table only holds the uploads still
+# waiting and the ones that ran out of attempts. The image is stored in the
+# row because the web processes and the workers may not share a disk.
+
+    class Meta:
+        """
+        Meta options for the UploadJob model.
+
+        Attributes:
+            indexes (list): Indexes used by the workers to take the jobs
+                        that are due, and to find the jobs of a row.
+        """
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='upload_job_due_idx'),
+            models.Index(fields=['content_type', 'object_id', 'field_name'],
+                         name='upload_job_target_idx'),
+        ]
+
+    def __str__(self):
+        return f'Upload of {self.name} to {self.field_name}'
+
+
+class OutboundEmail(models.Model):
+    """
+    Represents an email waiting in the outbox, see post_hub/outbox.py.
+
+    Attributes:
+        subject (TextField): The subject of the email.
+        body (TextField): The text of the email.
+        from_email (CharField): The sender of the email.
+        to (JSONField): The list of recipients.
+        status (PositiveSmallIntegerField): Whether the email is queued,
+                        being sent or failed.
+        attempts (PositiveSmallIntegerField): The number of times a worker
+                        took the email.
+        run_at (DateTimeField): When the email is next taken, or when the
+                        worker sending it is considered gone.
+        claimed_by (CharField): The token of the worker sending the email.
+        last_error (TextField): The error of the last failed attempt.
+        created_at (DateTimeField): When the email was queued.
+        updated_at (DateTimeField): When the email last changed.
+        objects (Manager): The default manager for the model.
+    """
+    QUEUED, SENDING, FAILED = 0, 1, 2
+    STATUSES = ((QUEUED, 'Queued'), (SENDING, 'Sending'), (FAILED, 'Failed'))
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.PositiveSmallIntegerField(
+        choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+# A sent email is deleted, so the table only holds the emails still
+# waiting and the ones that ran out of attempts.
+
+    class Meta:
+        """
+        Meta options for the OutboundEmail model.
+
+        Attributes:
+            indexes (list): Index used by the workers to take the emails
+                        that are due.
+        """
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Email to {", ".join(self.to)}: {self.subject}'
+
+
 @receiver(post_save, sender=User)
 # I learned that signals can be used to perform actions when
 # certain events occur, for this case, I used the post_save signal,
@@ -0,0 +1,148 @@
+"""
+This module contains the outbox of the emails sent by the site.
+
+The views no longer talk to the SMTP server while the request waits.
+queue_email stores the email as an OutboundEmail row, and the send_outbox
+management command sends the due emails in batches over one connection,
+which stays open until no email is due.
+
+A worker takes emails with a conditional UPDATE, so two workers never send
+the same email, and holds them for OUTBOX_LEASE_SECONDS. An email whose
+worker died is taken again once its lease ran out, so an email is sent at
+least once. A failed email is retried after OUTBOX_RETRY_SECONDS, doubled
+on each attempt, until it has been tried OUTBOX_MAX_ATTEMPTS times. It is
+then marked as failed, and can be queued again with send_outbox
+--retry-failed.
+
+Settings:
+    OUTBOX_MAX_ATTEMPTS: The number of attempts of an email, 5 by default.
+    OUTBOX_RETRY_SECONDS: The delay before the first retry, 60 by default.
+    OUTBOX_LEASE_SECONDS: How long a worker holds an email, 300 by default.
+
+Functions:
+    queue_email: Stores an email in the outbox.
+    claim_emails: Takes the due emails for a worker.
+    send_pending_emails: Sends the due emails until none are left.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+MAX_RETRY_SECONDS = 3600
+
+
+def _setting(name, default):
+    return getattr(settings, f'OUTBOX_{name}', default)
+
+
+def queue_email(subject, body, from_email, to):
+    """
+    Stores an email in the outbox, to be sent by a worker.
+
+    Args:
+        subject (str): The subject of the email.
+        body (str): The text of the email.
+        from_email (str): The sender of the email.
+        to (list): The recipients of the email.
+
+    Returns:
+        OutboundEmail: The queued email.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject, body=body, from_email=from_email, to=list(to))
+
+
+def claim_emails(limit):
+    """
+    Takes the emails that are due, or whose worker's lease ran out, for
+    this worker.
+
+    Args:
+        limit (int): The largest number of emails taken.
+
+    Returns:
+        list: The taken emails, with the token of this claim in claimed_by.
+    """
+    now = timezone.now()
+    due = OutboundEmail.objects.filter(
+        status__in=(OutboundEmail.QUEUED, OutboundEmail.SENDING),
+        run_at__lte=now)
+    ids = list(due.order_by('run_at').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    due.filter(pk__in=ids).update(
+        status=OutboundEmail.SENDING, claimed_by=token,
+        attempts=F('attempts') + 1, updated_at=now,
+        run_at=now + timedelta(seconds=_setting('LEASE_SECONDS', 300)))
+    return list(OutboundEmail.objects.filter(
+        claimed_by=token).order_by('run_at'))
+# The UPDATE repeats the conditions of the SELECT, so of two workers that
+# selected the same emails only the first one to update a row takes it.
+
+
+def _send(email, connection, max_attempts):
+    held = OutboundEmail.objects.filter(
+        pk=email.pk, status=OutboundEmail.SENDING,
+        claimed_by=email.claimed_by)
+    try:
+        connection.open()
+        connection.send_messages([EmailMessage(
+            email.subject, email.body, email.from_email, email.to)])
+    except Exception as error:
+        connection.close()
+        now = timezone.now()
+        if email.attempts >= max_attempts:
+            held.update(status=OutboundEmail.FAILED, claimed_by='',
+                        last_error=repr(error), updated_at=now)
+        else:
+            delay = min(_setting('RETRY_SECONDS', 60) * 2 ** (
+                email.attempts - 1), MAX_RETRY_SECONDS)
+            held.update(status=OutboundEmail.QUEUED, claimed_by='',
+                        last_error=repr(error), updated_at=now,
+                        run_at=now + timedelta(seconds=delay))
+        return False
+    held.delete()
+    return True
+# The connection is closed after an error, so the next email opens a new
+# one instead of reusing a connection the server dropped.
+
+
+def send_pending_emails(batch_size=50, connection=None, max_attempts=None):
+    """
+    Sends the due emails, a batch at a time, over one connection until none
+    are left, then closes the connection.
+
+    Args:
+        batch_size (int): The number of emails taken at a time.
+        connection (BaseEmailBackend): The email connection, by default a
+                                    new connection of EMAIL_BACKEND.
+        max_attempts (int): The number of attempts of an email, by default
+                        OUTBOX_MAX_ATTEMPTS.
+
+    Returns:
+        tuple: The number of sent and failed emails.
+    """
+    connection = connection or get_connection(fail_silently=False)
+    max_attempts = max_attempts or _setting('MAX_ATTEMPTS', 5)
+    sent = failed = 0
+    try:
+        while True:
+            emails = claim_emails(batch_size)
+            if not emails:
+                return sent, failed
+            for email in emails:
+                if _send(email, connection, max_attempts):
+                    sent += 1
+                else:
+                    failed += 1
+    finally:
+        connection.close()
+# The SMTP backend only closes the connections it opened itself, so the
+# connection opened by _send stays open for the rest of the emails.
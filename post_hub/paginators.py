@@ -0,0 +1,140 @@
+"""
+This module contains the paginator used where pages stay numbered.
+
+Django's Paginator runs an exact COUNT(*) on every request to number the
+pages, which reads every matching row and comes to dominate the page time
+of a table with millions of rows. EstimatedCountPaginator asks the database
+planner for its row estimate first, and only counts exactly when the
+estimate is below a threshold. Large exact counts are cached for a short
+while, so refreshing a page does not count again.
+
+Estimates are only read on PostgreSQL, from pg_class.reltuples for a whole
+table and from the EXPLAIN row estimate for a filtered query. On other
+databases the count is always exact, and cached when large.
+
+An estimate can be off by a few percent, so the last page may come out
+empty or a few rows may be left off it. That is the trade made by every
+large site that shows page numbers.
+
+Settings:
+    ESTIMATED_COUNT_THRESHOLD: The estimated row count from which the
+                            estimate is used, 1,000,000 by default.
+    COUNT_CACHE_SECONDS: How long exact counts are cached, 60 by default.
+
+Classes:
+    EstimatedCountPaginator: A Paginator that estimates large counts.
+
+Functions:
+    estimate_count: Returns the planner's row estimate of a queryset.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    Returns the planner's estimate of the number of rows of a queryset.
+
+    Args:
+        queryset (QuerySet): The rows to estimate.
+
+    Returns:
+        int: The estimated number of rows, or None if the database gives
+            no estimate.
+    """
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where and not queryset.query.distinct:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return int(row[0])
+# reltuples is -1 until the table is first analyzed, in which case the
+# planner is asked instead.
+        try:
+            sql, params = queryset.query.get_compiler(
+                queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that uses the planner's row estimate for large counts.
+
+    Attributes:
+        cached_count_min (int): Exact counts below this are not cached, as
+                            they are cheap and should stay exact while
+                            rows are added.
+
+    Methods:
+        count: The estimated or exact number of rows.
+        estimate(): Returns the planner's row estimate.
+        exact_count(): Returns the exact number of rows, cached when large.
+    """
+    cached_count_min = 10_000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is not None and estimate >= getattr(
+                settings, 'ESTIMATED_COUNT_THRESHOLD', 1_000_000):
+            return estimate
+        return self.exact_count()
+
+    def estimate(self):
+        """
+        Returns the planner's row estimate of the paginated rows.
+
+        Returns:
+            int: The estimate, or None.
+        """
+        return estimate_count(self.object_list)
+
+    def exact_count(self):
+        """
+        Returns the exact number of rows, read from the cache when a large
+        count of the same query was made recently.
+
+        Returns:
+            int: The number of rows.
+        """
+        key = self._cache_key()
+        count = cache.get(key) if key else None
+        if count is None:
+            count = Paginator.count.func(self)
+            if key and count >= self.cached_count_min:
+                cache.set(key, count,
+                          getattr(settings, 'COUNT_CACHE_SECONDS', 60))
+        return count
+
+    def _cache_key(self):
+        if not isinstance(self.object_list, QuerySet):
+            return None
+        try:
+            sql, params = self.object_list.query.get_compiler(
+                self.object_list.db).as_sql()
+        except EmptyResultSet:
+            return None
+        digest = hashlib.md5(
+            f'{self.object_list.db}:{sql}:{params!r}'.encode()).hexdigest()
+        return f'post_hub:count:{digest}'
@@ -0,0 +1,535 @@
+"""
+This module contains the full-text search of posts, comments, groups and
+categories.
+
+Each searchable row gets a title, weighted highest, and a body. The search
+backend is chosen by the database vendor:
+
+- PostgresSearchBackend adds a search_vector tsvector column with a GIN
+  index to each searchable table. A trigger fills the column when a row is
+  inserted or its text columns are updated, so vote counter and tree
+  updates do not re-parse the text. Hits are ranked with ts_rank.
+- SQLiteSearchBackend keeps an FTS5 table, so tests and development work
+  without PostgreSQL. Triggers on the searchable tables copy their text
+  into it, keyed by a rowid made from the row's primary key and kind, and
+  hits are ranked with bm25. The FTS5 table also holds the HTML tags of
+  post content, which PostgreSQL's parser skips.
+
+The search tables and triggers are created by a migration. Django rebuilds
+an SQLite table when one of its columns is altered, which drops the
+triggers of that table, so run the rebuild_search_index management command
+after such a migration.
+
+Results are ordered by rank, then kind and primary key, and split into
+cursor pages the way cursors.py splits listings. The ranks depend on the
+rest of the index, so a hit can move between pages when rows are added
+while a user pages through the results. Ranking reads the text of every
+match, so only the newest SEARCH_MAX_RANKED matches of a query are ranked,
+which bounds the cost of a query for a word most rows contain. Terms are
+not matched as prefixes, as a short prefix expands to every indexed word it
+starts. The snippets are cut from the tag-stripped text in Python, marking
+the words that start with a searched term, as the stored bodies are HTML.
+
+Settings:
+    SEARCH_MAX_RANKED: The number of newest matches that are ranked,
+                    10,000 by default.
+
+Constants:
+    SEARCH_CONFIG: The PostgreSQL text search configuration.
+    SEARCHABLE: The searchable kinds with their model, title columns, body
+                columns and the condition of a searchable row.
+    MAX_TERMS: The number of terms of a query that are searched.
+    BACKENDS: The search backend of each database vendor.
+
+Classes:
+    SearchHit: A search result.
+    BaseSearchBackend: The interface of a search backend.
+    PostgresSearchBackend: Searches tsvector columns.
+    SQLiteSearchBackend: Searches an FTS5 table.
+    SearchPaginator: Splits the hits of a query into cursor pages.
+
+Functions:
+    get_search_backend: Returns the search backend of a database.
+    parse_query: Returns the terms of a search query.
+    highlight: Returns a snippet of a text with the terms marked.
+    load_hits: Loads the rows of a page of hits.
+"""
+from abc import ABC, abstractmethod
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import NotSupportedError, connections
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from .cursors import CURSOR_SALT, CursorPage
+from .models import Category, Comment, Post, UserGroup
+
+SEARCH_CONFIG = 'english'
+SEARCHABLE = {
+    'category': (Category, ['category_name'], [], None),
+    'comment': (Comment, [], ['content'], '{row}status'),
+    'group': (UserGroup, ['name'], ['description'], None),
+    'post': (Post, ['title'], ['blurb', 'content'], '{row}status = 1'),
+}
+MAX_TERMS = 8
+
+
+class SearchHit:
+    """
+    A search result.
+
+    Attributes:
+        kind (str): The key of the row's kind in SEARCHABLE.
+        pk (int): The primary key of the row.
+        rank (float): How well the row matches, higher is better.
+        object (Model): The row, once loaded by load_hits().
+        snippet (str): The marked snippet, once loaded by load_hits().
+    """
+    def __init__(self, kind, pk, rank):
+        self.kind = kind
+        self.pk = pk
+        self.rank = rank
+        self.object = None
+        self.snippet = ''
+
+    def __repr__(self):
+        return f'<SearchHit {self.kind} {self.pk}>'
+
+
+class BaseSearchBackend(ABC):
+    """
+    The interface of a search backend.
+
+    Attributes:
+        connection (DatabaseWrapper): The database searched.
+
+    Methods:
+        install(): Creates the search columns, tables and triggers, and
+                indexes the existing rows.
+        uninstall(): Drops them again.
+        search(terms, kinds, after, backwards, limit): Returns a page of
+                                                    hits.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    @abstractmethod
+    def install(self):
+        """
+        Creates the search columns, tables and triggers of every SEARCHABLE
+        model and indexes the rows already stored.
+
+        Once it returns, the triggers keep the index in step with every
+        insert, update and delete. It runs inside the caller's transaction
+        and expects uninstall to have run first, or nothing to be installed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def uninstall(self):
+        """
+        Drops everything install created, leaving the searched tables as
+        they were before.
+
+        It must not fail when nothing is installed, so rebuilding the index
+        can always uninstall first.
+        """
+        raise NotImplementedError
+
+    def search(self, terms, kinds, after=None, backwards=False, limit=20):
+        """
+        Returns the hits of a query, best first.
+
+        Args:
+            terms (list): The terms a row must all contain, matched after
+                        stemming, so "tomato" matches "tomatoes".
+            kinds (list): The kinds of rows to search.
+            after (list): The rank, kind and primary key of the hit to
+                        start after, or None to start at the best hit.
+            backwards (bool): Whether to return the hits before it instead,
+                        still best first.
+            limit (int): The number of hits to return.
+
+        Returns:
+            list: The SearchHits.
+        """
+        if not terms or not kinds:
+            return []
+        sql, params = self.hits_sql(
+            terms, kinds, getattr(settings, 'SEARCH_MAX_RANKED', 10_000))
+        where, where_params = '', []
+        if after is not None:
+            where, where_params = self._after(after, backwards)
+        order = 'rank, kind DESC, pk DESC' if backwards else (
+            'rank DESC, kind, pk')
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT kind, pk, rank FROM ({sql}) hits {where} '
+                f'ORDER BY {order} LIMIT %s',
+                [*params, *where_params, limit])
+            rows = cursor.fetchall()
+        if backwards:
+            rows.reverse()
+        return [SearchHit(kind, pk, rank) for kind, pk, rank in rows]
+
+    @abstractmethod
+    def hits_sql(self, terms, kinds, candidates):
+        """
+        Returns the query of the hits, with kind, pk and rank columns.
+
+        Args:
+            terms (list): The searched terms.
+            kinds (list): The kinds of rows to search.
+            candidates (int): The number of newest matches to rank.
+
+        Returns:
+            tuple: The SQL and its parameters.
+        """
+        raise NotImplementedError
+
+    def _after(self, after, backwards):
+        rank, kind, pk = after
+        first, then = ('>', '<') if backwards else ('<', '>')
+        return (f'WHERE rank {first} %s OR (rank = %s AND (kind {then} %s '
+                f'OR (kind = %s AND pk {then} %s)))',
+                [rank, rank, kind, kind, pk])
+# (rank, kind, pk) after the cursor in the order rank DESC, kind, pk,
+# written out as cursors.py writes its row comparisons.
+
+    @staticmethod
+    def _text(columns, row=''):
+        if not columns:
+            return "''"
+        return " || ' ' || ".join(
+            f"coalesce({row}{column}, '')" for column in columns)
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Searches search_vector tsvector columns with GIN indexes.
+    """
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for model, title, body, condition in SEARCHABLE.values():
+                table = model._meta.db_table
+                vector = self._vector(title, body, 'NEW.')
+                columns = ', '.join(title + body)
+                where = (' WHERE ' + condition.format(row='')
+                         if condition else '')
+                cursor.execute(
+                    f'ALTER TABLE {table} ADD COLUMN search_vector tsvector')
+                cursor.execute(
+                    f'CREATE FUNCTION {table}_search() RETURNS trigger '
+                    f'LANGUAGE plpgsql AS $$ BEGIN '
+                    f'NEW.search_vector := {vector}; RETURN NEW; END $$')
+                cursor.execute(
+                    f'CREATE TRIGGER {table}_search BEFORE INSERT OR UPDATE '
+                    f'OF {columns} ON {table} FOR EACH ROW '
+                    f'EXECUTE FUNCTION {table}_search()')
+                cursor.execute(
+                    f'UPDATE {table} SET search_vector = '
+                    f'{self._vector(title, body)}')
+                cursor.execute(
+                    f'CREATE INDEX {table}_search_idx ON {table} '
+                    f'USING gin (search_vector){where}')
+# The index is partial like the listing indexes, so blocked posts and
+# comments take no space in it.
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for model, *_ in SEARCHABLE.values():
+                table = model._meta.db_table
+                cursor.execute(
+                    f'DROP TRIGGER IF EXISTS {table}_search ON {table}')
+                cursor.execute(f'DROP FUNCTION IF EXISTS {table}_search()')
+                cursor.execute(
+                    f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+    def hits_sql(self, terms, kinds, candidates):
+        query = ' & '.join(f"'{term}'" for term in terms)
+        selects = []
+        for kind in kinds:
+            model, _, _, condition = SEARCHABLE[kind]
+            where = ' AND ' + condition.format(row='') if condition else ''
+            selects.append(
+                f"SELECT '{kind}' AS kind, id AS pk, "
+                f'ts_rank(search_vector, query)::float8 AS rank '
+                f'FROM (SELECT id, search_vector '
+                f'FROM {model._meta.db_table} '
+                f'WHERE search_vector @@ to_tsquery(%s::regconfig, %s)'
+                f'{where} ORDER BY id DESC LIMIT %s) matches, '
+                f'to_tsquery(%s::regconfig, %s) query')
+        return (' UNION ALL '.join(selects),
+                [SEARCH_CONFIG, query, candidates, SEARCH_CONFIG, query]
+                * len(selects))
+# The matches are limited before they are ranked, so ts_rank only reads
+# the vectors of the newest matches of each kind.
+
+    def _vector(self, title, body, row=''):
+        return (f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+                f"{self._text(title, row)}), 'A') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+                f"{self._text(body, row)}), 'B')")
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Searches an FTS5 table.
+
+    The rowid of a row in the FTS5 table is its primary key times the
+    number of kinds plus the position of its kind in SEARCHABLE, so a
+    trigger finds the row it replaces through the rowid.
+
+    Attributes:
+        table (str): The name of the FTS5 table.
+    """
+    table = 'post_hub_search'
+
+    def install(self):
+        kinds = len(SEARCHABLE)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {self.table} USING fts5(title, body, '
+                f"tokenize = 'porter unicode61 remove_diacritics 2')")
+            for code, (model, title, body, condition) in enumerate(
+                    SEARCHABLE.values()):
+                table = model._meta.db_table
+                columns = ', '.join(title + body)
+
+                def insert(row, where):
+                    return (
+                        f'INSERT INTO {self.table} (rowid, title, body) '
+                        f'SELECT {row}id * {kinds} + {code}, '
+                        f'{self._text(title, row)}, {self._text(body, row)}'
+                        f'{where}')
+
+                def when(row):
+                    return (' WHERE ' + condition.format(row=row)
+                            if condition else '')
+
+                delete = (f'DELETE FROM {self.table} '
+                          f'WHERE rowid = OLD.id * {kinds} + {code};')
+                cursor.execute(
+                    f'CREATE TRIGGER {table}_search_insert AFTER INSERT ON '
+                    f'{table} BEGIN {insert("NEW.", when("NEW."))}; END')
+                cursor.execute(
+                    f'CREATE TRIGGER {table}_search_update AFTER UPDATE OF '
+                    f'{columns}{", status" if condition else ""} ON {table} '
+                    f'BEGIN {delete} {insert("NEW.", when("NEW."))}; END')
+                cursor.execute(
+                    f'CREATE TRIGGER {table}_search_delete AFTER DELETE ON '
+                    f'{table} BEGIN {delete} END')
+                cursor.execute(insert('', f' FROM {table}{when("")}'))
+# Only searchable rows are copied, so a blocked post or comment leaves the
+# table and an approved one comes back when its status is updated.
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for model, *_ in SEARCHABLE.values():
+                table = model._meta.db_table
+                for event in ('insert', 'update', 'delete'):
+                    cursor.execute(
+                        f'DROP TRIGGER IF EXISTS {table}_search_{event}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def hits_sql(self, terms, kinds, candidates):
+        query = ' AND '.join(f'"{term}"' for term in terms)
+        codes = list(SEARCHABLE)
+        kind = ' '.join(f"WHEN {code} THEN '{name}'"
+                        for code, name in enumerate(codes))
+        return (
+            f'SELECT CASE rowid %% {len(codes)} {kind} END AS kind, '
+            f'rowid / {len(codes)} AS pk, '
+            f'-bm25({self.table}, 10.0, 1.0) AS rank FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid %% {len(codes)} IN '
+            f'({", ".join(str(codes.index(name)) for name in kinds)}) '
+            f'ORDER BY rowid DESC LIMIT %s',
+            [query, candidates])
+# bm25 is lower for better matches, so it is negated to rank like ts_rank,
+# and the title is weighted ten times the body. FTS5 returns the matches in
+# rowid order, so bm25 is only computed for the newest matches.
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend(connection=None):
+    """
+    Returns the search backend of a database.
+
+    Args:
+        connection (DatabaseWrapper): The database, the default one if
+                                    None.
+
+    Returns:
+        BaseSearchBackend: The backend.
+
+    Raises:
+        NotSupportedError: If the database has no search backend.
+    """
+    connection = connection or connections['default']
+    try:
+        return BACKENDS[connection.vendor](connection)
+    except KeyError:
+        raise NotSupportedError(
+            f'Full-text search is not supported on {connection.vendor}.')
+
+
+def parse_query(query):
+    """
+    Returns the terms of a search query, the words of it in lower case.
+
+    Args:
+        query (str): The query typed by the user.
+
+    Returns:
+        list: At most MAX_TERMS terms.
+    """
+    return re.findall(r'[^\W_]+', (query or '').lower())[:MAX_TERMS]
+# Only letters and digits are kept, so the terms can be quoted into the
+# tsquery and FTS5 query syntax without escaping.
+
+
+def highlight(text, terms, length=30):
+    """
+    Returns a snippet of a text around its first match, with the words
+    that start with a term marked.
+
+    Args:
+        text (str): The text, which may be HTML.
+        terms (list): The searched terms.
+        length (int): The number of words in the snippet.
+
+    Returns:
+        str: The snippet, safe to render as HTML.
+    """
+    words = strip_tags(text or '').split()
+    matches = [index for index, word in enumerate(words)
+               if word.lower().lstrip('"\'(').startswith(tuple(terms))]
+    start = max(0, min(matches[0] - length // 3, len(words) - length)
+                if matches else 0)
+    snippet = []
+    for index, word in enumerate(words[start:start + length], start):
+        snippet.append(f'<mark>{escape(word)}</mark>' if index in matches
+                       else escape(word))
+    prefix = '&hellip; ' if start else ''
+    suffix = ' &hellip;' if start + length < len(words) else ''
+    return mark_safe(prefix + ' '.join(snippet) + suffix)
+
+
+def load_hits(hits, terms):
+    """
+    Loads the rows of a page of hits with one query per kind, and marks
+    their snippets.
+
+    Args:
+        hits (list): The SearchHits.
+        terms (list): The searched terms.
+    """
+    related = {
+        'comment': ('author', 'post', 'group'),
+        'post': ('author', 'category'),
+    }
+    for kind, (model, title, body, _) in SEARCHABLE.items():
+        pks = [hit.pk for hit in hits if hit.kind == kind]
+        if not pks:
+            continue
+        rows = model.objects.select_related(
+            *related.get(kind, ())).in_bulk(pks)
+        for hit in hits:
+            if hit.kind == kind:
+                hit.object = rows.get(hit.pk)
+                if hit.object is not None:
+                    hit.snippet = highlight(' '.join(
+                        str(getattr(hit.object, column) or '')
+                        for column in body or title), terms)
+# A row deleted since the page was searched has no object and is skipped
+# by the template.
+
+
+class SearchPaginator:
+    """
+    Splits the hits of a query into cursor pages.
+
+    Attributes:
+        terms (list): The searched terms.
+        kinds (list): The kinds of rows searched.
+        per_page (int): The number of hits on a page.
+        backend (BaseSearchBackend): The backend searched.
+
+    Methods:
+        page(cursor): Returns the page of a cursor.
+        get_page(cursor): Returns the page of a cursor, or the first page
+                        if the cursor is invalid.
+    """
+    def __init__(self, terms, kinds, per_page, backend=None):
+        self.terms = terms
+        self.kinds = kinds
+        self.per_page = per_page
+        self.backend = backend or get_search_backend()
+
+    def page(self, cursor):
+        """
+        Returns the page of a cursor.
+
+        Args:
+            cursor (str): A cursor of these results, or None for the first
+                        page.
+
+        Returns:
+            CursorPage: The page of SearchHits.
+
+        Raises:
+            signing.BadSignature: If the cursor is invalid.
+        """
+        direction, after = 'next', None
+        if cursor is not None:
+            token = signing.loads(cursor, salt=CURSOR_SALT)
+            if token['o'] != self._ordering():
+                raise signing.BadSignature('The cursor has another query.')
+            direction, after = token['d'], token['v']
+            after = [float(after[0]), str(after[1]), int(after[2])]
+        backwards = direction == 'previous'
+        hits = self.backend.search(self.terms, self.kinds, after, backwards,
+                                   self.per_page + 1)
+        more = len(hits) > self.per_page
+        hits = hits[1:] if backwards and more else hits[:self.per_page]
+        if not hits:
+            return CursorPage(hits, self, None, None)
+        has_next = more if not backwards else True
+        has_previous = more if backwards else after is not None
+        return CursorPage(
+            hits, self,
+            self._sign('next', hits[-1]) if has_next else None,
+            self._sign('previous', hits[0]) if has_previous else None)
+
+    def get_page(self, cursor):
+        """
+        Returns the page of a cursor, or the first page if the cursor is
+        invalid.
+
+        Args:
+            cursor (str): A cursor of these results, or None.
+
+        Returns:
+            CursorPage: The page.
+        """
+        try:
+            return self.page(cursor or None)
+        except (signing.BadSignature, KeyError, TypeError, ValueError,
+                IndexError, ValidationError):
+            return self.page(None)
+
+    def _ordering(self):
+        return ['search', *self.terms, '|', *self.kinds]
+
+    def _sign(self, direction, hit):
+        return signing.dumps(
+            {'o': self._ordering(), 'd': direction,
+             'v': [hit.rank, hit.kind, hit.pk]}, salt=CURSOR_SALT)
@@ -0,0 +1,126 @@
+"""
+This module contains the data of the sidebar widgets.
+
+The top categories, top groups and suggested categories widgets appear on
+most pages but change rarely, so their data is kept in the cache instead of
+being aggregated on every request. The cached entries expire after
+SIDEBAR_CACHE_SECONDS, and the signal receivers below delete them as soon
+as a post, category, group or group membership changes. The cache must be
+shared by every process, as the CACHES setting is, or the other processes
+keep serving the old widgets until they expire.
+
+Suggested categories are sampled from a cached pool of category ids, and
+only the sampled categories are loaded, so the category table is never read
+in full.
+
+Settings:
+    SIDEBAR_CACHE_SECONDS: How long the widget data is cached, 300 seconds
+                        by default.
+
+Constants:
+    TOP_COUNT: The number of top categories and top groups shown.
+    SUGGESTED_COUNT: The number of suggested categories shown.
+    TOP_CATEGORIES_KEY: The cache key of the top categories.
+    TOP_GROUPS_KEY: The cache key of the top groups.
+    CATEGORY_IDS_KEY: The cache key of the pool of category ids.
+
+Functions:
+    top_categories: Returns the categories with the most posts.
+    top_groups: Returns the groups with the most members.
+    suggested_categories: Returns random categories.
+    invalidate_categories: Drops the cached category data.
+    invalidate_groups: Drops the cached group data.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Post, UserGroup
+
+TOP_COUNT = 8
+SUGGESTED_COUNT = 5
+TOP_CATEGORIES_KEY = 'post_hub:sidebar:top_categories'
+TOP_GROUPS_KEY = 'post_hub:sidebar:top_groups'
+CATEGORY_IDS_KEY = 'post_hub:sidebar:category_ids'
+
+
+def _cached(key, load):
+    return cache.get_or_set(
+        key, load, getattr(settings, 'SIDEBAR_CACHE_SECONDS', 300))
+
+
+def top_categories():
+    """
+    Returns the categories with the most posts.
+
+    Returns:
+        list: The categories, each with a post_count attribute.
+    """
+    return _cached(TOP_CATEGORIES_KEY, lambda: list(
+        Category.objects.annotate(post_count=Count('category'))
+        .order_by('-post_count', 'category_name')[:TOP_COUNT]))
+
+
+def top_groups():
+    """
+    Returns the groups with the most members.
+
+    Returns:
+        list: The groups, each with a num_members attribute.
+    """
+    return _cached(TOP_GROUPS_KEY, lambda: list(
+        UserGroup.objects.annotate(num_members=Count('members'))
+        .order_by('-num_members', 'name')[:TOP_COUNT]))
+
+
+def suggested_categories(count=SUGGESTED_COUNT):
+    """
+    Returns random categories, sampled from the cached pool of category ids.
+
+    Args:
+        count (int): The number of categories to return.
+
+    Returns:
+        list: The categories in random order.
+    """
+    ids = _cached(CATEGORY_IDS_KEY, lambda: list(
+        Category.objects.values_list('pk', flat=True)))
+    ids = random.sample(ids, min(count, len(ids)))
+    categories = Category.objects.in_bulk(ids)
+    return [categories[pk] for pk in ids if pk in categories]
+# A category deleted since the pool was cached is skipped rather than
+# failing the page.
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_categories(sender, **_kwargs):
+    """
+    Drops the cached category data when a category or a post changes, as
+    either can change the post counts and the id pool.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        **_kwargs: Additional keyword arguments.
+    """
+    cache.delete_many([TOP_CATEGORIES_KEY, CATEGORY_IDS_KEY])
+
+
+@receiver(post_save, sender=UserGroup)
+@receiver(post_delete, sender=UserGroup)
+@receiver(m2m_changed, sender=UserGroup.members.through)
+def invalidate_groups(sender, **_kwargs):
+    """
+    Drops the cached top groups when a group or its members change.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        **_kwargs: Additional keyword arguments.
+    """
+    cache.delete(TOP_GROUPS_KEY)
@@ -0,0 +1,57 @@
+"""
+This module contains the template tags that render comment threads.
+
+Functions:
+    comment_tree: Renders a list of comments as nested threads.
+"""
+from django import template
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+COMMENT_NODE_TEMPLATE = 'post_hub/comment_node.html'
+
+
+@register.simple_tag(takes_context=True)
+def comment_tree(context, comments):
+    """
+    Renders a list of comments as nested threads, with the same markup as
+    mptt's recursetree tag wrapped around comment_node.html.
+
+    The node template is parsed once by the template loader and rendered
+    once per comment into the current context, as with an include. The
+    tree is walked without recursion: the comments are rendered deepest
+    first, so the replies of a comment are always rendered before it and
+    are passed to it as the children variable. Parents are found by
+    parent_id rather than by comparing tree fields, so rendering stays
+    linear in the number of comments.
+
+    The comments should be fetched beforehand with their authors selected,
+    as by post_hub.threads.load_subtrees(). Comments whose parent is not in
+    the list are rendered as top level comments.
+
+    Args:
+        context (Context): The context of the calling template.
+        comments (list): The comments ordered by level and then by the
+                    order siblings are shown in.
+
+    Returns:
+        SafeString: The rendered threads.
+    """
+    node_template = context.template.engine.get_template(
+        COMMENT_NODE_TEMPLATE)
+    comments = list(comments)
+    children = {comment.pk: [] for comment in comments}
+    top_level = []
+    for comment in comments:
+        if comment.parent_id in children:
+            children[comment.parent_id].append(comment)
+        else:
+            top_level.append(comment)
+    rendered = {}
+    for comment in reversed(comments):
+        replies = mark_safe(''.join(
+            rendered.pop(reply.pk) for reply in children[comment.pk]))
+        with context.push(node=comment, children=replies):
+            rendered[comment.pk] = node_template.render(context)
+    return mark_safe(''.join(rendered[comment.pk] for comment in top_level))
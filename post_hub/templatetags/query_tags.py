@@ -0,0 +1,37 @@
+"""
+This module contains the template tags that build the links of paginated
+and sorted pages.
+
+Functions:
+    query_string: Returns the query string of the current request with some
+                parameters replaced.
+"""
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def query_string(context, **params):
+    """
+    Returns the query string of the current request with the given
+    parameters replaced, so a link keeps the parameters of the other lists
+    on the page, such as the comment page of a group under its posts.
+
+    Args:
+        context (Context): The context of the calling template.
+        **params: The parameters to replace. A parameter set to None is
+                removed.
+
+    Returns:
+        str: The query string, starting with '?'.
+    """
+    query = context['request'].GET.copy()
+    for name, value in params.items():
+        if value is None:
+            query.pop(name, None)
+        else:
+            query[name] = value
+    return f'?{query.urlencode()}'
+# The result is escaped like any other tag output, so the & separators are
+# written as &amp; in the href attributes.
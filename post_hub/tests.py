@@ -12,18 +12,54 @@ Utilities:
     Leverages PIL for image creation in tests.
 """
 import json
+import re
 import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPServerDisconnected
 
 from PIL import Image
 
 from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import engines
+from django.test import (
+    Client, RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from . import forms, sidebar, votes
+from .autocomplete import (
+    PAGE_SIZE, AutocompleteIndex, Entry, edit_distance, get_index)
+from .cursors import CursorPaginator
 from .forms import CommentForm, PostForm
-from .models import Category, Comment, Post, Profile, UserGroup, Vote
+from .models import (
+    Category, Comment, CommentClosure, CommentTreeCounter, OutboundEmail,
+    Post, Profile, UploadJob, UserGroup, Vote)
+from .outbox import claim_emails, queue_email, send_pending_emails
+from .paginators import EstimatedCountPaginator, estimate_count
+from .search import (
+    SEARCHABLE, SearchPaginator, get_search_backend, highlight, parse_query)
+from .ranking import (
+    COMMENT_SORTS, SORTS, controversy_score, hot_score, refresh_comment_scores,
+    refresh_hot_scores, wilson_score)
+from .vote_buffer import (
+    InMemoryVoteBuffer, SQLiteVoteBuffer, flush_vote_buffer, get_vote_buffer,
+    pending_votes)
+from .threads import load_subtrees, thread_roots
+from .tree_backends import BaseTreeBackend
+from .uploads import (
+    BaseStorageClient, claim_jobs, run_job, run_pending_uploads,
+    stage_upload)
+from .votes import cast_vote, load_vote_states
 
 
 class PostFormTest4SpellChecker(TestCase):
@@ -615,6 +651,7 @@ class CategoryDetailViewTest(TestCase):
 class CloudinaryImageUploadTest(TestCase):
     """
     Tests the functionality of image uploads to Cloudinary for comments.
+    The queued uploads are run with the local storage client.
 
     Methods:
         setUp(): Sets up the test environment by creating necessary objects.
@@ -629,8 +666,16 @@ class CloudinaryImageUploadTest(TestCase):
         Sets up the test environment by creating necessary objects.
 
         This method creates a client, a user, a category, a post,
-        and a user group to be used in the tests.
-        """
+        and a user group to be used in the tests, and stores the uploads
+        in a temporary directory.
+        """
+        uploads = tempfile.TemporaryDirectory()
+        self.addCleanup(uploads.cleanup)
+        local = override_settings(
+            UPLOAD_STORAGE_CLIENT='post_hub.uploads.LocalStorageClient',
+            MEDIA_ROOT=uploads.name + '/media')
+        local.enable()
+        self.addCleanup(local.disable)
         # Create a sample user, post, category, and user group for testing
         self.client = Client()
         self.user = User.objects.create_user(
@@ -690,6 +735,8 @@ class CloudinaryImageUploadTest(TestCase):
             comment = form.save(commit=False, author=self.user)
             comment.post = self.post  # Set the post field
             comment.save()
+            run_pending_uploads()
+            comment.refresh_from_db()
 
             # Print the image URL for debugging
             print(f"Image URL: {comment.image}")
@@ -731,6 +778,8 @@ class CloudinaryImageUploadTest(TestCase):
             print(f"Author: {comment.author}, Group: {
                   comment.group}")  # Debug print
             comment.save()
+            run_pending_uploads()
+            comment.refresh_from_db()
 
             # Print the image URL for debugging
             print(f"Image URL: {comment.image}")
@@ -956,3 +1005,2783 @@ class EditProfileTest(TestCase):
         self.assertEqual(self.profile.bio, 'Updated bio')
         self.assertEqual(self.profile.location, 'Updated location')
         self.assertTrue(self.profile.user_image)
+
+
+class CommentTreeInsertTest(TestCase):
+    """
+    Tests that new comments are inserted into their own tree only.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        tree_values(): Returns the tree fields of every comment.
+        test_reply_only_shifts_its_thread(): Tests a reply leaves other
+                                        threads untouched.
+        test_insert_matches_full_rebuild(): Tests incremental inserts give
+                                        the same tree as a full rebuild.
+        test_repair_command_fixes_broken_tree(): Tests the repair command.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a user, a category, a post and two threads
+        of comments to be used in the tests.
+        """
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='Test Category')
+        self.post = Post.objects.create(
+            title='Test Post', content='Test Content',
+            author=self.user, category=self.category)
+        self.first = Comment.objects.create(
+            post=self.post, author=self.user, content='First thread')
+        self.second = Comment.objects.create(
+            post=self.post, author=self.user, content='Second thread')
+        self.reply = Comment.objects.create(
+            post=self.post, author=self.user, content='Reply',
+            parent=self.first)
+
+    def tree_values(self):
+        """
+        Returns the tree fields of every comment keyed by primary key.
+
+        Returns:
+            dict: Maps comment ids to (tree_id, lft, rght, level) tuples.
+        """
+        return {comment['pk']: (comment['tree_id'], comment['lft'],
+                                comment['rght'], comment['level'])
+                for comment in Comment.objects.values(
+                    'pk', 'tree_id', 'lft', 'rght', 'level')}
+
+    def test_reply_only_shifts_its_thread(self):
+        """
+        Tests that replying to one thread leaves the other thread untouched.
+        """
+        self.assertNotEqual(self.first.tree_id, self.second.tree_id)
+        before = self.tree_values()
+        Comment.objects.create(
+            post=self.post, author=self.user, content='Nested reply',
+            parent=self.reply)
+        after = self.tree_values()
+        self.assertEqual(before[self.second.pk], after[self.second.pk])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.get_descendant_count(), 2)
+
+    def test_insert_matches_full_rebuild(self):
+        """
+        Tests that incremental inserts produce the same tree values as a
+        full rebuild of every tree.
+        """
+        Comment.objects.create(
+            post=self.post, author=self.user, content='Second reply',
+            parent=self.first)
+        Comment.objects.create(
+            post=self.post, author=self.user, content='Nested reply',
+            parent=self.reply)
+        incremental = self.tree_values()
+        Comment.objects.rebuild()
+        self.assertEqual(incremental, self.tree_values())
+
+    def test_repair_command_fixes_broken_tree(self):
+        """
+        Tests that the repair command rebuilds a corrupted tree.
+        """
+        Comment.objects.filter(pk=self.reply.pk).update(lft=7, rght=3)
+        call_command('repair_comment_trees', '--post', self.post.slug,
+                     stdout=StringIO())
+        self.reply.refresh_from_db()
+        self.assertEqual((self.reply.lft, self.reply.rght), (2, 3))
+
+
+class TreeIdAllocationTest(TransactionTestCase):
+    """
+    Tests that new threads started in separate transactions get their own
+    tree_id with either tree backend.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        separate_roots(): Takes a tree id in one transaction and creates a
+                        thread in another.
+        test_mptt_roots(): Tests the tree ids of the MPTT backend.
+        test_closure_roots(): Tests the tree ids of the closure backend.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a user, a category and a post with one thread.
+        """
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.post = Post.objects.create(
+            title='Test Post', content='Test Content', author=self.user,
+            category=Category.objects.create(category_name='Test Category'))
+        self.first = Comment.objects.create(
+            post=self.post, author=self.user, content='First thread')
+
+    def separate_roots(self):
+        """
+        Takes a tree id in one transaction, as a thread whose comment is not
+        committed yet would, then creates a thread in another transaction.
+
+        Returns:
+            tuple: The taken tree id and the created comment.
+        """
+        with transaction.atomic():
+            taken = Comment.objects.next_tree_id()
+        with transaction.atomic():
+            root = Comment.objects.create(
+                post=self.post, author=self.user, content='Second thread')
+        return taken, root
+
+    def test_mptt_roots(self):
+        """
+        Tests that the MPTT backend does not reuse a taken tree id.
+        """
+        taken, root = self.separate_roots()
+        self.assertEqual(taken, self.first.tree_id + 1)
+        self.assertEqual(root.tree_id, taken + 1)
+        self.assertEqual((root.lft, root.rght), (1, 2))
+
+    @override_settings(
+        COMMENT_TREE_BACKEND='post_hub.tree_backends.ClosureTreeBackend')
+    def test_closure_roots(self):
+        """
+        Tests that the closure backend does not reuse a taken tree id.
+        """
+        taken, root = self.separate_roots()
+        self.assertEqual(root.tree_id, taken + 1)
+
+
+class VoteCountTest(TestCase):
+    """
+    Tests the stored vote counts on posts and comments.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        vote(data): Sends a vote to the vote view.
+        test_post_counts_follow_votes(): Tests the counts through a vote,
+                                    a changed vote and a removed vote.
+        test_comment_counts_follow_votes(): Tests the comment counts.
+        test_vote_response_has_counts(): Tests that the vote response
+                                    carries the fresh counts.
+        test_reconcile_votes_fixes_drift(): Tests the reconcile command.
+        test_stale_save_keeps_counts(): Tests that saving an instance loaded
+                                    before a vote keeps the vote.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category, a post,
+        and a comment to be used in the tests.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user)
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.user, content='Test Comment')
+        self.client.login(username='testuser', password='12345')
+
+    def vote(self, data):
+        """
+        Sends a vote to the vote view.
+
+        Args:
+            data (dict): The JSON body of the vote request.
+
+        Returns:
+            HttpResponse: The response of the vote view.
+        """
+        return self.client.post(reverse('vote'), data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_post_counts_follow_votes(self):
+        """
+        Tests that the post counts follow a new vote, a changed vote
+        and a removed vote.
+        """
+        self.vote({'post_id': self.post.id, 'is_upvote': True})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.total_upvotes(), self.post.score), (1, 1))
+
+        self.vote({'post_id': self.post.id, 'is_upvote': False})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count,
+                          self.post.score), (0, 1, -1))
+
+        self.vote({'post_id': self.post.id, 'is_upvote': False})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count,
+                          self.post.score), (0, 0, 0))
+
+    def test_comment_counts_follow_votes(self):
+        """
+        Tests that the comment counts follow a new vote.
+        """
+        self.vote({'comment_id': self.comment.id, 'is_upvote': True})
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.total_upvotes(), 1)
+        self.assertEqual(self.comment.total_downvotes(), 0)
+
+    def test_vote_response_has_counts(self):
+        """
+        Tests that the vote response carries the fresh counts and the
+        user's vote, so the page does not need to reload.
+        """
+        response = self.vote({'post_id': self.post.id, 'is_upvote': False})
+        self.assertEqual(response.json(), {
+            'success': True, 'upvotes': 0, 'downvotes': 1, 'score': -1,
+            'user_vote': False})
+        response = self.vote({'comment_id': self.comment.id,
+                              'is_upvote': True})
+        self.assertEqual(response.json()['upvotes'], 1)
+        response = self.vote({'comment_id': self.comment.id,
+                              'is_upvote': True})
+        self.assertEqual((response.json()['upvotes'],
+                          response.json()['user_vote']), (0, None))
+
+    def test_reconcile_votes_fixes_drift(self):
+        """
+        Tests that reconcile_votes recounts drifted counts from the
+        Vote table.
+        """
+        Vote.objects.create(user=self.user, post=self.post, is_upvote=True)
+        Comment.objects.filter(pk=self.comment.pk).update(
+            downvote_count=4, score=-4)
+        out = StringIO()
+        call_command('reconcile_votes', stdout=out)
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.score), (1, 1))
+        self.assertEqual((self.comment.downvote_count, self.comment.score),
+                         (0, 0))
+        self.assertIn('Post: 1 checked, 1 drifted', out.getvalue())
+
+    def test_stale_save_keeps_counts(self):
+        """
+        Tests that editing a post or comment loaded before a vote saves the
+        edit without writing back the counts it loaded.
+        """
+        post = Post.objects.get(pk=self.post.pk)
+        comment = Comment.objects.get(pk=self.comment.pk)
+        self.vote({'post_id': self.post.id, 'is_upvote': True})
+        self.vote({'comment_id': self.comment.id, 'is_upvote': False})
+        post.content = 'Edited'
+        post.save()
+        comment.content = 'Edited'
+        comment.save()
+        post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((post.content, post.upvote_count, post.score),
+                         ('Edited', 1, 1))
+        self.assertEqual(
+            (comment.content, comment.downvote_count, comment.score),
+            ('Edited', 1, -1))
+
+
+class ToggleVoteTest(TestCase):
+    """
+    Tests the vote upsert behind the vote view.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_toggle_vote_states(): Tests a new, changed and removed vote.
+        test_toggle_vote_orm_fallback(): Tests the fallback for backends
+                                    without upserts.
+        test_vote_on_missing_post(): Tests that a missing post returns 404
+                                    and leaves no vote behind.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category and a post
+        to be used in the tests.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user)
+        self.client.login(username='testuser', password='12345')
+
+    def test_toggle_vote_states(self):
+        """
+        Tests that cast_vote adds a vote, changes it and removes it,
+        reporting the old and new state each time.
+        """
+        self.assertEqual(cast_vote(self.user, 'post', self.post.id, True)[:2],
+                         (None, True))
+        self.assertEqual(cast_vote(self.user, 'post', self.post.id, False)[:2],
+                         (True, False))
+        self.assertFalse(Vote.objects.get(user=self.user).is_upvote)
+        self.assertEqual(cast_vote(self.user, 'post', self.post.id, False),
+                         (False, None, 0, 0))
+        self.assertFalse(Vote.objects.exists())
+
+    def test_toggle_vote_orm_fallback(self):
+        """
+        Tests that the ORM fallback toggles a vote the same way.
+        """
+        with transaction.atomic():
+            states = [votes._toggle_orm(self.user.id, 'post', self.post.id,
+                                        is_upvote)
+                      for is_upvote in (True, False, False)]
+        self.assertEqual(states, [(None, True), (True, False), (False, None)])
+        self.assertFalse(Vote.objects.exists())
+
+    def test_vote_on_missing_post(self):
+        """
+        Tests that voting on a missing post returns 404 and rolls the
+        vote back.
+        """
+        response = self.client.post(
+            reverse('vote'), content_type='application/json',
+            data=json.dumps({'post_id': self.post.id + 1, 'is_upvote': True}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Vote.objects.exists())
+
+
+class VoteBatchTest(TestCase):
+    """
+    Tests the batch vote endpoint.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        vote_batch(votes): Sends a batch of votes.
+        test_batch_applies_votes_in_order(): Tests the results and counts
+                                        of a mixed batch.
+        test_batch_uses_constant_queries(): Tests that the query count does
+                                        not grow with the batch size.
+        test_batch_rejects_invalid_body(): Tests a body without a list.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category, two posts and
+        a comment to be used in the tests.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user)
+        self.other_post = Post.objects.create(
+            title='Other Post', content='Other Content',
+            category=self.category, author=self.user)
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.user, content='Test Comment')
+        self.client.login(username='testuser', password='12345')
+
+    def vote_batch(self, votes):
+        """
+        Sends a batch of votes to the batch vote view.
+
+        Args:
+            votes (list): The votes to send.
+
+        Returns:
+            HttpResponse: The response of the batch vote view.
+        """
+        return self.client.post(reverse('vote_batch'),
+                                data=json.dumps({'votes': votes}),
+                                content_type='application/json')
+
+    def test_batch_applies_votes_in_order(self):
+        """
+        Tests that a batch adds, flips and removes votes in order and
+        reports a result for every vote, including invalid ones.
+        """
+        Vote.objects.create(user=self.user, post=self.other_post,
+                            is_upvote=True)
+        Post.objects.filter(pk=self.other_post.pk).update(
+            upvote_count=1, score=1)
+        results = self.vote_batch([
+            {'post_id': self.post.id, 'is_upvote': True},
+            {'post_id': self.post.id, 'is_upvote': False},
+            {'post_id': self.other_post.id, 'is_upvote': True},
+            {'comment_id': self.comment.id, 'is_upvote': True},
+            {'post_id': 9999, 'is_upvote': True},
+            {'is_upvote': True},
+        ]).json()['results']
+
+        self.assertEqual([result['success'] for result in results],
+                         [True, True, True, True, False, False])
+        self.assertEqual([result.get('user_vote') for result in results[:4]],
+                         [True, False, None, True])
+        self.assertEqual((results[1]['upvotes'], results[1]['downvotes']),
+                         (0, 1))
+        self.assertEqual(results[2]['score'], 0)
+        self.assertEqual(results[3]['upvotes'], 1)
+        self.assertFalse(Vote.objects.get(post=self.post).is_upvote)
+        self.assertFalse(Vote.objects.filter(post=self.other_post).exists())
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.score, 1)
+
+    def test_batch_uses_constant_queries(self):
+        """
+        Tests that the number of queries does not depend on the number of
+        votes in the batch.
+        """
+        posts = [Post.objects.create(title=f'Post {index}', content='Text',
+                                     category=self.category,
+                                     author=self.user)
+                 for index in range(10)]
+        with CaptureQueriesContext(connection) as single:
+            self.vote_batch([{'post_id': self.post.id, 'is_upvote': True}])
+        with self.assertNumQueries(len(single)):
+            self.vote_batch([{'post_id': post.id, 'is_upvote': True}
+                             for post in posts])
+
+    def test_batch_rejects_invalid_body(self):
+        """
+        Tests that a body without a list of votes is rejected.
+        """
+        response = self.client.post(reverse('vote_batch'),
+                                    data=json.dumps({'votes': 'up'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(VOTE_BUFFER={
+    'BACKEND': 'post_hub.vote_buffer.InMemoryVoteBuffer'})
+class VoteBufferTest(TestCase):
+    """
+    Tests the write-behind vote buffer.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        vote(is_upvote): Sends a vote on the post to the vote view.
+        test_votes_are_buffered_until_flushed(): Tests that votes reach the
+                                            Vote table only on flush.
+        test_flush_command_reports_batches(): Tests the flush command.
+        test_sqlite_buffer_keeps_last_vote(): Tests the SQLite backend.
+        test_batch_votes_are_buffered(): Tests that the batch endpoint
+                                    toggles the buffered votes.
+        test_concurrent_toggles(): Tests that both backends toggle
+                                    atomically.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category and a post
+        to be used in the tests.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user)
+        self.client.login(username='testuser', password='12345')
+
+    def vote(self, is_upvote):
+        """
+        Sends a vote on the post to the vote view.
+
+        Args:
+            is_upvote (bool): Whether the vote is an upvote.
+
+        Returns:
+            dict: The JSON response of the vote view.
+        """
+        return self.client.post(
+            reverse('vote'), content_type='application/json',
+            data=json.dumps({'post_id': self.post.id,
+                             'is_upvote': is_upvote})).json()
+
+    def test_votes_are_buffered_until_flushed(self):
+        """
+        Tests that buffered votes are not written to the Vote table, that
+        the user sees their own buffered vote, and that a flush writes the
+        last vote and the counts.
+        """
+        self.assertEqual(self.vote(True)['upvotes'], 1)
+        response = self.vote(False)
+        self.assertEqual((response['upvotes'], response['downvotes'],
+                          response['user_vote']), (0, 1, False))
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(pending_votes(self.user, 'post', [self.post.id]),
+                         {self.post.id: False})
+
+        batches = flush_vote_buffer(get_vote_buffer())
+        self.assertEqual([batch[:2] for batch in batches], [(1, 1)])
+        self.assertFalse(Vote.objects.get(post=self.post).is_upvote)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, -1)
+        self.assertEqual(len(get_vote_buffer()), 0)
+
+        self.assertIsNone(self.vote(False)['user_vote'])
+        flush_vote_buffer(get_vote_buffer())
+        self.assertFalse(Vote.objects.exists())
+
+    def test_flush_command_reports_batches(self):
+        """
+        Tests that the flush command writes in batches and reports them.
+        """
+        buffer = get_vote_buffer()
+        for index in range(3):
+            user = User.objects.create_user(username=f'voter{index}')
+            buffer.put((user.pk, 'post', self.post.id), True)
+        out = StringIO()
+        call_command('flush_vote_buffer', batch_size=2, stdout=out)
+        self.assertIn('Flushed 2 vote(s), 2 applied', out.getvalue())
+        self.assertIn('2 batch(es), 3 vote(s)', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.upvote_count, 3)
+
+    def test_sqlite_buffer_keeps_last_vote(self):
+        """
+        Tests that the SQLite buffer keeps the last vote per key and does
+        not drop a vote overwritten during a flush.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            buffer = SQLiteVoteBuffer(f'{directory}/votes.db')
+            key = (self.user.pk, 'post', self.post.id)
+            buffer.put(key, True)
+            buffer.put(key, None)
+            entries = buffer.peek(10)
+            self.assertEqual(len(entries), 1)
+            self.assertIsNone(entries[0].vote)
+            buffer.put(key, False)
+            buffer.ack(entries)
+            self.assertEqual(buffer.get_many([key]), {key: False})
+            buffer.ack(buffer.peek(10))
+            self.assertEqual(len(buffer), 0)
+
+    def test_batch_votes_are_buffered(self):
+        """
+        Tests that the batch endpoint starts from the user's buffered vote,
+        writes its result to the buffer, and that a flush keeps it.
+        """
+        Vote.objects.create(user=self.user, post=self.post, is_upvote=True)
+        Post.objects.filter(pk=self.post.pk).update(upvote_count=1, score=1)
+        self.assertEqual(self.vote(False)['user_vote'], False)
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, content='Test Comment')
+        response = self.client.post(
+            reverse('vote_batch'), content_type='application/json',
+            data=json.dumps([
+                {'post_id': self.post.id, 'is_upvote': False},
+                {'comment_id': comment.id, 'is_upvote': True},
+            ])).json()
+        self.assertEqual(
+            [(result['user_vote'], result['upvotes'], result['downvotes'])
+             for result in response['results']],
+            [(None, 0, 0), (True, 1, 0)])
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(pending_votes(self.user, 'post', [self.post.id]),
+                         {self.post.id: None})
+        flush_vote_buffer(get_vote_buffer())
+        self.assertEqual(
+            list(Vote.objects.values_list('comment', 'is_upvote')),
+            [(comment.id, True)])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.score), (0, 0))
+
+    def test_concurrent_toggles(self):
+        """
+        Tests that concurrent toggles of one key each start from the vote
+        the previous toggle left, in both buffer backends.
+        """
+        key = (self.user.pk, 'post', self.post.id)
+        with tempfile.TemporaryDirectory() as directory:
+            for buffer in (InMemoryVoteBuffer(),
+                           SQLiteVoteBuffer(f'{directory}/votes.db')):
+                votes = []
+
+                def toggle():
+                    votes.extend(buffer.toggle([(key, True, True)]))
+
+                threads = [threading.Thread(target=toggle)
+                           for _ in range(10)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(sorted(votes, key=str),
+                                 sorted([(True, None), (None, True)] * 5,
+                                        key=str))
+                self.assertEqual(buffer.get_many([key]), {key: True})
+
+
+class VoteStateLoaderTest(TestCase):
+    """
+    Tests loading the current user's votes for a page.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_loader_uses_one_query_per_type(): Tests the loaded states and
+                                        the query count.
+        test_post_detail_marks_user_votes(): Tests that the post page marks
+                                        the user's votes.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category, a post with
+        comments and the user's votes on some of them.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+        self.comments = [
+            Comment.objects.create(post=self.post, author=self.user,
+                                   content=f'Comment {index}')
+            for index in range(5)]
+        Vote.objects.create(user=self.user, post=self.post, is_upvote=True)
+        Vote.objects.create(user=self.user, comment=self.comments[1],
+                            is_upvote=False)
+        self.client.login(username='testuser', password='12345')
+
+    def test_loader_uses_one_query_per_type(self):
+        """
+        Tests that the loader returns the user's votes with one query per
+        type and sets user_vote on each item.
+        """
+        with self.assertNumQueries(2):
+            states = load_vote_states(self.user, posts=[self.post],
+                                      comments=self.comments)
+        self.assertEqual(states, {'post': {self.post.id: True},
+                                  'comment': {self.comments[1].id: False}})
+        self.assertEqual([comment.user_vote for comment in self.comments],
+                         [None, False, None, None, None])
+
+    def test_post_detail_marks_user_votes(self):
+        """
+        Tests that the post page marks the buttons of the user's votes.
+        """
+        response = self.client.get(
+            reverse('post_detail', args=[self.post.slug]))
+        self.assertEqual(response.context['user_votes']['post'],
+                         {self.post.id: True})
+        self.assertContains(
+            response, f'data-vote="post-{self.post.id}-up" '
+            'aria-pressed="true"')
+        self.assertContains(
+            response, f'data-vote="comment-{self.comments[1].id}-down" '
+            'aria-pressed="true"', count=2)
+
+
+class PostRankingTest(TestCase):
+    """
+    Tests the hot, top and new sort modes of post listings.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_hot_score_formula(): Tests the hot ranking formula.
+        test_vote_refreshes_hot_score(): Tests that a vote updates the
+                                    stored ranking.
+        test_listing_sort_modes(): Tests the sort modes of the home page.
+        test_refresh_rankings_command(): Tests the refresh command.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category and three posts,
+        one of them two days old.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.old, self.liked, self.new = [
+            Post.objects.create(title=title, content='Test Content',
+                                category=self.category, author=self.user)
+            for title in ('Old Post', 'Liked Post', 'New Post')]
+        Post.objects.filter(pk=self.old.pk).update(
+            created_at=timezone.now() - timedelta(days=2), score=50)
+        refresh_hot_scores(Post.objects.all())
+        self.client.login(username='testuser', password='12345')
+
+    def test_hot_score_formula(self):
+        """
+        Tests that ten times the score is worth 12.5 hours of age.
+        """
+        now = timezone.now()
+        self.assertAlmostEqual(
+            hot_score(100, now - timedelta(hours=12.5)), hot_score(10, now))
+        self.assertLess(hot_score(-10, now), hot_score(0, now))
+
+    def test_vote_refreshes_hot_score(self):
+        """
+        Tests that voting on a post updates its stored hot ranking.
+        """
+        Post.objects.filter(pk=self.liked.pk).update(
+            upvote_count=9, score=9)
+        refresh_hot_scores(Post.objects.filter(pk=self.liked.pk))
+        before = Post.objects.get(pk=self.liked.pk).hot_score
+        self.client.post(reverse('vote'), content_type='application/json',
+                         data=json.dumps({'post_id': self.liked.id,
+                                          'is_upvote': True}))
+        self.liked.refresh_from_db()
+        self.assertGreater(self.liked.hot_score, before)
+        self.assertEqual(self.liked.hot_score,
+                         hot_score(10, self.liked.created_at))
+
+    def test_listing_sort_modes(self):
+        """
+        Tests that the home page orders posts by the requested sort mode
+        and that top respects its window.
+        """
+        Post.objects.filter(pk=self.liked.pk).update(score=10)
+        refresh_hot_scores(Post.objects.all())
+
+        def titles(query):
+            response = self.client.get(reverse('home') + query)
+            return [post.title for post in response.context['post_list']]
+
+        self.assertEqual(titles(''), ['New Post', 'Liked Post', 'Old Post'])
+        self.assertEqual(titles('?sort=hot'),
+                         ['Liked Post', 'New Post', 'Old Post'])
+        self.assertEqual(titles('?sort=top'),
+                         ['Old Post', 'Liked Post', 'New Post'])
+        self.assertEqual(titles('?sort=top&t=day'),
+                         ['Liked Post', 'New Post'])
+        self.assertEqual(titles('?sort=bogus'), titles('?sort=new'))
+
+    def test_refresh_rankings_command(self):
+        """
+        Tests that refresh_rankings recomputes stale rankings.
+        """
+        Post.objects.filter(pk=self.new.pk).update(hot_score=0)
+        out = StringIO()
+        call_command('refresh_rankings', batch_size=2, stdout=out)
+        self.new.refresh_from_db()
+        self.assertEqual(self.new.hot_score,
+                         hot_score(0, self.new.created_at))
+        self.assertIn('3 post(s) checked, 1 ranking(s) updated',
+                      out.getvalue())
+
+
+class CommentSortTest(TestCase):
+    """
+    Tests the comment sort modes of the post page.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        rendered_order(query): Returns the comment ids in page order.
+        test_comment_scores(): Tests the best and controversial formulas.
+        test_best_sort_orders_threads_and_replies(): Tests the best sort.
+        test_new_and_controversial_sorts(): Tests two more sort modes.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a post with two threads of replies whose
+        vote counts are set directly and their rankings refreshed.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+
+        def comment(content, parent=None, upvotes=0, downvotes=0):
+            node = Comment.objects.create(post=self.post, author=self.user,
+                                          content=content, parent=parent)
+            Comment.objects.filter(pk=node.pk).update(
+                upvote_count=upvotes, downvote_count=downvotes,
+                score=upvotes - downvotes)
+            return node
+
+        self.first = comment('first', upvotes=1)
+        self.second = comment('second', upvotes=10)
+        self.old_reply = comment('old reply', self.second, 2, 2)
+        self.good_reply = comment('good reply', self.second, 5)
+        refresh_comment_scores(Comment.objects.all())
+
+    def rendered_order(self, query):
+        """
+        Returns the ids of the comments in the order they are rendered.
+
+        Args:
+            query (str): The query string of the post page.
+
+        Returns:
+            list: The comment ids in page order.
+        """
+        content = self.client.get(
+            reverse('post_detail', args=[self.post.slug]) + query
+        ).content.decode()
+        comments = [self.first, self.second, self.old_reply,
+                    self.good_reply]
+        return [node.id for node in sorted(
+            comments, key=lambda node: content.index(
+                f'id="comment-{node.id}"'))]
+
+    def test_comment_scores(self):
+        """
+        Tests that the best ranking rewards more evidence and that the
+        controversial ranking rewards evenly split votes.
+        """
+        self.assertEqual(wilson_score(0, 0), 0)
+        self.assertGreater(wilson_score(10, 0), wilson_score(1, 0))
+        self.assertGreater(wilson_score(10, 1), wilson_score(2, 0))
+        self.assertGreater(controversy_score(5, 5), controversy_score(10, 1))
+        self.assertEqual(controversy_score(10, 0), 0)
+
+    def test_best_sort_orders_threads_and_replies(self):
+        """
+        Tests that best is the default and orders threads and replies by
+        their Wilson score.
+        """
+        expected = [self.second.id, self.good_reply.id, self.old_reply.id,
+                    self.first.id]
+        self.assertEqual(self.rendered_order(''), expected)
+        self.assertEqual(self.rendered_order('?comment_sort=best'), expected)
+
+    def test_new_and_controversial_sorts(self):
+        """
+        Tests the new and controversial sort modes.
+        """
+        self.assertEqual(self.rendered_order('?comment_sort=new'), [
+            self.second.id, self.good_reply.id, self.old_reply.id,
+            self.first.id])
+        self.assertEqual(
+            self.rendered_order('?comment_sort=controversial'), [
+                self.first.id, self.second.id, self.old_reply.id,
+                self.good_reply.id])
+
+
+class ThreadPaginationTest(TestCase):
+    """
+    Tests that the comments of the post page are paginated by thread.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        page_ids(page): Returns the ids of the comments on a page.
+        test_threads_are_not_split(): Tests that pages hold whole threads.
+        test_page_queries_do_not_grow(): Tests the queries of a page.
+        test_heading_counts_threads(): Tests the count in the heading.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a post with twelve threads, the oldest of which
+        has a reply with a nested reply.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+        self.roots = [
+            Comment.objects.create(post=self.post, author=self.user,
+                                   content=f'thread {index}')
+            for index in range(12)]
+        self.reply = Comment.objects.create(
+            post=self.post, author=self.user, content='reply',
+            parent=self.roots[0])
+        self.nested = Comment.objects.create(
+            post=self.post, author=self.user, content='nested',
+            parent=self.reply)
+
+    def page_ids(self, page):
+        """
+        Returns the ids of the comments on a page of the newest first sort.
+
+        Args:
+            page (int): The page number.
+
+        Returns:
+            set: The ids of the comments in the page's context.
+        """
+        response = self.client.get(
+            reverse('post_detail', args=[self.post.slug]),
+            {'page': page, 'comment_sort': 'new'})
+        return {comment.id for comment in response.context['comments']}
+
+    def test_threads_are_not_split(self):
+        """
+        Tests that a page holds ten threads with all their replies.
+        """
+        self.assertEqual(self.page_ids(1),
+                         {root.id for root in self.roots[2:]})
+        self.assertEqual(self.page_ids(2), {
+            self.roots[0].id, self.roots[1].id, self.reply.id,
+            self.nested.id})
+
+    def test_page_queries_do_not_grow(self):
+        """
+        Tests that the number of queries of a page does not grow with the
+        number of comments on other pages.
+        """
+        def page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.page_ids(2)
+            return len(queries)
+
+        before = page_queries()
+        for root in self.roots[2:]:
+            for _ in range(3):
+                Comment.objects.create(post=self.post, author=self.user,
+                                       content='more', parent=root)
+        self.assertEqual(page_queries(), before)
+
+    def test_heading_counts_threads(self):
+        """
+        Tests that the heading shows the thread count of the paginator, so
+        the page runs no other count of the comments.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('post_detail', args=[self.post.slug]))
+        self.assertContains(response, '12 comment threads')
+        self.assertEqual(sum('COUNT(' in query['sql']
+                             for query in queries.captured_queries), 1)
+
+
+@override_settings(COMMENT_THREAD_DEPTH=1, COMMENT_THREAD_REPLIES=2)
+class CommentRepliesTest(TestCase):
+    """
+    Tests the depth and reply limits of comment threads and the view that
+    loads more replies.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        replies(comment, **params): Requests the replies of a comment.
+        test_threads_are_limited(): Tests the limits on the post page.
+        test_load_more_replies(): Tests loading the next replies as JSON.
+        test_load_replies_below_depth(): Tests loading hidden nested replies.
+        test_replies_fragment(): Tests loading the next replies as HTML.
+        test_invalid_offset(): Tests that a bad offset is rejected.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a post with one thread of four replies, the
+        newest of which has a nested reply.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+        self.root = Comment.objects.create(post=self.post, author=self.user,
+                                           content='root')
+        self.children = [
+            Comment.objects.create(post=self.post, author=self.user,
+                                   content=f'reply {index}', parent=self.root)
+            for index in range(4)]
+        self.nested = Comment.objects.create(
+            post=self.post, author=self.user, content='nested',
+            parent=self.children[3])
+
+    def replies(self, comment, **params):
+        """
+        Requests the replies of a comment in the newest first sort.
+
+        Args:
+            comment (Comment): The comment whose replies are requested.
+            **params: More query parameters.
+
+        Returns:
+            HttpResponse: The response of the comment_replies view.
+        """
+        return self.client.get(
+            reverse('comment_replies', args=[comment.id]),
+            {'comment_sort': 'new', **params})
+
+    def test_threads_are_limited(self):
+        """
+        Tests that the post page only renders the newest two replies, not
+        the nested reply, and offers to load the rest.
+        """
+        response = self.client.get(
+            reverse('post_detail', args=[self.post.slug]),
+            {'comment_sort': 'new'})
+        comments = list(response.context['comments'])
+        self.assertEqual([comment.id for comment in comments], [
+            self.root.id, self.children[3].id, self.children[2].id])
+        self.assertEqual(
+            (comments[0].shown_replies, comments[0].more_replies), (2, 2))
+        self.assertEqual(
+            (comments[1].shown_replies, comments[1].more_replies), (0, 1))
+        self.assertContains(response, f'id="more-replies-{self.root.id}"')
+        self.assertNotContains(response, f'id="comment-{self.nested.id}"')
+
+    def test_load_more_replies(self):
+        """
+        Tests that the next replies of a comment are returned as JSON.
+        """
+        data = self.replies(self.root, offset=2, format='json').json()
+        self.assertEqual([comment['id'] for comment in data['comments']],
+                         [self.children[1].id, self.children[0].id])
+        self.assertEqual(data['next_offset'], 4)
+        self.assertFalse(data['has_more'])
+        self.assertIn(f'id="comment-{self.children[0].id}"', data['html'])
+
+        data = self.replies(self.root, format='json').json()
+        self.assertEqual(data['next_offset'], 2)
+        self.assertTrue(data['has_more'])
+
+    def test_load_replies_below_depth(self):
+        """
+        Tests that replies below the depth limit can be loaded.
+        """
+        data = self.replies(self.children[3], format='json').json()
+        self.assertEqual([comment['id'] for comment in data['comments']],
+                         [self.nested.id])
+        self.assertFalse(data['has_more'])
+
+    def test_replies_fragment(self):
+        """
+        Tests that the replies are returned as an HTML fragment by default.
+        """
+        response = self.replies(self.root, offset=2)
+        self.assertContains(response, f'id="comment-{self.children[1].id}"')
+        self.assertNotContains(response, '<html')
+
+    def test_invalid_offset(self):
+        """
+        Tests that an invalid offset is rejected.
+        """
+        self.assertEqual(self.replies(self.root, offset='x').status_code, 400)
+        self.assertEqual(self.replies(self.root, offset=-1).status_code, 400)
+
+
+class CommentTreeTagTest(TestCase):
+    """
+    Tests the comment_tree template tag.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        render(source, comments): Renders a template with some comments.
+        test_matches_recursetree(): Tests the markup against recursetree.
+        test_page_queries_do_not_grow_with_replies(): Tests the queries of
+                                                the post page.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a post with two threads, the first with a
+        reply and a nested reply.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+        self.root = Comment.objects.create(post=self.post, author=self.user,
+                                           content='root')
+        self.reply = Comment.objects.create(
+            post=self.post, author=self.user, content='reply',
+            parent=self.root)
+        Comment.objects.create(post=self.post, author=self.user,
+                               content='nested', parent=self.reply)
+        Comment.objects.create(post=self.post, author=self.user,
+                               content='second root')
+
+    def render(self, source, comments):
+        """
+        Renders a template with some comments, as the post page's user.
+
+        Args:
+            source (str): The template source.
+            comments (list): The comments to render.
+
+        Returns:
+            str: The rendered template with whitespace collapsed and the
+                CSRF tokens, which are masked differently every time,
+                removed.
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        html = engines['django'].from_string(source).render(
+            {'comments': comments}, request)
+        html = re.sub(r'name="csrfmiddlewaretoken" value="[^"]*"', '', html)
+        return ' '.join(html.split())
+
+    def test_matches_recursetree(self):
+        """
+        Tests that comment_tree renders the same markup as recursetree
+        around the comment node template.
+        """
+        comments = Comment.objects.select_related('author')
+        nodes = load_subtrees(comments, list(thread_roots(comments, 'new')),
+                              'new')
+        html = self.render(
+            '{% load comment_tags %}{% comment_tree comments %}', nodes)
+        self.assertEqual(html, self.render(
+            '{% load mptt_tags %}{% recursetree comments %}'
+            "{% include 'post_hub/comment_node.html' %}{% endrecursetree %}",
+            nodes))
+        self.assertLess(html.index('second root'), html.index('>root<'))
+
+    def test_page_queries_do_not_grow_with_replies(self):
+        """
+        Tests that rendering more replies on the post page does not run
+        more queries, so no comment loads its author or counts lazily.
+        """
+        self.client.login(username='testuser', password='12345')
+
+        def page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(
+                    reverse('post_detail', args=[self.post.slug]))
+            return len(queries)
+
+        before = page_queries()
+        for _ in range(3):
+            Comment.objects.create(post=self.post, author=self.user,
+                                   content='more', parent=self.root)
+        self.assertEqual(page_queries(), before)
+
+
+@override_settings(
+    COMMENT_TREE_BACKEND='post_hub.tree_backends.ClosureTreeBackend')
+class ClosureTreeBackendTest(TestCase):
+    """
+    Tests the closure table comment tree backend and the command converting
+    the stored trees.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        links(comment): Returns the stored ancestor links of a comment.
+        test_insert_links(): Tests the links recorded for new comments.
+        test_tree_id_counter(): Tests that new threads take their tree_id
+                            from the counter.
+        test_tree_methods(): Tests the tree methods used by the views.
+        test_post_page_threads(): Tests the limited threads of the post page.
+        test_delete(): Tests that deleting a comment deletes its replies.
+        test_convert_comment_tree(): Tests converting MPTT trees and back.
+        test_incomplete_backend(): Tests that a backend missing a method
+                                cannot be created.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a post with a thread of two replies, the first
+        of which has a nested reply.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.post = Post.objects.create(title='Test Post', blurb='Test Blurb',
+                                        content='Test Content',
+                                        category=self.category,
+                                        author=self.user, status=1)
+        self.root = Comment.objects.create(post=self.post, author=self.user,
+                                           content='root')
+        self.child = Comment.objects.create(post=self.post, author=self.user,
+                                            content='child', parent=self.root)
+        self.nested = Comment.objects.create(
+            post=self.post, author=self.user, content='nested',
+            parent=self.child)
+        self.sibling = Comment.objects.create(
+            post=self.post, author=self.user, content='sibling',
+            parent=self.root)
+
+    def links(self, comment):
+        """
+        Returns the stored ancestor links of a comment.
+
+        Args:
+            comment (Comment): The comment whose links are returned.
+
+        Returns:
+            set: (ancestor id, depth) pairs.
+        """
+        return set(CommentClosure.objects.filter(
+            descendant=comment).values_list('ancestor_id', 'depth'))
+
+    def test_insert_links(self):
+        """
+        Tests that a new comment is linked to itself and its ancestors and
+        keeps its thread's tree_id and its level.
+        """
+        self.assertEqual(self.links(self.nested), {
+            (self.nested.id, 0), (self.child.id, 1), (self.root.id, 2)})
+        self.assertEqual(self.links(self.root), {(self.root.id, 0)})
+        self.assertEqual(self.nested.tree_id, self.root.tree_id)
+        self.assertEqual(self.nested.level, 2)
+        other = Comment.objects.create(post=self.post, author=self.user,
+                                       content='other root')
+        self.assertEqual(other.tree_id, self.root.tree_id + 1)
+
+    def test_tree_id_counter(self):
+        """
+        Tests that a new thread takes the tree_id of the counter, which stays
+        ahead of tree ids already taken by threads not saved yet, and that
+        the counter moves past it.
+        """
+        CommentTreeCounter.objects.update(next_tree_id=self.root.tree_id + 5)
+        other = Comment.objects.create(post=self.post, author=self.user,
+                                       content='other root')
+        self.assertEqual(other.tree_id, self.root.tree_id + 5)
+        self.assertEqual(CommentTreeCounter.objects.get().next_tree_id,
+                         other.tree_id + 1)
+        reply = Comment.objects.create(post=self.post, author=self.user,
+                                       content='reply', parent=other)
+        self.assertEqual(reply.tree_id, other.tree_id)
+        self.assertEqual(CommentTreeCounter.objects.get().next_tree_id,
+                         other.tree_id + 1)
+
+    def test_tree_methods(self):
+        """
+        Tests the descendants, ancestors, descendant count and leaf check.
+        """
+        self.assertEqual(list(self.root.get_descendants()),
+                         [self.child, self.sibling, self.nested])
+        self.assertEqual(list(self.nested.get_ancestors()),
+                         [self.root, self.child])
+        self.assertEqual(list(self.nested.get_ancestors(ascending=True)),
+                         [self.child, self.root])
+        self.assertEqual(self.root.get_descendant_count(), 3)
+        self.assertFalse(self.child.is_leaf_node())
+        self.assertTrue(self.nested.is_leaf_node())
+
+    @override_settings(COMMENT_THREAD_DEPTH=1, COMMENT_THREAD_REPLIES=1)
+    def test_post_page_threads(self):
+        """
+        Tests that the post page loads the limited threads and counts the
+        replies left out.
+        """
+        response = self.client.get(
+            reverse('post_detail', args=[self.post.slug]))
+        comments = list(response.context['comments'])
+        self.assertEqual([comment.id for comment in comments],
+                         [self.root.id, self.child.id])
+        self.assertEqual(
+            (comments[0].shown_replies, comments[0].more_replies), (1, 1))
+        self.assertEqual(
+            (comments[1].shown_replies, comments[1].more_replies), (0, 1))
+        self.assertContains(response, f'id="more-replies-{self.root.id}"')
+
+    def test_delete(self):
+        """
+        Tests that deleting a comment deletes its replies and their links.
+        """
+        self.child.delete()
+        self.assertEqual(
+            set(Comment.objects.values_list('id', flat=True)),
+            {self.root.id, self.sibling.id})
+        self.assertFalse(CommentClosure.objects.filter(
+            descendant=self.nested.id).exists())
+
+    def test_convert_comment_tree(self):
+        """
+        Tests that converting MPTT trees links every comment to its MPTT
+        ancestors, and that converting back restores the nested sets.
+        """
+        with override_settings(
+                COMMENT_TREE_BACKEND='post_hub.tree_backends.MPTTTreeBackend'):
+            Comment.objects.all().delete()
+            root = Comment.objects.create(post=self.post, author=self.user,
+                                          content='mptt root')
+            child = Comment.objects.create(post=self.post, author=self.user,
+                                           content='mptt child', parent=root)
+            nested = Comment.objects.create(
+                post=self.post, author=self.user, content='mptt nested',
+                parent=child)
+            expected = {
+                comment.id: {(ancestor.id, comment.level - ancestor.level)
+                             for ancestor in comment.get_ancestors(
+                                 include_self=True)}
+                for comment in (root, child, nested)}
+            self.assertFalse(CommentClosure.objects.exists())
+
+        call_command('convert_comment_tree', 'closure', stdout=StringIO())
+        for comment in (root, child, nested):
+            self.assertEqual(self.links(comment), expected[comment.id])
+        self.assertEqual(root.get_descendant_count(), 2)
+
+        call_command('convert_comment_tree', 'mptt', stdout=StringIO())
+        self.assertFalse(CommentClosure.objects.exists())
+        root.refresh_from_db()
+        self.assertEqual((root.lft, root.rght), (1, 6))
+
+    def test_incomplete_backend(self):
+        """
+        Tests that a backend which does not implement the whole interface
+        fails when it is created rather than when a method is called.
+        """
+        class PartialBackend(BaseTreeBackend):
+            def prepare_insert(self, comment):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialBackend()
+
+
+class GroupWallTest(TestCase):
+    """
+    Tests the paginated comment wall of a group.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        wall(**params): Requests the group page.
+        test_wall_is_paginated(): Tests the threads on each wall page.
+        test_wall_queries_do_not_grow(): Tests the queries of a wall page.
+        test_replies_in_posting_order(): Tests the order of wall replies.
+        test_post_wall_comment(): Tests posting a comment on the wall.
+        test_links_keep_other_params(): Tests that the sort and page links
+                                    keep the other query parameters.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a group whose wall has twelve threads, each
+        with one reply.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.group = UserGroup.objects.create(
+            name='Test Group', slug='test-group', admin=self.user)
+        self.roots = []
+        for index in range(12):
+            root = Comment.objects.create(group=self.group, author=self.user,
+                                          content=f'wall {index}')
+            Comment.objects.filter(pk=root.pk).update(
+                created_at=timezone.now() - timedelta(minutes=12 - index))
+            Comment.objects.create(group=self.group, author=self.user,
+                                   content=f'reply {index}', parent=root)
+            self.roots.append(root)
+
+    def wall(self, **params):
+        """
+        Requests the group page.
+
+        Args:
+            **params: Query parameters.
+
+        Returns:
+            HttpResponse: The response of the group_detail view.
+        """
+        return self.client.get(
+            reverse('group_detail', args=[self.group.slug]), params)
+
+    def test_wall_is_paginated(self):
+        """
+        Tests that the wall shows the newest threads first, a page of
+        threads at a time, with their replies.
+        """
+        response = self.wall()
+        comments = response.context['comments']
+        roots = [comment.id for comment in comments if comment.level == 0]
+        self.assertEqual(roots, [root.id for root in self.roots[:1:-1]])
+        self.assertEqual(len(comments.object_list), 20)
+        self.assertEqual(response.context['thread_count'], 12)
+        self.assertContains(response, '12 comment threads')
+        self.assertContains(response, 'comment_page=2')
+
+        comments = self.wall(comment_page=2).context['comments']
+        self.assertEqual(
+            [comment.id for comment in comments if comment.level == 0],
+            [self.roots[1].id, self.roots[0].id])
+
+    def test_wall_queries_do_not_grow(self):
+        """
+        Tests that more wall threads do not make the page run more queries.
+        """
+        self.client.login(username='testuser', password='12345')
+
+        def page_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.wall()
+            return len(queries)
+
+        before = page_queries()
+        for index in range(5):
+            root = Comment.objects.create(group=self.group, author=self.user,
+                                          content=f'more {index}')
+            Comment.objects.create(group=self.group, author=self.user,
+                                   content='more reply', parent=root)
+        self.assertEqual(page_queries(), before)
+
+    def test_replies_in_posting_order(self):
+        """
+        Tests that the replies of a wall thread are shown oldest first, both
+        on the page and by the load more replies button.
+        """
+        root = self.roots[-1]
+        later = Comment.objects.create(group=self.group, author=self.user,
+                                       content='later reply', parent=root)
+        response = self.wall()
+        replies = [comment.content for comment in response.context['comments']
+                   if comment.parent_id == root.id]
+        self.assertEqual(replies, ['reply 11', 'later reply'])
+        self.assertContains(response, 'data-comment-sort=""')
+        replies = self.client.get(
+            reverse('comment_replies', args=[root.id]),
+            {'format': 'json', 'comment_sort': ''}).json()['comments']
+        self.assertEqual([reply['id'] for reply in replies][-1], later.id)
+
+    def test_post_wall_comment(self):
+        """
+        Tests that a comment posted on the wall is shown first.
+        """
+        self.client.login(username='testuser', password='12345')
+        response = self.client.post(
+            reverse('group_detail', args=[self.group.slug]),
+            {'form_type': 'comment_form', 'content': 'new wall comment'})
+        self.assertRedirects(
+            response, reverse('group_detail', args=[self.group.slug]))
+        comments = self.wall().context['comments']
+        self.assertEqual(comments[0].content, 'new wall comment')
+        self.assertEqual(comments[0].group, self.group)
+
+    def test_links_keep_other_params(self):
+        """
+        Tests that the sort links keep the wall page and drop the post
+        cursor, and that the wall page links keep the post listing.
+        """
+        response = self.wall(comment_page=2, cursor='abc', sort='top',
+                             t='day')
+        self.assertContains(response, 'href="?comment_page=2&amp;sort=new"')
+        self.assertContains(
+            response, 'href="?comment_page=2&amp;sort=top&amp;t=week"')
+        self.assertContains(
+            response, 'href="?comment_page=1&amp;cursor=abc&amp;sort=top'
+                      '&amp;t=day#comments-section"')
+
+
+class CursorPaginationTest(TestCase):
+    """
+    Tests the cursor pagination of post listings.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        walk(queryset, per_page): Follows the next cursors of a listing.
+        test_pages_cover_listing(): Tests that the pages visit every post
+                                once, in order.
+        test_previous_and_last(): Tests going back and to the last page.
+        test_invalid_cursor(): Tests that a bad cursor shows the first page.
+        test_home_page(): Tests the cursor pages of the home page.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a client, a user, a category and eleven posts,
+        some of them sharing a creation date and a score.
+        """
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        now = timezone.now()
+        for index in range(11):
+            post = Post.objects.create(
+                title=f'Post {index}', content='Test Content',
+                category=self.category, author=self.user)
+            Post.objects.filter(pk=post.pk).update(
+                created_at=now - timedelta(hours=index // 3),
+                score=index % 4)
+        refresh_hot_scores(Post.objects.all())
+
+    def walk(self, queryset, per_page):
+        """
+        Follows the next cursors of a listing from its first page.
+
+        Args:
+            queryset (QuerySet): The ordered posts.
+            per_page (int): The number of posts on a page.
+
+        Returns:
+            list: The pages, each a list of post ids.
+        """
+        paginator = CursorPaginator(queryset, per_page)
+        pages, page = [], paginator.page(None)
+        while True:
+            pages.append([post.id for post in page])
+            if not page.has_next():
+                return pages
+            page = paginator.page(page.next_cursor)
+
+    def test_pages_cover_listing(self):
+        """
+        Tests that following the next cursors visits every post once, in
+        the order of the listing, in each sort mode.
+        """
+        for sort in SORTS:
+            posts = Post.objects.ranked(sort)
+            pages = self.walk(posts, 4)
+            self.assertEqual([len(page) for page in pages], [4, 4, 3])
+            self.assertEqual(
+                sum(pages, []),
+                list(posts.order_by(*posts.query.order_by, '-pk')
+                     .values_list('id', flat=True)))
+
+    def test_previous_and_last(self):
+        """
+        Tests that the previous cursor returns the page before, and that the
+        last cursor returns the end of the listing.
+        """
+        paginator = CursorPaginator(Post.objects.ranked('new'), 4)
+        first = paginator.page(None)
+        second = paginator.page(first.next_cursor)
+        self.assertFalse(first.has_previous())
+        self.assertEqual(list(paginator.page(second.previous_cursor)),
+                         list(first))
+        last = paginator.page(paginator.last_cursor)
+        self.assertEqual(len(last), 4)
+        self.assertFalse(last.has_next())
+        self.assertTrue(last.has_previous())
+        self.assertEqual(paginator.count, 11)
+
+    def test_invalid_cursor(self):
+        """
+        Tests that a tampered cursor, or one made for another ordering,
+        shows the first page.
+        """
+        new = CursorPaginator(Post.objects.ranked('new'), 4)
+        hot = CursorPaginator(Post.objects.ranked('hot'), 4)
+        cursor = new.page(None).next_cursor
+        self.assertEqual(list(new.get_page(cursor[:-2] + 'xx')),
+                         list(new.page(None)))
+        self.assertEqual(list(hot.get_page(cursor)), list(hot.page(None)))
+
+    def test_home_page(self):
+        """
+        Tests that the home page follows its cursor links without counting
+        the posts.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertFalse(any('__count' in query['sql']
+                             for query in queries.captured_queries))
+        page = response.context['page_obj']
+        self.assertEqual(len(response.context['post_list']), 8)
+        self.assertContains(response, 'cursor=')
+        response = self.client.get(reverse('home'),
+                                   {'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['post_list']), 3)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    """
+    Tests the estimated count paginator.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        paginator(estimate, cached_count_min): Returns a paginator of the
+                                            posts with a fixed estimate.
+        test_large_estimate_is_used(): Tests that no count query runs.
+        test_small_estimate_is_counted(): Tests the exact count fallback.
+        test_large_exact_count_is_cached(): Tests the exact count cache.
+        test_admin_changelist(): Tests the paginator of the post admin.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method clears the cache and creates a staff user, a category
+        and three posts.
+        """
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            username='admin', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        for index in range(3):
+            Post.objects.create(title=f'Post {index}', content='Test Content',
+                                category=self.category, author=self.user)
+
+    def paginator(self, estimate, cached_count_min=10_000):
+        """
+        Returns a paginator of the posts whose planner estimate is fixed.
+
+        Args:
+            estimate (int): The estimate to report, or None.
+            cached_count_min (int): The smallest exact count to cache.
+
+        Returns:
+            EstimatedCountPaginator: The paginator.
+        """
+        class FixedEstimatePaginator(EstimatedCountPaginator):
+            def estimate(self):
+                return estimate
+
+        FixedEstimatePaginator.cached_count_min = cached_count_min
+        return FixedEstimatePaginator(Post.objects.order_by('-id'), 2)
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_large_estimate_is_used(self):
+        """
+        Tests that an estimate above the threshold numbers the pages
+        without counting.
+        """
+        paginator = self.paginator(5000)
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.num_pages, 2500)
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_small_estimate_is_counted(self):
+        """
+        Tests that the rows are counted exactly below the threshold, or
+        without an estimate, as on SQLite.
+        """
+        self.assertEqual(self.paginator(999).count, 3)
+        self.assertIsNone(estimate_count(Post.objects.all()))
+        self.assertEqual(
+            EstimatedCountPaginator(Post.objects.order_by('pk'), 2).count, 3)
+
+    def test_large_exact_count_is_cached(self):
+        """
+        Tests that exact counts are only cached from cached_count_min up.
+        """
+        self.assertEqual(self.paginator(None, cached_count_min=5).count, 3)
+        Post.objects.create(title='Post 3', content='Test Content',
+                            category=self.category, author=self.user)
+        self.assertEqual(self.paginator(None, cached_count_min=5).count, 4)
+        self.assertEqual(self.paginator(None, cached_count_min=3).count, 4)
+        Post.objects.create(title='Post 4', content='Test Content',
+                            category=self.category, author=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.paginator(None, cached_count_min=3).count, 4)
+
+    def test_admin_changelist(self):
+        """
+        Tests that the post changelist pages with the estimated count
+        paginator.
+        """
+        self.client.login(username='admin', password='12345')
+        response = self.client.get(reverse('admin:post_hub_post_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context['cl'].paginator,
+                              EstimatedCountPaginator)
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+
+class QueryPlanTest(TestCase):
+    """
+    Tests that the listing queries of each view are answered from an index.
+
+    Methods:
+        setUpTestData(): Seeds posts, comments and a group wall.
+        plans(url, **params): Returns the query plans of a page.
+        assertIndexed(url, **params): Fails if a query of a page scans the
+                                    post or comment table.
+        test_listings(): Tests the post listings.
+        test_comment_pages(): Tests the post page and the group wall.
+        test_profile(): Tests the profile page.
+    """
+    TABLES = ('post_hub_post', 'post_hub_comment')
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Seeds posts, comments and a group wall.
+
+        This method creates a user, a category, a group, posts in and out
+        of the group, comments with replies on one post and on the wall.
+        The tables are then analyzed so the planner sees their sizes.
+        """
+        cls.user = User.objects.create_user(
+            username='testuser', password='12345')
+        cls.category = Category.objects.create(category_name='test category')
+        cls.group = UserGroup.objects.create(
+            name='Test Group', slug='test-group', admin=cls.user)
+        posts = Post.objects.bulk_create([
+            Post(title=f'Post {index}', slug=f'post-{index}',
+                 content='Test Content', category=cls.category,
+                 author=cls.user, status=index % 5 != 0,
+                 group=cls.group if index % 3 == 0 else None)
+            for index in range(300)])
+        cls.post = posts[1]
+        for index in range(30):
+            root = Comment.objects.create(post=cls.post, author=cls.user,
+                                          content=f'root {index}')
+            Comment.objects.create(post=cls.post, author=cls.user,
+                                   content='reply', parent=root)
+            wall = Comment.objects.create(group=cls.group, author=cls.user,
+                                          content=f'wall {index}')
+            Comment.objects.create(group=cls.group, author=cls.user,
+                                   content='reply', parent=wall)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plans(self, url, **params):
+        """
+        Returns the query plans of the queries a page runs.
+
+        Args:
+            url (str): The page to request.
+            **params: Query parameters.
+
+        Returns:
+            list: (query, plan) pairs, the plan being a list of steps.
+        """
+        self.client.login(username='testuser', password='12345')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.append((query['sql'],
+                              [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertIndexed(self, url, **params):
+        """
+        Fails if a query of a page reads the post or comment table without
+        an index.
+
+        Args:
+            url (str): The page to request.
+            **params: Query parameters.
+        """
+        for sql, plan in self.plans(url, **params):
+            for step in plan:
+                for table in self.TABLES:
+                    if re.fullmatch(rf'SCAN {table}( AS \w+)?', step):
+                        self.fail(f'Sequential scan of {table} in {sql}')
+
+    def test_listings(self):
+        """
+        Tests the home, category and group pages in each sort mode.
+        """
+        for sort in SORTS:
+            self.assertIndexed(reverse('home'), sort=sort)
+            self.assertIndexed(
+                reverse('category_detail', args=[self.category.slug]),
+                sort=sort)
+            self.assertIndexed(
+                reverse('group_detail', args=[self.group.slug]), sort=sort)
+
+    def test_comment_pages(self):
+        """
+        Tests the post page in each comment sort.
+        """
+        for sort in COMMENT_SORTS:
+            self.assertIndexed(reverse('post_detail', args=[self.post.slug]),
+                               comment_sort=sort)
+
+    def test_profile(self):
+        """
+        Tests the profile page.
+        """
+        self.assertIndexed(reverse('view_profile', args=['testuser']))
+
+
+class ListingQueryTest(TestCase):
+    """
+    Tests that post listings load their cards with a constant number of
+    queries.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        add_posts(count): Adds posts by new authors in new categories.
+        assertConstantQueries(url): Fails if more posts make a page run
+                                more queries.
+        test_for_listing(): Tests the loaded fields and counts.
+        test_listing_queries(): Tests the listing pages.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a user, a category, a group and two posts in
+        them.
+        """
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.group = UserGroup.objects.create(
+            name='Test Group', slug='test-group', admin=self.user)
+        self.added = 0
+        self.add_posts(2)
+        self.client.login(username='testuser', password='12345')
+
+    def add_posts(self, count):
+        """
+        Adds posts to the group, each by a new author in a new category
+        and with a comment. Every other post is also by the test user in
+        the test category.
+
+        Args:
+            count (int): The number of posts to add.
+        """
+        for _ in range(count):
+            self.added += 1
+            index = self.added
+            author = User.objects.create_user(username=f'author{index}')
+            category = Category.objects.create(category_name=f'cat {index}')
+            post = Post.objects.create(
+                title=f'Post {index}', content='Test Content',
+                author=self.user if index % 2 else author,
+                category=self.category if index % 2 else category,
+                group=self.group)
+            Comment.objects.create(post=post, author=author, content='hi')
+
+    def assertConstantQueries(self, url):
+        """
+        Fails if adding posts makes a page run more queries.
+
+        The page is requested once before counting, so the cached sidebar
+        widgets are loaded in both counts.
+
+        Args:
+            url (str): The page to request.
+        """
+        def page_queries():
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            return len(queries)
+
+        before = page_queries()
+        self.add_posts(4)
+        self.assertEqual(page_queries(), before)
+
+    def test_for_listing(self):
+        """
+        Tests that for_listing joins the related rows, counts the approved
+        comments and defers the content.
+        """
+        post = Post.objects.get(title='Post 1')
+        Comment.objects.create(post=post, author=self.user, content='hidden',
+                               status=False)
+        with self.assertNumQueries(1):
+            post = Post.objects.for_listing().get(pk=post.pk)
+            self.assertEqual(
+                (post.author.username, post.category.category_name,
+                 post.group.name, post.comment_count),
+                ('testuser', 'test category', 'Test Group', 1))
+        self.assertIn('content', post.get_deferred_fields())
+
+    def test_listing_queries(self):
+        """
+        Tests the home, category, group and profile pages.
+        """
+        self.assertConstantQueries(reverse('home'))
+        self.assertConstantQueries(
+            reverse('category_detail', args=[self.category.slug]))
+        self.assertConstantQueries(
+            reverse('group_detail', args=[self.group.slug]))
+        self.assertConstantQueries(reverse('view_profile', args=['testuser']))
+
+
+class SidebarTest(TestCase):
+    """
+    Tests the cached sidebar widgets.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_widgets_are_cached(): Tests that cached widgets run no queries.
+        test_post_invalidates_categories(): Tests the post signals.
+        test_membership_invalidates_groups(): Tests the membership signal.
+        test_suggested_categories(): Tests sampling the id pool.
+        test_context_processor(): Tests the widgets on the home page.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method clears the cache and creates two users, three
+        categories, one with a post, and two groups, one with a member.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.other = User.objects.create_user(
+            username='otheruser', password='12345')
+        self.categories = [
+            Category.objects.create(category_name=f'category {index}')
+            for index in range(3)]
+        Post.objects.create(title='Test Post', content='Test Content',
+                            category=self.categories[1], author=self.user)
+        self.groups = [
+            UserGroup.objects.create(name=f'Group {index}',
+                                     slug=f'group-{index}', admin=self.user)
+            for index in range(2)]
+        self.groups[1].members.add(self.user)
+
+    def test_widgets_are_cached(self):
+        """
+        Tests that the widgets are only computed once.
+        """
+        self.assertEqual(sidebar.top_categories()[0], self.categories[1])
+        self.assertEqual(sidebar.top_groups()[0], self.groups[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(sidebar.top_categories()[0].post_count, 1)
+            self.assertEqual(sidebar.top_groups()[0].num_members, 1)
+
+    def test_post_invalidates_categories(self):
+        """
+        Tests that a new post updates the top categories.
+        """
+        sidebar.top_categories()
+        for index in range(2):
+            Post.objects.create(title=f'Other Post {index}',
+                                content='Test Content',
+                                category=self.categories[2],
+                                author=self.user)
+        self.assertEqual(sidebar.top_categories()[0], self.categories[2])
+
+    def test_membership_invalidates_groups(self):
+        """
+        Tests that joining a group updates the top groups.
+        """
+        sidebar.top_groups()
+        self.groups[0].members.add(self.user, self.other)
+        self.assertEqual(sidebar.top_groups()[0], self.groups[0])
+        self.groups[0].members.clear()
+        self.assertEqual(sidebar.top_groups()[0], self.groups[1])
+
+    def test_suggested_categories(self):
+        """
+        Tests that suggestions are sampled from the cached id pool, with
+        one query once the pool is cached, and skip deleted categories.
+        """
+        self.assertCountEqual(sidebar.suggested_categories(),
+                              self.categories)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(sidebar.suggested_categories(2)), 2)
+        Category.objects.filter(pk=self.categories[0].pk).delete()
+        cache.set(sidebar.CATEGORY_IDS_KEY,
+                  [category.pk for category in self.categories])
+        self.assertCountEqual(sidebar.suggested_categories(),
+                              self.categories[1:])
+
+    def test_context_processor(self):
+        """
+        Tests that the home page shows the cached widgets.
+        """
+        response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['top_groups']),
+                         [self.groups[1], self.groups[0]])
+        self.assertContains(response, 'category 1')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        self.assertFalse(any('"num_members"' in query['sql']
+                             for query in queries.captured_queries))
+
+
+class GroupIndexTest(TestCase):
+    """
+    Tests the paginated group index.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        add_groups(count): Adds groups with members and posts.
+        test_for_index(): Tests the member counts and latest posts.
+        test_constant_queries(): Tests that more groups, posts and members
+                                run no more queries.
+        test_pagination(): Tests the cursor pages of the groups.
+        test_search(): Tests the search results.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method clears the cache and creates a user, a category and two
+        groups with members and posts.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='test category')
+        self.added = 0
+        self.add_groups(2)
+
+    def add_groups(self, count):
+        """
+        Adds groups, each with one member more than the last and with an
+        approved post followed by a blocked one.
+
+        Args:
+            count (int): The number of groups to add.
+        """
+        for _ in range(count):
+            self.added += 1
+            index = self.added
+            group = UserGroup.objects.create(
+                name=f'Group {index:02}', slug=f'group-{index}',
+                admin=self.user)
+            group.members.add(*[
+                User.objects.create_user(username=f'member{index}-{member}')
+                for member in range(index)])
+            for status in (1, 0):
+                Post.objects.create(
+                    title=f'Post {index} {status}', content='Test Content',
+                    author=self.user, category=self.category, group=group,
+                    status=status)
+
+    def test_for_index(self):
+        """
+        Tests that the groups are annotated with their member count and
+        latest approved post.
+        """
+        groups = UserGroup.objects.for_index().order_by('name')
+        self.assertEqual(
+            [(group.member_count, group.latest_post_id) for group in groups],
+            [(1, Post.objects.get(title='Post 1 1').pk),
+             (2, Post.objects.get(title='Post 2 1').pk)])
+        empty = UserGroup.objects.create(
+            name='Empty', slug='empty', admin=self.user)
+        empty = UserGroup.objects.for_index().get(pk=empty.pk)
+        self.assertEqual((empty.member_count, empty.latest_post_id), (0, None))
+
+    def test_constant_queries(self):
+        """
+        Tests that the index runs the same number of queries with more
+        groups, posts and members.
+        """
+        url = reverse('group_index') + '?q=group'
+
+        def page_queries():
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        before = page_queries()
+        self.add_groups(4)
+        self.assertEqual(page_queries(), before)
+        response = self.client.get(url)
+        self.assertContains(response, 'Members: 6')
+        self.assertContains(response, 'Post 6 1')
+        self.assertNotContains(response, 'Post 6 0')
+
+    def test_pagination(self):
+        """
+        Tests that the groups are split into cursor pages by name.
+        """
+        self.add_groups(10)
+        response = self.client.get(reverse('group_index'))
+        groups = response.context['groups']
+        self.assertEqual([group.name for group in groups],
+                         [f'Group {index:02}' for index in range(1, 11)])
+        self.assertTrue(groups.has_next())
+        response = self.client.get(reverse('group_index'),
+                                   {'cursor': groups.next_cursor})
+        self.assertEqual([group.name for group in response.context['groups']],
+                         ['Group 11', 'Group 12'])
+
+    def test_search(self):
+        """
+        Tests that only the matching groups are shown as search results.
+        """
+        response = self.client.get(reverse('group_index'), {'q': 'up 02'})
+        self.assertEqual([group.name for group in
+                          response.context['usergroups']], ['Group 02'])
+        self.assertEqual(response.context['usergroups'][0].latest_post.title,
+                         'Post 2 1')
+
+
+class SearchTest(TestCase):
+    """
+    Tests the full-text search.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        search(*terms, kinds): Returns the kinds and primary keys of the hits.
+        test_index_follows_rows(): Tests that the triggers keep the index
+                                current.
+        test_ranking(): Tests that title matches rank first.
+        test_max_ranked(): Tests that only the newest matches are ranked.
+        test_pagination(): Tests the cursor pages of the hits.
+        test_highlight(): Tests the marked and escaped snippets.
+        test_search_view(): Tests the search page.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method creates a user, a category, a group, a post and a
+        comment on it.
+        """
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.category = Category.objects.create(category_name='gardening')
+        self.group = UserGroup.objects.create(
+            name='Tomato growers', slug='tomato-growers', admin=self.user,
+            description='People who grow tomatoes')
+        self.post = Post.objects.create(
+            title='Growing tomatoes', content='<p>Plant them in spring</p>',
+            author=self.user, category=self.category)
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.user, content='Water them daily')
+
+    def search(self, *terms, kinds=None):
+        """
+        Returns the kinds and primary keys of the hits of the terms.
+
+        Args:
+            *terms (str): The searched terms.
+            kinds (list): The kinds searched, every kind if None.
+
+        Returns:
+            list: The (kind, pk) tuples, best first.
+        """
+        return [(hit.kind, hit.pk) for hit in get_search_backend().search(
+            list(terms), kinds or list(SEARCHABLE))]
+
+    def test_index_follows_rows(self):
+        """
+        Tests that new, edited, blocked and deleted rows are searched as
+        they are now.
+        """
+        self.assertCountEqual(self.search('tomato'), [
+            ('group', self.group.pk), ('post', self.post.pk)])
+        self.assertEqual(self.search('water'),
+                         [('comment', self.comment.pk)])
+        self.assertEqual(self.search('garden'),
+                         [('category', self.category.pk)])
+        self.post.content = 'Pick them in autumn'
+        self.post.save()
+        self.assertEqual(self.search('autumn'), [('post', self.post.pk)])
+        self.assertEqual(self.search('spring'), [])
+        Post.objects.filter(pk=self.post.pk).update(status=0)
+        self.assertEqual(self.search('autumn'), [])
+        Post.objects.filter(pk=self.post.pk).update(status=1)
+        self.assertEqual(self.search('autumn'), [('post', self.post.pk)])
+        self.comment.delete()
+        self.assertEqual(self.search('water'), [])
+
+    def test_ranking(self):
+        """
+        Tests that a title match ranks above a body match, and that every
+        term must match.
+        """
+        other = Post.objects.create(
+            title='Spring jobs', content='Sow tomatoes and beans',
+            author=self.user, category=self.category)
+        self.assertEqual(self.search('tomatoes', kinds=['post']),
+                         [('post', self.post.pk), ('post', other.pk)])
+        self.assertEqual(self.search('sow', 'bean'), [('post', other.pk)])
+        self.assertEqual(self.search('sow', 'carrots'), [])
+
+    @override_settings(SEARCH_MAX_RANKED=1)
+    def test_max_ranked(self):
+        """
+        Tests that a query only ranks its newest matches.
+        """
+        other = Post.objects.create(
+            title='Beans', content='Sow tomatoes and beans',
+            author=self.user, category=self.category)
+        self.assertEqual(self.search('tomatoes', kinds=['post']),
+                         [('post', other.pk)])
+
+    def test_pagination(self):
+        """
+        Tests that the hits are split into pages without repeats and that
+        the previous cursor goes back.
+        """
+        for index in range(4):
+            Post.objects.create(
+                title=f'Tomato {index}', content='Tomato ' * index,
+                author=self.user, category=self.category)
+        paginator = SearchPaginator(['tomato'], ['post'], 2)
+        pages = [paginator.get_page(None)]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        hits = [hit.pk for page in pages for hit in page]
+        self.assertEqual(len(pages), 3)
+        self.assertCountEqual(
+            hits, Post.objects.values_list('pk', flat=True))
+        self.assertEqual(
+            [hit.pk for hit in paginator.get_page(pages[2].previous_cursor)],
+            hits[2:4])
+        self.assertFalse(pages[0].has_previous())
+        self.assertEqual(
+            [hit.pk for hit in paginator.get_page('bad cursor')], hits[:2])
+
+    def test_highlight(self):
+        """
+        Tests that snippets are cut from the text without tags, with the
+        matching words marked and the text escaped.
+        """
+        self.assertEqual(parse_query('Tomato, "beans"!'), ['tomato', 'beans'])
+        self.assertEqual(
+            highlight('<p>Red <b>tomatoes</b> & <i>beans</i></p>',
+                      ['tomato']),
+            'Red <mark>tomatoes</mark> &amp; beans')
+        snippet = highlight(' '.join(['word'] * 50 + ['tomato']), ['tomato'],
+                            length=10)
+        self.assertTrue(snippet.startswith('&hellip; word'))
+        self.assertTrue(snippet.endswith('<mark>tomato</mark>'))
+
+    def test_search_view(self):
+        """
+        Tests that the search page lists and links the hits of each kind.
+        """
+        response = self.client.get(reverse('search'), {'q': 'tomatoes'})
+        self.assertContains(response, '<mark>tomatoes</mark>', html=False)
+        self.assertContains(response, reverse(
+            'post_detail', args=[self.post.slug]))
+        self.assertContains(response, reverse(
+            'group_detail', args=[self.group.slug]))
+        response = self.client.get(reverse('search'),
+                                   {'q': 'tomatoes', 'type': 'group'})
+        self.assertEqual([hit.kind for hit in response.context['results']],
+                         ['group'])
+        response = self.client.get(reverse('search'), {'q': 'nothing'})
+        self.assertContains(response, 'No results for')
+
+
+class AutocompleteTest(TestCase):
+    """
+    Tests the in-memory autocomplete of category and group names.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_prefix(): Tests the prefix matches.
+        test_fuzzy(): Tests the typo tolerant matches.
+        test_index_refresh(): Tests that saves and deletes rebuild the index.
+        test_autocomplete_view(): Tests the JSON endpoint.
+        test_form_suggests_category(): Tests the new category check of
+                                    PostForm.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method clears the cache and creates three categories.
+        """
+        cache.clear()
+        self.names = ['Web Development', 'Technology', 'Gardening']
+        self.categories = [Category.objects.create(category_name=name)
+                           for name in self.names]
+
+    def test_prefix(self):
+        """
+        Tests that names are matched from the start of any of their words,
+        ignoring case and spacing.
+        """
+        index = AutocompleteIndex(Entry(pk, name, '') for pk, name in [
+            (1, 'Web Development'), (2, 'Web Design'), (3, 'Cooking')])
+        self.assertEqual([entry.pk for entry in index.prefix('web')], [2, 1])
+        self.assertEqual([entry.pk for entry in index.prefix('DEV')], [1])
+        self.assertEqual([entry.pk for entry in index.prefix('web  de')],
+                         [2, 1])
+        self.assertEqual(len(index.prefix('web', limit=1)), 1)
+        self.assertEqual(index.prefix('x'), [])
+        self.assertEqual([entry.pk for entry in index.find(' cooking ')],
+                         [3])
+
+    def test_fuzzy(self):
+        """
+        Tests that misspelled names are matched within their edit distance,
+        which is one edit for queries of up to seven characters.
+        """
+        self.assertEqual(edit_distance('tehcnology', 'technology', 2), 1)
+        self.assertEqual(edit_distance('cat', 'dog', 2), 3)
+        index = get_index('category')
+        self.assertEqual([entry.name for entry in index.fuzzy('tehcnology')],
+                         ['Technology'])
+        self.assertEqual([entry.name for entry in index.fuzzy('gardnign')],
+                         ['Gardening'])
+        self.assertEqual(index.fuzzy('gardnig'), [])
+        self.assertEqual(index.suggest('technolgy'),
+                         (index.find('technology'), True))
+
+    def test_index_refresh(self):
+        """
+        Tests that the index is built once and rebuilt after a save or
+        delete.
+        """
+        index = get_index('category')
+        with self.assertNumQueries(0):
+            self.assertIs(get_index('category'), index)
+        Category.objects.create(category_name='Cooking')
+        self.assertEqual(
+            [entry.name for entry in get_index('category').prefix('coo')],
+            ['Cooking'])
+        self.categories[0].delete()
+        self.assertEqual(get_index('category').prefix('web'), [])
+        user = User.objects.create_user(username='testuser')
+        UserGroup.objects.create(name='Web Crafters', slug='web-crafters',
+                                 admin=user)
+        self.assertEqual(
+            [entry.slug for entry in get_index('group').prefix('craft')],
+            ['web-crafters'])
+
+    def test_autocomplete_view(self):
+        """
+        Tests that the endpoint returns prefix matches, falls back to fuzzy
+        matches and rejects unknown kinds.
+        """
+        response = self.client.get(
+            reverse('autocomplete', args=['category']), {'q': 'dev'})
+        self.assertEqual(response.json(), {'results': [{
+            'id': self.categories[0].pk, 'name': 'Web Development',
+            'slug': self.categories[0].slug}], 'fuzzy': False, 'page': 1,
+            'has_next': False})
+        response = self.client.get(
+            reverse('autocomplete', args=['category']), {'q': 'gardenign'})
+        self.assertEqual(response.json()['fuzzy'], True)
+        self.assertEqual(response.json()['results'][0]['name'], 'Gardening')
+        response = self.client.get(
+            reverse('autocomplete', args=['post']), {'q': 'dev'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_form_suggests_category(self):
+        """
+        Tests that a misspelled new category suggests the existing one, that
+        an existing name is accepted, and that the spell checker is shared.
+        """
+        data = {'title': 'Test Post', 'blurb': 'Blurb', 'content': 'Content',
+                'new_category': 'Gardenign'}
+        form = PostForm(data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn("Did you mean 'Gardening'?",
+                      form.errors['new_category'])
+        data['new_category'] = 'web development'
+        self.assertTrue(PostForm(data=data).is_valid())
+        self.assertIs(forms.spell_checker(), forms.spell_checker())
+
+
+class AutocompleteSelectTest(TestCase):
+    """
+    Tests the autocomplete selects of PostForm and the pages of the
+    autocomplete endpoint.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        test_endpoint_pages(): Tests paging through the names.
+        test_create_page_size(): Tests that the create page renders no
+                                names.
+        test_edit_page(): Tests that the edit page renders the selected
+                        names.
+        test_validation(): Tests that a submitted choice is looked up by
+                        primary key.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method clears the cache, creates a user with a post in a
+        group, and more categories than fit on a page.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.categories = [
+            Category.objects.create(category_name=f'Topic {index:02}')
+            for index in range(PAGE_SIZE + 5)]
+        self.group = UserGroup.objects.create(
+            name='Test Group', slug='test-group', admin=self.user)
+        self.post = Post.objects.create(
+            title='Test Post', content='Test Content', author=self.user,
+            category=self.categories[3], group=self.group)
+        self.client.login(username='testuser', password='12345')
+
+    def test_endpoint_pages(self):
+        """
+        Tests that an empty query pages through every name in order.
+        """
+        url = reverse('autocomplete', args=['category'])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), PAGE_SIZE)
+        self.assertTrue(first['has_next'])
+        second = self.client.get(url, {'page': 2}).json()
+        self.assertEqual([result['name'] for result in second['results']],
+                         [f'Topic {index}' for index in range(20, 25)])
+        self.assertFalse(second['has_next'])
+        self.assertEqual(
+            self.client.get(url, {'q': 'topic', 'page': 'x'}).json()['page'],
+            1)
+
+    def test_create_page_size(self):
+        """
+        Tests that the create page renders the selects empty with the
+        endpoint URLs, in the same queries however many names there are.
+        """
+        url = reverse('create_post')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(
+            response, reverse('autocomplete', args=['category']))
+        self.assertNotContains(response, 'Topic 01')
+        self.assertNotContains(response, 'Test Group')
+        for index in range(10):
+            Category.objects.create(category_name=f'More {index}')
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+    def test_edit_page(self):
+        """
+        Tests that the edit page renders only the post's category and
+        group.
+        """
+        response = self.client.get(
+            reverse('edit_post', args=[self.post.slug]))
+        self.assertContains(response, 'Topic 03')
+        self.assertContains(response, 'Test Group')
+        self.assertNotContains(response, 'Topic 04')
+
+    def test_validation(self):
+        """
+        Tests that a chosen category is accepted, and an unknown one is
+        rejected and rendered as no selection.
+        """
+        data = {'title': 'Other Post', 'blurb': 'Blurb',
+                'content': 'Content', 'category': self.categories[5].pk}
+        form = PostForm(data=data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['category'], self.categories[5])
+        data['category'] = 'abc'
+        form = PostForm(data=data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(str(form['category']).count('<option'), 1)
+
+
+class FailingStorageClient(BaseStorageClient):
+    """
+    A storage client whose uploads always fail, used by UploadQueueTest.
+    """
+    def upload(self, file, **options):
+        raise OSError('Storage unavailable')
+
+
+class UploadQueueTest(TestCase):
+    """
+    Tests the queue of image uploads and the run_workers command.
+
+    Methods:
+        setUp(): Sets up the test environment by creating necessary objects.
+        image(): Returns an uploaded image.
+        test_form_queues_upload(): Tests that a form stages its image and a
+                                worker sets the field.
+        test_retry_backoff(): Tests that a failed upload is retried later,
+                            then marked as failed.
+        test_claim(): Tests that a job is taken once, and that a worker
+                    whose lease ran out does not set the field.
+        test_newer_image(): Tests that a newer image drops the job of the
+                        older one.
+        test_remove_image(): Tests that removing a comment's image drops
+                        its queued upload.
+        test_run_workers(): Tests the run_workers command.
+    """
+    def setUp(self):
+        """
+        Sets up the test environment by creating necessary objects.
+
+        This method stores the uploads in a temporary directory with the
+        local storage client, and creates a user, a post and a comment.
+        """
+        uploads = tempfile.TemporaryDirectory()
+        self.addCleanup(uploads.cleanup)
+        local = override_settings(
+            UPLOAD_STORAGE_CLIENT='post_hub.uploads.LocalStorageClient',
+            UPLOAD_RETRY_SECONDS=30,
+            MEDIA_ROOT=uploads.name + '/media')
+        local.enable()
+        self.addCleanup(local.disable)
+        self.user = User.objects.create_user(
+            username='testuser', password='12345')
+        self.post = Post.objects.create(
+            title='Test Post', content='Test content', author=self.user,
+            category=Category.objects.create(category_name='Test Category'))
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.user, content='Test comment')
+        self.client.login(username='testuser', password='12345')
+
+    def image(self):
+        """
+        Returns an uploaded image.
+
+        Returns:
+            SimpleUploadedFile: A small JPEG image.
+        """
+        content = tempfile.SpooledTemporaryFile()
+        Image.new('RGB', (10, 10), color='red').save(content, format='JPEG')
+        content.seek(0)
+        return SimpleUploadedFile(
+            'photo.jpg', content.read(), content_type='image/jpeg')
+
+    def test_form_queues_upload(self):
+        """
+        Tests that saving a form stages the image and keeps the default
+        image until a worker uploaded it.
+        """
+        form = forms.GroupForm(
+            data={'name': 'Photos', 'description': 'Pictures'},
+            files={'group_image': self.image()})
+        self.assertTrue(form.is_valid(), form.errors)
+        group = form.save(commit=False)
+        group.admin = self.user
+        group.save()
+        group.refresh_from_db()
+        self.assertIn('default', str(group.group_image))
+        job = UploadJob.objects.get()
+        self.assertEqual(
+            (job.object_id, job.field_name, job.options['folder']),
+            (group.pk, 'group_image', 'groups/'))
+        self.assertTrue(job.name.endswith('.jpg'))
+        self.assertEqual(bytes(job.data)[:2], b'\xff\xd8')
+        self.assertEqual(run_pending_uploads(), (1, 0))
+        group.refresh_from_db()
+        self.assertTrue(str(group.group_image).startswith(
+            '/media/groups/' + job.name[:-4]))
+        self.assertFalse(UploadJob.objects.exists())
+
+    @override_settings(
+        UPLOAD_STORAGE_CLIENT='post_hub.tests.FailingStorageClient')
+    def test_retry_backoff(self):
+        """
+        Tests that a failed upload is retried after the retry delay, doubled
+        on each attempt, and marked as failed after the last attempt.
+        """
+        stage_upload(self.comment, 'image', self.image(), None)
+        self.comment.save()
+        self.assertEqual(run_pending_uploads(max_attempts=3), (0, 1))
+        job = UploadJob.objects.get()
+        self.assertEqual((job.status, job.attempts),
+                         (UploadJob.QUEUED, 1))
+        self.assertIn('Storage unavailable', job.last_error)
+        delay = job.run_at - timezone.now()
+        self.assertTrue(timedelta(seconds=25) < delay
+                        <= timedelta(seconds=30))
+        self.assertEqual(run_pending_uploads(max_attempts=3), (0, 0))
+        UploadJob.objects.update(run_at=timezone.now())
+        run_pending_uploads(max_attempts=3)
+        job.refresh_from_db()
+        self.assertTrue(timedelta(seconds=55) < job.run_at - timezone.now()
+                        <= timedelta(seconds=60))
+        UploadJob.objects.update(run_at=timezone.now())
+        run_pending_uploads(max_attempts=3)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (UploadJob.FAILED, 3))
+        UploadJob.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending_uploads(max_attempts=3), (0, 0))
+        self.comment.refresh_from_db()
+        self.assertFalse(self.comment.image)
+
+    def test_claim(self):
+        """
+        Tests that a taken job is not taken again until its lease ran out,
+        and that the worker that lost it does not set the field.
+        """
+        stage_upload(self.comment, 'image', self.image(), None)
+        self.comment.save()
+        first = claim_jobs(10)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(claim_jobs(10), [])
+        UploadJob.objects.update(run_at=timezone.now())
+        second = claim_jobs(10)
+        self.assertEqual(second[0].attempts, 2)
+        self.assertTrue(run_job(first[0]))
+        self.comment.refresh_from_db()
+        self.assertFalse(self.comment.image)
+        self.assertTrue(run_job(second[0]))
+        self.comment.refresh_from_db()
+        self.assertTrue(self.comment.image)
+
+    def test_newer_image(self):
+        """
+        Tests that a newer image of a field drops the queued upload of the
+        older one.
+        """
+        stage_upload(self.comment, 'image', self.image(), None)
+        self.comment.save()
+        older = UploadJob.objects.get()
+        stage_upload(self.comment, 'image', self.image(), None)
+        self.comment.save()
+        newer = UploadJob.objects.get()
+        self.assertNotEqual(older.pk, newer.pk)
+        self.assertNotEqual(older.name, newer.name)
+
+    def test_remove_image(self):
+        """
+        Tests that the edit_comment view queues a new image, and drops it
+        when the image is removed before it was uploaded.
+        """
+        url = reverse('edit_comment', args=[self.comment.pk])
+        response = self.client.post(
+            url, {'content': 'Edited', 'image': self.image()})
+        self.assertEqual(response.json(), {
+            'success': True, 'image': None, 'image_pending': True})
+        self.assertEqual(UploadJob.objects.count(), 1)
+        self.client.post(url, {'content': 'Edited', 'remove_image': 'true'})
+        self.assertFalse(UploadJob.objects.exists())
+
+    def test_run_workers(self):
+        """
+        Tests that the command runs the due uploads and queues the failed
+        ones again with --retry-failed.
+        """
+        stage_upload(self.comment, 'image', self.image(), None,
+                     folder='comments/')
+        self.comment.save()
+        UploadJob.objects.update(status=UploadJob.FAILED, attempts=5)
+        out = StringIO()
+        call_command('run_workers', '--once', '--workers', '1',
+                     '--retry-failed', stdout=out)
+        self.assertIn('Queued 1 failed uploads again.', out.getvalue())
+        self.assertIn('Uploaded 1 images, 0 attempts failed.', out.getvalue())
+        self.comment.refresh_from_db()
+        self.assertTrue(str(self.comment.image).startswith('/media/comments/'))
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """
+    A locmem email backend that fails its next sends, used by OutboxTest.
+
+    Attributes:
+        failures (int): The number of sends left to fail.
+        connections (set): The ids of the connections that sent emails.
+    """
+    failures = 0
+    connections = set()
+
+    def send_messages(self, messages):
+        FlakyEmailBackend.connections.add(id(self))
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='post_hub.tests.FlakyEmailBackend', OUTBOX_RETRY_SECONDS=60)
+class OutboxTest(TestCase):
+    """
+    Tests the outbox and the send_outbox command.
+
+    Methods:
+        setUp(): Resets the flaky email backend.
+        test_contact_form_queues_email(): Tests that the contact form
+                                        queues its email.
+        test_batches_share_connection(): Tests that the emails of several
+                                        batches are sent over one
+                                        connection.
+        test_retry_backoff(): Tests that a failed email is retried later,
+                            then marked as failed.
+        test_claim(): Tests that an email is taken once.
+        test_send_outbox(): Tests the send_outbox command.
+    """
+    def setUp(self):
+        """
+        Resets the flaky email backend before each test.
+        """
+        FlakyEmailBackend.failures = 0
+        FlakyEmailBackend.connections = set()
+
+    def test_contact_form_queues_email(self):
+        """
+        Tests that the contact form returns without sending the email, and
+        that the worker sends it.
+        """
+        response = self.client.post(reverse('send_email'), {
+            'name': 'Ann', 'email': 'ann@example.com', 'message': 'Hello'})
+        self.assertRedirects(response, reverse('contact'))
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        self.assertEqual(send_pending_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        sent = mail.outbox[0]
+        self.assertEqual(sent.subject, 'Message from Ann')
+        self.assertEqual(sent.from_email, 'ann@example.com')
+        self.assertEqual(sent.to, ['maxwise70@hotmail.co.uk'])
+        self.assertIn('Hello', sent.body)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_batches_share_connection(self):
+        """
+        Tests that the due emails are sent in batches over one connection.
+        """
+        for index in range(5):
+            queue_email(f'Subject {index}', 'Body', 'site@example.com',
+                        ['admin@example.com'])
+        self.assertEqual(send_pending_emails(batch_size=2), (5, 0))
+        self.assertEqual([sent.subject for sent in mail.outbox],
+                         [f'Subject {index}' for index in range(5)])
+        self.assertEqual(len(FlakyEmailBackend.connections), 1)
+
+    def test_retry_backoff(self):
+        """
+        Tests that a failed email is retried after the retry delay, doubled
+        on each attempt, and marked as failed after the last attempt while
+        the other emails are sent.
+        """
+        failing = queue_email('First', 'Body', 'site@example.com',
+                              ['admin@example.com'])
+        queue_email('Second', 'Body', 'site@example.com',
+                    ['admin@example.com'])
+        FlakyEmailBackend.failures = 1
+        self.assertEqual(send_pending_emails(max_attempts=2), (1, 1))
+        self.assertEqual([sent.subject for sent in mail.outbox], ['Second'])
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts),
+                         (OutboundEmail.QUEUED, 1))
+        self.assertIn('Connection unexpectedly closed', failing.last_error)
+        self.assertTrue(timedelta(seconds=55) < failing.run_at
+                        - timezone.now() <= timedelta(seconds=60))
+        self.assertEqual(send_pending_emails(max_attempts=2), (0, 0))
+        OutboundEmail.objects.update(run_at=timezone.now())
+        FlakyEmailBackend.failures = 1
+        self.assertEqual(send_pending_emails(max_attempts=2), (0, 1))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts),
+                         (OutboundEmail.FAILED, 2))
+        OutboundEmail.objects.update(run_at=timezone.now())
+        self.assertEqual(send_pending_emails(max_attempts=2), (0, 0))
+
+    def test_claim(self):
+        """
+        Tests that a taken email is not taken again until its lease ran
+        out.
+        """
+        queue_email('Subject', 'Body', 'site@example.com',
+                    ['admin@example.com'])
+        self.assertEqual(len(claim_emails(10)), 1)
+        self.assertEqual(claim_emails(10), [])
+        OutboundEmail.objects.update(run_at=timezone.now())
+        self.assertEqual(claim_emails(10)[0].attempts, 2)
+
+    def test_send_outbox(self):
+        """
+        Tests that the command sends the due emails and queues the failed
+        ones again with --retry-failed.
+        """
+        queue_email('Subject', 'Body', 'site@example.com',
+                    ['admin@example.com'])
+        OutboundEmail.objects.update(status=OutboundEmail.FAILED, attempts=5)
+        out = StringIO()
+        call_command('send_outbox', '--once', '--retry-failed', stdout=out)
+        self.assertIn('Queued 1 failed emails again.', out.getvalue())
+        self.assertIn('Sent 1 emails, 0 attempts failed.', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
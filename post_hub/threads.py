@@ -0,0 +1,155 @@
+"""
+This module contains the loading of comment threads for display.
+
+Comments are paginated by thread rather than by comment, so a thread is
+never split across pages. A page holds a number of top level comments, and
+their replies are then loaded with one query, over the lft and rght range
+of each top level comment or through the closure table depending on the
+tree backend. The cost of a page depends on the size of its threads, not on
+how many comments the post has in total.
+
+Threads are only loaded to a limited depth and number of replies per
+comment, so a viral thread does not make a huge page. Each loaded comment
+records how many of its replies were left out, and the comment_replies view
+serves the next replies of a comment on demand.
+
+Settings:
+    COMMENT_THREAD_DEPTH: The levels of replies loaded below a comment.
+    COMMENT_THREAD_REPLIES: The replies loaded per comment.
+
+Constants:
+    THREADS_PER_PAGE: The number of threads on a page of comments.
+    TREE_ORDER: The sibling ordering used without a sort mode, oldest
+                first.
+    WALL_SORT: The sort mode of group wall threads, newest first.
+
+Functions:
+    thread_limits: Returns the configured depth and reply limits.
+    sibling_order: Returns the ordering of siblings in a sort mode.
+    thread_roots: Returns the top level comments in a sort mode.
+    load_threads: Adds the replies of a page of threads to the page.
+    load_subtrees: Returns some comments followed by their limited
+                replies.
+"""
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .ranking import COMMENT_SORTS
+from .tree_backends import get_tree_backend
+
+THREADS_PER_PAGE = 10
+TREE_ORDER = ('tree_id', 'created_at', 'id')
+# Replies are always added as the last child of their parent, so this is
+# the lft order of the nested sets, and it works with every tree backend.
+WALL_SORT = 'new'
+# A group wall reads like a feed, so its newest threads come first. Their
+# replies keep TREE_ORDER, the order in which they were posted.
+
+
+def thread_limits():
+    """
+    Returns the depth and reply limits of the COMMENT_THREAD_DEPTH and
+    COMMENT_THREAD_REPLIES settings.
+
+    Returns:
+        tuple: The levels of replies and the replies per comment to load.
+    """
+    return (getattr(settings, 'COMMENT_THREAD_DEPTH', 3),
+            getattr(settings, 'COMMENT_THREAD_REPLIES', 5))
+
+
+def sibling_order(sort):
+    """
+    Returns the ordering of sibling comments in a sort mode.
+
+    Args:
+        sort (str): A key of COMMENT_SORTS, or None for the order in which
+                the comments were posted.
+
+    Returns:
+        tuple: The order_by() arguments.
+    """
+    return COMMENT_SORTS[sort] if sort else TREE_ORDER
+
+
+def thread_roots(comments, sort):
+    """
+    Returns the top level comments ordered by a comment sort mode, to be
+    paginated.
+
+    Args:
+        comments (QuerySet): The comments to show.
+        sort (str): A key of COMMENT_SORTS, or None.
+
+    Returns:
+        QuerySet: The ordered top level comments.
+    """
+    return comments.filter(level=0).order_by(*sibling_order(sort))
+
+
+def load_threads(page, comments, sort):
+    """
+    Adds the replies of the threads on a page to the page.
+
+    Args:
+        page (Page): A page of thread_roots().
+        comments (QuerySet): The comments to show, the same as were passed
+                        to thread_roots().
+        sort (str): A key of COMMENT_SORTS, or None.
+
+    Returns:
+        Page: The same page, now holding every comment to render.
+    """
+    page.object_list = load_subtrees(comments, list(page.object_list), sort)
+    return page
+
+
+def load_subtrees(comments, nodes, sort):
+    """
+    Returns some comments followed by their replies, loaded with one query
+    through the tree backend and limited by thread_limits().
+
+    The replies are ordered by level and then by the sort mode. Tree
+    builders such as mptt's cache_tree_children keep the order in which
+    they see siblings, so every reply ends up below its parent and before
+    its lower ranked siblings without sorting in Python. Replies whose
+    parent was left out are dropped.
+
+    Every returned comment gets a shown_replies attribute with the number of
+    its direct replies that were loaded, and a more_replies attribute with
+    the number of comments below it that were left out by the reply limit
+    or by the depth limit.
+
+    Args:
+        comments (QuerySet): The comments to choose the replies from.
+        nodes (list): The comments whose replies are loaded.
+        sort (str): A key of COMMENT_SORTS, or None.
+
+    Returns:
+        list: The comments followed by their replies.
+    """
+    depth, replies = thread_limits()
+    ordering = sibling_order(sort)
+    backend = get_tree_backend()
+    subtrees = backend.descendants_filter(nodes, depth)
+    descendants = []
+    if subtrees is not None:
+        descendants = comments.filter(subtrees).annotate(
+            sibling_rank=Window(RowNumber(), partition_by=F('parent_id'),
+                                order_by=list(ordering)),
+        ).filter(sibling_rank__lte=replies).order_by('level', *ordering)
+    loaded = list(nodes)
+    children = {node.pk: [] for node in nodes}
+    for reply in descendants:
+        if reply.parent_id in children:
+            children[reply.parent_id].append(reply)
+            children[reply.pk] = []
+            loaded.append(reply)
+    backend.load_descendant_counts(loaded)
+    for node in loaded:
+        node.shown_replies = len(children[node.pk])
+        node.more_replies = node.get_descendant_count() - sum(
+            child.get_descendant_count() + 1
+            for child in children[node.pk])
+    return loaded
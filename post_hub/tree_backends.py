@@ -0,0 +1,316 @@
+"""
+This module contains the storage backends of the comment trees.
+
+The Comment model reads and writes its tree through the backend selected by
+the COMMENT_TREE_BACKEND setting, so the views, threads.py and the
+templates work the same with either of them:
+
+- MPTTTreeBackend keeps the lft/rght nested sets of django-mptt. Reading a
+  subtree is a single range lookup, but every reply shifts the lft/rght
+  values of the rest of its thread, so concurrent replies to a busy thread
+  wait for each other.
+- ClosureTreeBackend keeps a CommentClosure row for every comment and each
+  of its ancestors. A reply only inserts its own rows, one per level, and
+  never updates existing rows, so concurrent replies do not block each
+  other. The lft/rght columns of comments inserted with it are left at
+  placeholder values.
+
+Both backends take the tree_id of a new top level comment from the locked
+CommentTreeCounter row, see CommentManager.next_tree_id, so two threads
+started at the same time never share a tree_id.
+
+The convert_comment_tree management command converts the stored trees when
+switching from one backend to the other.
+
+Settings:
+    COMMENT_TREE_BACKEND: The dotted path of the backend class, by default
+                        'post_hub.tree_backends.MPTTTreeBackend'.
+
+Classes:
+    BaseTreeBackend: The interface of a comment tree backend.
+    MPTTTreeBackend: Stores the trees as django-mptt nested sets.
+    ClosureTreeBackend: Stores the trees in a closure table.
+
+Functions:
+    get_tree_backend: Returns the configured tree backend.
+"""
+from abc import ABC, abstractmethod
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Count, Q
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from mptt.models import MPTTModel
+
+DEFAULT_BACKEND = 'post_hub.tree_backends.MPTTTreeBackend'
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class BaseTreeBackend(ABC):
+    """
+    The interface of a comment tree backend.
+
+    Attributes:
+        nested_sets (bool): Whether the backend keeps the lft/rght values
+                        of comments up to date.
+
+    Methods:
+        prepare_insert(comment): Sets the tree fields of an unsaved comment.
+        after_insert(comment): Records the tree links of a new comment.
+        descendants_filter(nodes, depth): Returns a filter matching the
+                                        replies of some comments.
+        descendants(comment, include_self): Returns a comment's replies.
+        ancestors(comment, ascending, include_self): Returns the comments
+                                                a comment replies to.
+        descendant_count(comment): Returns the number of replies below a
+                                comment.
+        load_descendant_counts(comments): Loads the reply counts of some
+                                        comments at once.
+    """
+    nested_sets = False
+
+    @abstractmethod
+    def prepare_insert(self, comment):
+        """
+        Sets the tree fields of an unsaved comment, right before it is
+        inserted in the same transaction.
+
+        It must set tree_id and level, giving a top level comment a tree_id
+        no other thread has or is about to take, and give lft and rght
+        values the database accepts.
+
+        Args:
+            comment (Comment): The unsaved comment, with its parent set.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def after_insert(self, comment):
+        """
+        Records the tree links of a comment right after it was inserted,
+        in the same transaction, so the reads below see it in its thread.
+
+        Args:
+            comment (Comment): The comment, which now has a primary key.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def descendants_filter(self, nodes, depth=None):
+        """
+        Returns a filter matching the replies of some comments.
+
+        Args:
+            nodes (list): The comments whose replies to match.
+            depth (int): The most levels below each comment to match, all
+                    of them if None.
+
+        Returns:
+            Q: The filter on the Comment model, or None if no comment has
+                replies to match.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def descendants(self, comment, include_self=False):
+        """
+        Returns the replies below a comment, at any level.
+
+        Args:
+            comment (Comment): The comment.
+            include_self (bool): Whether the comment itself is included.
+
+        Returns:
+            QuerySet: The comments, each level before the next.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def ancestors(self, comment, ascending=False, include_self=False):
+        """
+        Returns the comments a comment replies to, up to its top level
+        comment.
+
+        Args:
+            comment (Comment): The comment.
+            ascending (bool): Whether the parent comes first rather than
+                        the top level comment.
+            include_self (bool): Whether the comment itself is included.
+
+        Returns:
+            QuerySet: The comments, ordered by level.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def descendant_count(self, comment):
+        """
+        Returns the number of replies below a comment, at any level,
+        without a query if load_descendant_counts loaded it.
+
+        Args:
+            comment (Comment): The comment.
+
+        Returns:
+            int: The number of replies.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_descendant_counts(self, comments):
+        """
+        Loads the reply counts of some comments at once, so that
+        descendant_count needs no query for them.
+
+        Args:
+            comments (list): The comments, changed in place.
+        """
+        raise NotImplementedError
+
+
+class MPTTTreeBackend(BaseTreeBackend):
+    """
+    Stores the comment trees as django-mptt nested sets.
+
+    Every top level comment owns a tree_id, so a reply only shifts the
+    lft/rght values of its own thread.
+    """
+    nested_sets = True
+
+    def prepare_insert(self, comment):
+        type(comment).objects.prepare_insert(comment)
+
+    def after_insert(self, comment):
+        pass
+
+    def descendants_filter(self, nodes, depth=None):
+        ranges = Q()
+        for node in nodes:
+            if node.rght - node.lft > 1:
+                lookups = {'tree_id': node.tree_id, 'lft__gt': node.lft,
+                           'rght__lt': node.rght}
+                if depth is not None:
+                    lookups['level__lte'] = node.level + depth
+                ranges |= Q(**lookups)
+        return ranges or None
+
+    def descendants(self, comment, include_self=False):
+        return MPTTModel.get_descendants(comment, include_self=include_self)
+
+    def ancestors(self, comment, ascending=False, include_self=False):
+        return MPTTModel.get_ancestors(
+            comment, ascending=ascending, include_self=include_self)
+
+    def descendant_count(self, comment):
+        return MPTTModel.get_descendant_count(comment)
+
+    def load_descendant_counts(self, comments):
+        pass
+# The counts follow from the lft/rght values already loaded with each
+# comment, so there is nothing to load.
+
+
+class ClosureTreeBackend(BaseTreeBackend):
+    """
+    Stores the comment trees in the CommentClosure table.
+
+    Every comment has a link to itself at depth 0 and one to each of its
+    ancestors at the number of levels between them. tree_id and level are
+    still set, as top level comments are ordered by tree_id and threads are
+    limited by level, but lft and rght are placeholders.
+    """
+    def prepare_insert(self, comment):
+        model = type(comment)
+        if comment.parent_id is None:
+            comment.tree_id = model.objects.next_tree_id()
+            comment.level = 0
+        else:
+            comment.tree_id, level = model.objects.filter(
+                pk=comment.parent_id).values_list('tree_id', 'level').get()
+            comment.level = level + 1
+        comment.lft, comment.rght = 1, 2
+
+    def after_insert(self, comment):
+        closure = apps.get_model('post_hub', 'CommentClosure')
+        links = [closure(ancestor_id=comment.pk, descendant_id=comment.pk,
+                         depth=0)]
+        if comment.parent_id is not None:
+            links += [
+                closure(ancestor_id=ancestor_id, descendant_id=comment.pk,
+                        depth=depth + 1)
+                for ancestor_id, depth in closure.objects.filter(
+                    descendant_id=comment.parent_id).values_list(
+                        'ancestor_id', 'depth')]
+        closure.objects.bulk_create(links)
+
+    def descendants_filter(self, nodes, depth=None):
+        if not nodes:
+            return None
+        lookups = {'ancestor_links__ancestor__in': [node.pk for node in nodes],
+                   'ancestor_links__depth__gte': 1}
+        if depth is not None:
+            lookups['ancestor_links__depth__lte'] = depth
+        return Q(**lookups)
+
+    def descendants(self, comment, include_self=False):
+        return type(comment).objects.filter(
+            ancestor_links__ancestor=comment,
+            ancestor_links__depth__gte=0 if include_self else 1,
+        ).order_by('level', 'created_at', 'pk')
+
+    def ancestors(self, comment, ascending=False, include_self=False):
+        return type(comment).objects.filter(
+            descendant_links__descendant=comment,
+            descendant_links__depth__gte=0 if include_self else 1,
+        ).order_by('-level' if ascending else 'level')
+
+    def descendant_count(self, comment):
+        count = getattr(comment, '_descendant_count', None)
+        if count is None:
+            closure = apps.get_model('post_hub', 'CommentClosure')
+            count = closure.objects.filter(
+                ancestor=comment, depth__gte=1).count()
+        return count
+
+    def load_descendant_counts(self, comments):
+        closure = apps.get_model('post_hub', 'CommentClosure')
+        counts = dict(closure.objects.filter(
+            ancestor__in=[comment.pk for comment in comments], depth__gte=1,
+        ).values('ancestor').annotate(count=Count('pk')).values_list(
+            'ancestor', 'count'))
+        for comment in comments:
+            comment._descendant_count = counts.get(comment.pk, 0)
+
+
+def get_tree_backend():
+    """
+    Returns the tree backend configured by the COMMENT_TREE_BACKEND setting.
+
+    Returns:
+        BaseTreeBackend: The shared backend instance.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(getattr(
+                    settings, 'COMMENT_TREE_BACKEND', DEFAULT_BACKEND))()
+    return _backend
+# Templates ask for the backend once per rendered comment, so the lock is
+# only taken while the backend is created.
+
+
+@receiver(setting_changed)
+def reset_tree_backend(setting, **kwargs):
+    """
+    Drops the shared backend when the COMMENT_TREE_BACKEND setting is
+    overridden.
+    """
+    global _backend
+    if setting == 'COMMENT_TREE_BACKEND':
+        _backend = None
@@ -0,0 +1,302 @@
+"""
+This module contains the queue of image uploads.
+
+The forms and views no longer upload images while the request waits.
+stage_upload keeps the uploaded file on the instance and leaves the image
+field at its current value. When the instance is saved, an UploadJob holding
+the bytes of the file is queued, in the same transaction as the instance, so
+the workers need no disk shared with the web processes. The run_workers
+management command takes the due jobs, hands their files to the storage
+client and sets the image field to the returned URL.
+
+A worker takes jobs with a conditional UPDATE, so two workers never run the
+same job, and holds them for UPLOAD_LEASE_SECONDS. A job whose worker died
+is taken again once its lease ran out. A failed upload is retried after
+UPLOAD_RETRY_SECONDS, doubled on each attempt, until it has been tried
+UPLOAD_MAX_ATTEMPTS times. It is then marked as failed and keeps its file,
+so it can be queued again with run_workers --retry-failed.
+
+A newer image for the same field drops the jobs of the older ones, and a
+job only sets its field if it still holds the job when it finishes, so an
+older upload never replaces a newer image.
+
+Settings:
+    UPLOAD_STORAGE_CLIENT: The dotted path of the storage client class, by
+                        default 'post_hub.uploads.CloudinaryStorageClient'.
+    UPLOAD_MAX_ATTEMPTS: The number of attempts of a job, 5 by default.
+    UPLOAD_RETRY_SECONDS: The delay before the first retry, 30 by default.
+    UPLOAD_LEASE_SECONDS: How long a worker holds a job, 300 by default.
+
+Classes:
+    BaseStorageClient: The interface of a storage client.
+    CloudinaryStorageClient: Uploads the images to Cloudinary.
+    LocalStorageClient: Copies the images to MEDIA_ROOT, for tests and
+                        local development.
+
+Functions:
+    get_storage_client: Returns the configured storage client.
+    stage_upload: Queues the upload of an image when its instance is saved.
+    cancel_uploads: Drops the queued uploads of an image field.
+    claim_jobs: Takes the due jobs for a worker.
+    run_job: Uploads the file of a taken job.
+    run_pending_uploads: Runs the due jobs until none are left.
+"""
+from abc import ABC, abstractmethod
+import os
+import posixpath
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import UploadJob
+
+DEFAULT_CLIENT = 'post_hub.uploads.CloudinaryStorageClient'
+MAX_RETRY_SECONDS = 3600
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class BaseStorageClient(ABC):
+    """
+    The interface of a storage client.
+
+    Methods:
+        upload(file, **options): Stores the file of a job and returns its URL.
+    """
+    @abstractmethod
+    def upload(self, file, **options):
+        """
+        Stores the file of an upload job.
+
+        Args:
+            file (File): The file, named after the original upload.
+            **options: The options of the job, such as folder. A client
+                    ignores the options it does not support.
+
+        Returns:
+            str: The URL the stored file is served from.
+
+        Raises:
+            Exception: Any error, after which run_job schedules a retry.
+        """
+        raise NotImplementedError
+
+
+class CloudinaryStorageClient(BaseStorageClient):
+    """
+    Uploads the images to Cloudinary with the options of the job.
+    """
+    def upload(self, file, **options):
+        from cloudinary.uploader import upload
+        return upload(file, **options)['url']
+
+
+class LocalStorageClient(BaseStorageClient):
+    """
+    Copies the images to the folder of the job under MEDIA_ROOT, and returns
+    their URL under MEDIA_URL. The other options are ignored.
+    """
+    def upload(self, file, **options):
+        storage = FileSystemStorage(
+            location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL)
+        name = storage.save(
+            posixpath.join(options.get('folder', ''), file.name), file)
+        return storage.url(name)
+
+
+def get_storage_client():
+    """
+    Returns the storage client configured by the UPLOAD_STORAGE_CLIENT
+    setting.
+
+    Returns:
+        BaseStorageClient: The shared client instance.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = import_string(getattr(
+                    settings, 'UPLOAD_STORAGE_CLIENT', DEFAULT_CLIENT))()
+    return _client
+
+
+@receiver(setting_changed)
+def reset_storage_client(setting, **kwargs):
+    """
+    Drops the shared client when the UPLOAD_STORAGE_CLIENT setting is
+    overridden.
+    """
+    global _client
+    if setting == 'UPLOAD_STORAGE_CLIENT':
+        _client = None
+
+
+def _setting(name, default):
+    return getattr(settings, f'UPLOAD_{name}', default)
+
+
+def stage_upload(instance, field, upload, placeholder, **options):
+    """
+    Queues the upload of an image when its instance is next saved, and sets
+    the image field back to the value it keeps until the upload finishes.
+
+    Args:
+        instance (Model): The instance the image belongs to.
+        field (str): The name of the image field.
+        upload (UploadedFile): The uploaded image.
+        placeholder: The value of the field until the upload finishes.
+        **options: The options passed to the storage client.
+    """
+    instance.__dict__.setdefault('_staged_uploads', {})[field] = (
+        upload, options)
+    setattr(instance, field, placeholder)
+# The CloudinaryField would upload a file left in the field itself when the
+# instance is saved, so only the placeholder stays in it.
+
+
+@receiver(post_save)
+def queue_staged_uploads(sender, instance, **_kwargs):
+    """
+    Queues a job holding the file of each staged image of a saved instance.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Model): The saved instance.
+        **_kwargs: Additional keyword arguments.
+    """
+    staged = instance.__dict__.pop('_staged_uploads', None)
+    if not staged:
+        return
+    content_type = ContentType.objects.get_for_model(instance)
+    for field, (upload, options) in staged.items():
+        cancel_uploads(instance, field)
+        extension = os.path.splitext(upload.name or '')[1][:10].lower()
+        upload.seek(0)
+        UploadJob.objects.create(
+            content_type=content_type, object_id=instance.pk,
+            field_name=field, name=f'{uuid.uuid4().hex}{extension}',
+            data=b''.join(upload.chunks()), options=options)
+
+
+def cancel_uploads(instance, field):
+    """
+    Drops the queued, running and failed uploads of an image field.
+
+    Args:
+        instance (Model): The instance the image belongs to.
+        field (str): The name of the image field.
+    """
+    UploadJob.objects.filter(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.pk, field_name=field).delete()
+
+
+def claim_jobs(limit):
+    """
+    Takes the jobs that are due, or whose worker's lease ran out, for this
+    worker.
+
+    Args:
+        limit (int): The largest number of jobs taken.
+
+    Returns:
+        list: The taken jobs, with the token of this claim in claimed_by.
+    """
+    now = timezone.now()
+    due = UploadJob.objects.filter(
+        status__in=(UploadJob.QUEUED, UploadJob.RUNNING), run_at__lte=now)
+    ids = list(due.order_by('run_at').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    due.filter(pk__in=ids).update(
+        status=UploadJob.RUNNING, claimed_by=token,
+        attempts=F('attempts') + 1, updated_at=now,
+        run_at=now + timedelta(seconds=_setting('LEASE_SECONDS', 300)))
+    return list(UploadJob.objects.filter(claimed_by=token).order_by('run_at'))
+# The UPDATE repeats the conditions of the SELECT, so of two workers that
+# selected the same jobs only the first one to update a row takes it.
+
+
+def run_job(job, client=None, max_attempts=None):
+    """
+    Uploads the file of a taken job and sets its image field, or
+    schedules a retry if the upload failed.
+
+    Args:
+        job (UploadJob): A job returned by claim_jobs.
+        client (BaseStorageClient): The storage client, by default the
+                                configured one.
+        max_attempts (int): The number of attempts before the job is
+                        marked as failed, by default UPLOAD_MAX_ATTEMPTS.
+
+    Returns:
+        bool: Whether the upload succeeded.
+    """
+    client = client or get_storage_client()
+    held = UploadJob.objects.filter(
+        pk=job.pk, status=UploadJob.RUNNING, claimed_by=job.claimed_by)
+    try:
+        url = client.upload(
+            ContentFile(bytes(job.data), name=job.name), **job.options)
+    except Exception as error:
+        now = timezone.now()
+        if job.attempts >= (max_attempts or _setting('MAX_ATTEMPTS', 5)):
+            held.update(status=UploadJob.FAILED, claimed_by='',
+                        last_error=repr(error), updated_at=now)
+        else:
+            delay = min(_setting('RETRY_SECONDS', 30) * 2 ** (
+                job.attempts - 1), MAX_RETRY_SECONDS)
+            held.update(status=UploadJob.QUEUED, claimed_by='',
+                        last_error=repr(error), updated_at=now,
+                        run_at=now + timedelta(seconds=delay))
+        return False
+    model = ContentType.objects.get_for_id(job.content_type_id).model_class()
+    with transaction.atomic():
+        finished = held.delete()[0]
+        if finished:
+            model.objects.filter(pk=job.object_id).update(
+                **{job.field_name: url})
+    return True
+# A job dropped by a newer image, or taken by another worker after the
+# lease ran out, is no longer held, so its URL is not stored.
+
+
+def run_pending_uploads(batch_size=10, client=None, max_attempts=None):
+    """
+    Runs the due jobs, a batch at a time, until none are left.
+
+    Args:
+        batch_size (int): The number of jobs taken at a time.
+        client (BaseStorageClient): The storage client, by default the
+                                configured one.
+        max_attempts (int): The number of attempts of a job, by default
+                        UPLOAD_MAX_ATTEMPTS.
+
+    Returns:
+        tuple: The number of succeeded and failed uploads.
+    """
+    succeeded = failed = 0
+    while True:
+        jobs = claim_jobs(batch_size)
+        if not jobs:
+            return succeeded, failed
+        for job in jobs:
+            if run_job(job, client, max_attempts):
+                succeeded += 1
+            else:
+                failed += 1
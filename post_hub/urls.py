@@ -15,6 +15,8 @@ URL Patterns:
 - 'post/<int:pk>/delete/' (delete_post): Handles the deletion of a post.
 - 'edit_comment/<int:comment_id>/' (edit_comment): Editing of a comment.
 - 'comment/<int:pk>/delete/' (comment_delete): Handles deletion of a comment.
+- 'comment/<int:comment_id>/replies/' (comment_replies): Returns the next
+                                replies of a comment.
 - 'post/<slug:slug>/' (post_detail): Displays the details of a specific post.
 - 'usergroup/create/' (create_group): Handles the creation of a new user group.
 - 'usergroup/<slug:slug>/' (group_detail): Displays details of a user group.
@@ -24,7 +26,11 @@ URL Patterns:
 - 'usergroups/' (group_index): Displays list of groups and their latest posts.
 - 'categories/' (category_list): Displays a list of categories.
 - 'category/<slug:slug>/' (category_detail): Displays details of a category.
+- 'search/' (search): Displays the full-text search results.
+- 'autocomplete/<str:kind>/' (autocomplete): Returns the category or group
+                                names matching the typed text.
 - 'vote/' (vote): Handles voting on posts and comments.
+- 'vote/batch/' (vote_batch): Handles a batch of votes in one request.
 - 'profile/edit/' (edit_profile): Handles the editing of a user's profile.
 - 'profile/<str:username>/' (view_profile): Displays the profile of a user.
 - 'terms-conditions/' (terms_conditions): Display terms and conditions page.
@@ -43,6 +49,8 @@ urlpatterns = [
     path('edit_comment/<int:comment_id>/', edit_comment, name='edit_comment'),
     path('comment/<int:pk>/delete/',
          DeleteComment.as_view(), name='comment_delete'),
+    path('comment/<int:comment_id>/replies/',
+         views.comment_replies, name='comment_replies'),
     path('post/<slug:slug>/', views.post_detail, name='post_detail'),
     path('usergroup/create/', views.create_group, name='create_group'),
     path('usergroup/<slug:slug>/', views.group_detail, name='group_detail'),
@@ -53,7 +61,11 @@ urlpatterns = [
     path('categories/', views.category_list, name='category_list'),
     path('category/<slug:slug>/',
          CategoryDetailView.as_view(), name='category_detail'),
+    path('search/', views.search, name='search'),
+    path('autocomplete/<str:kind>/',
+         views.autocomplete, name='autocomplete'),
     path('vote/', views.vote, name='vote'),
+    path('vote/batch/', views.vote_batch, name='vote_batch'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/<str:username>/', views.view_profile, name='view_profile'),
     path('security/', views.security, name='security'),
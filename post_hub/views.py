@@ -4,67 +4,129 @@ This module contains the views for the post_hub app.
 import json
 
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseRedirect
-from django.db import IntegrityError, transaction
-from django.db.models import Count
+from django.http import JsonResponse, HttpResponseRedirect, Http404
+from django.db import IntegrityError
 from django.conf import settings
 from django.views import generic
-from django.core.mail import send_mail
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import PageNotAnInteger, EmptyPage
 from django.core.exceptions import ObjectDoesNotExist
 from django.views.generic import DetailView
 from django.views.generic.edit import DeleteView
 from django.contrib import messages
 from django.urls import reverse, reverse_lazy
 
-import cloudinary
-
-from .models import Post, Comment, Category, Vote, UserGroup, User, Profile
+from .models import Post, Comment, Category, UserGroup, User, Profile
+from .autocomplete import KINDS as AUTOCOMPLETE_KINDS, PAGE_SIZE, get_index
+from .cursors import cursor_page
+from .paginators import EstimatedCountPaginator
+from .outbox import queue_email
+from .search import SEARCHABLE, SearchPaginator, load_hits, parse_query
 from .forms import (
     CommentForm, PostForm, GroupForm,
     GroupAdminForm, ProfileForm
 )
+from .ranking import (
+    COMMENT_SORTS, SORTS, TOP_WINDOWS, comment_sort, listing_sort)
+from .threads import (
+    THREADS_PER_PAGE, WALL_SORT, load_subtrees, load_threads, sibling_order,
+    thread_limits, thread_roots)
+from .uploads import cancel_uploads, stage_upload
+from .vote_buffer import buffered_vote, buffered_votes, get_vote_buffer
+from .votes import (
+    MAX_VOTE_BATCH, cast_vote, cast_votes, load_vote_states)
+
+
+def sort_context(sort, window):
+    """
+    Returns the template context for the sort links of a post listing.
+
+    Args:
+        sort (str): The current sort mode.
+        window (str): The current top window.
+
+    Returns:
+        dict: The current sort mode and window and the available ones.
+    """
+    return {'sort': sort, 'window': window, 'sorts': SORTS,
+            'top_windows': list(TOP_WINDOWS)}
 
 
 class PostList(generic.ListView):
     """
-    A view that displays a list of approved posts, ordered by creation date.
+    A view that displays a list of approved posts, ordered by hot, top
+    or new.
 
     This view inherits from Django's generic ListView and is used to display
     a paginated list of posts that have been approved (status=1). The posts
-    are ordered by their creation date in descending order.
+    are ordered by the sort mode in the query string, newest first by
+    default.
 
     Attributes:
-        queryset (QuerySet): The queryset to retrieve approved posts
-                            ordered by creation date.
+        queryset (QuerySet): The queryset to retrieve approved posts.
         template_name (str): The template to render the list of posts.
         paginate_by (int): The number of posts to display per page.
 
     Methods:
+        get_queryset():
+            Orders the posts by the requested sort mode.
+
+        paginate_queryset(queryset, page_size):
+            Splits the posts into cursor pages.
+
         get_context_data(**kwargs):
-            Adds additional context data to the template,
-            including top categories, top user groups,
-            and suggested categories.
+            Adds the sort links and the user's votes to the template.
     """
-    queryset = Post.objects.filter(status=1).order_by("-created_at")
+    queryset = Post.objects.filter(status=1)
     # This line of code tells Django to retrieve all posts with a status of 1
-    # (approved) and order them by the created_on field in descending order.
+    # (approved). They are ordered by the sort mode in get_queryset.
     template_name = "post_hub/index.html"
     paginate_by = 8
 
+    def get_queryset(self):
+        """
+        Orders the approved posts by the sort mode in the query string,
+        ?sort=hot|top|new with ?t=day|week|month|year|all for top.
+
+        Returns:
+            QuerySet: The ordered posts.
+        """
+        self.sort, self.window = listing_sort(self.request)
+        return super().get_queryset().ranked(
+            self.sort, self.window).for_listing()
+
     # django automatically sets the context_object_name attribute
     # to object_list. e.g "post_list" is the context_object_name,
     # this becomes our iterator in the templates to show all
     # published posts in order of date posted.
 
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Splits the posts into cursor pages, named by the ?cursor query
+        parameter, instead of numbered pages.
+
+        Args:
+            queryset (QuerySet): The ordered posts.
+            page_size (int): The number of posts on a page.
+
+        Returns:
+            tuple: The paginator, the page, its posts and whether there are
+                other pages, as ListView expects.
+        """
+        page = cursor_page(self.request, queryset, page_size)
+        return page.paginator, page, page.object_list, page.has_other_pages()
+# A cursor page filters on the sort columns of the last post of the previous
+# page instead of skipping rows with OFFSET, and does not count the posts,
+# so a deep page costs the same as the first one. See post_hub/cursors.py.
+
     def get_context_data(self, **kwargs):
         """
         Adds additional context data to the template.
 
         This method overrides the default get_context_data method to add
-        top categories, top user groups, and suggested categories
-        to the context.
+        the sort links and the user's votes on the posts of the page to
+        the context.
 
         Args:
             **kwargs: Additional keyword arguments.
@@ -73,18 +135,14 @@ class PostList(generic.ListView):
             dict: The context data with additional information.
         """
         context = super().get_context_data(**kwargs)
-        context['top_categories'] = Category.objects.annotate(
-            post_count=Count('category')).order_by('-post_count')[:8]
-        context['top_groups'] = UserGroup.objects.annotate(
-            num_members=Count('members')).order_by('num_members')[:8]
-# The top 8 groups are retrieved and added to the context. The annotate method
-# is used to add a num_members field to each UserGroup object
-# which contains the count of members inside the group. Count is a django
-# aggregation function often used in conjunction with annotate.
-# Learned from =
-# https://stackoverflow.com/questions/3606416/django-most-efficient-way-to-count-same-field-values-in-a-query#:~:text=You%20can%20use%20Django%27s%20Count%20aggregation%20on%20a,in%20queryset%3A%20print%20%22%25s%3A%20%25s%22%20%25%20%28each.my_charfield%2C%20each.count%29
-
-        context['suggested_categories'] = Category.get_random_categories()
+# The top categories, top groups and suggested categories widgets are added
+# to every template by the sidebar context processor, from the cache, see
+# post_hub/sidebar.py.
+        context.update(sort_context(self.sort, self.window))
+        context['user_votes'] = load_vote_states(
+            self.request.user, posts=context['post_list'])
+# The user's votes on the posts of the page are loaded with one query, so
+# the cards can show them without a query per post.
         return context
 # By overriding the get_context_data method, you can add the categories
 # to the context in a more standard and efficient way.
@@ -108,10 +166,11 @@ def vote(request):
 
     Returns:
         JsonResponse: A JSON response indicating the success or failure of
-                    the vote operation.
+                    the vote operation. On success it also carries the
+                    fresh upvote and downvote counts and the user's vote.
 
     Raises:
-        ObjectDoesNotExist: If the post or comment does not exist.
+        Http404: If the post or comment does not exist.
         IntegrityError: If there is a database integrity error.
         ValueError: If an invalid value is provided.
     """
@@ -130,55 +189,44 @@ def vote(request):
             return JsonResponse({'success': False})
 # If is_upvote is not provided, a JSON response is returned to
 # indicate that the request has failed.
-        try:
-            with transaction.atomic():
-                # The transaction.atomic() method is used to ensure
-                # that either all of the code in this view succeeds or none of
-                # it does. This ensures that all operations are either
-                # committed or rolled back together. If an error occurs
-                # during the view function, the transaction is rolled
-                # back and the database is restored to its previous state.
-                # This ensures data integrity.
-                if post_id:
-                    # If post_id exists, the vote is for a post.
-                    post = get_object_or_404(Post, id=post_id)
-# The post object to associate with is retrieved from the
-# database using the post_id.
-                    user_vote, created = Vote.objects.get_or_create(
-                        user=user, post=post, defaults={
-                            'is_upvote': is_upvote})
-# The vote object is retrieved from the database using the post_id.
-# The get_or_create method is used to retrieve the vote object for the user
-# because there should only be one vote per user.
-                elif comment_id:
-                    # If comment_id exists, the vote is for a comment.
-                    comment = get_object_or_404(Comment, id=comment_id)
-                    user_vote, created = Vote.objects.get_or_create(
-                        user=user, comment=comment, defaults={
-                            'is_upvote': is_upvote})
-# The vote object is retrieved from the database using the comment_id.
-                else:
-                    return JsonResponse(
-                        {'success': False, 'error': 'Invalid request'})
+        if post_id:
+            # If post_id exists, the vote is for a post.
+            field, target_id = 'post', post_id
+        elif comment_id:
+            # If comment_id exists, the vote is for a comment.
+            field, target_id = 'comment', comment_id
+        else:
+            return JsonResponse(
+                {'success': False, 'error': 'Invalid request'})
 # If neither post_id nor comment_id exists, a JSON response is returned
 # to indicate that the request has failed.
-
-                if not created:
-                    # The vote we grabbed above
-                    if user_vote.is_upvote == is_upvote:
-                        user_vote.delete()
-# If the vote exists and the is_upvote field is the same as the request,
-# the vote is deleted.
-                    else:
-                        user_vote.is_upvote = is_upvote
-                        user_vote.save()
-# If the vote exists and the is_upvote field is different from the request,
-# the is_upvote field is updated. This is for if the user wants
-# to change their vote.
-                messages.success(request, 'Your vote has been recorded.')
-                return JsonResponse({'success': True})
-            # A JSON response is returned to indicate that
-            # the vote was successful.
+        try:
+            buffer = get_vote_buffer()
+            if buffer is None:
+                result = cast_vote(user, field, target_id, is_upvote)
+            else:
+                result = buffered_vote(
+                    buffer, user, field, target_id, is_upvote)
+# cast_vote adds, flips or removes the user's vote with a single upsert
+# where the database supports it, instead of a get_or_create followed by
+# a save or delete, and updates the stored vote counts on the post or
+# comment in the same transaction. If the post or comment does not exist
+# the transaction is rolled back and a 404 is returned, as before.
+# When the VOTE_BUFFER setting is set the vote is recorded in the vote
+# buffer instead and written to the database later by flush_vote_buffer.
+            return JsonResponse({
+                'success': True,
+                'upvotes': result.upvotes,
+                'downvotes': result.downvotes,
+                'score': result.upvotes - result.downvotes,
+                'user_vote': result.new_vote,
+            })
+# The fresh counts and the user's vote (true, false or null when the vote
+# was removed) are returned so the page can update the counters in place
+# instead of reloading. No flash message is queued, as it would only show
+# up on the next page the user opens.
+        except (Post.DoesNotExist, Comment.DoesNotExist):
+            raise Http404(f'No {field} matches the given query.')
         except ObjectDoesNotExist:
             messages.error(request, 'The object does not exist.')
             return JsonResponse({'success': False})
@@ -193,6 +241,61 @@ def vote(request):
     # to indicate that the request is invalid.
 
 
+@login_required
+def vote_batch(request):
+    """
+    Handle a batch of votes on posts and comments.
+
+    Clients that queue votes, such as the mobile wrapper or a burst of
+    clicks in the browser, send them together instead of one request per
+    vote. The votes are applied in order in one transaction, with bulk
+    lookups and writes, and a result is returned for each of them.
+
+    Args:
+        request (HttpRequest): The HTTP request object. Its JSON body is
+                            either a list of votes or an object with a
+                            "votes" list. Each vote has a post_id or
+                            comment_id and an is_upvote.
+
+    Returns:
+        JsonResponse: A JSON response with a "results" list in the order
+                    of the votes. Each result says whether the vote
+                    succeeded and carries the fresh counts and the user's
+                    vote, as returned by the vote view.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request method'})
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request'}, status=400)
+    operations = data.get('votes') if isinstance(data, dict) else data
+    if not isinstance(operations, list):
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid request'}, status=400)
+    if len(operations) > MAX_VOTE_BATCH:
+        return JsonResponse(
+            {'success': False,
+             'error': f'At most {MAX_VOTE_BATCH} votes per batch'},
+            status=400)
+    try:
+        buffer = get_vote_buffer()
+        if buffer is None:
+            results = cast_votes(request.user, operations)
+        else:
+            results = buffered_votes(buffer, request.user, operations)
+    except IntegrityError:
+        return JsonResponse(
+            {'success': False, 'error': 'Database integrity error.'})
+# An IntegrityError means a concurrent request added one of the same votes
+# first, the whole batch is rolled back so the client can resend it. When
+# the VOTE_BUFFER setting is set the batch goes to the vote buffer, as the
+# votes of the vote view do.
+    return JsonResponse({'success': True, 'results': results})
+
+
 def post_detail(request, slug):
     """
     Display the details of a specific post, including its comments.
@@ -215,16 +318,24 @@ def post_detail(request, slug):
     post = get_object_or_404(Post, slug=slug, status=True)
 # Grab all comments related to the post with status approved
 
-    allcomments = post.comments.filter(status=True)
+    allcomments = post.comments.filter(status=True).select_related('author')
 # The comments are filtered to only include approved comments.
 # "comments" is the related name of the ForeignKey in the Comment model.
+# Their authors are fetched in the same query, as every comment shows and
+# checks its author.
     page = request.GET.get('page', 1)
 # This line of code retrieves the page number from the GET request.
 # Djangos pagination system includes the page paramenter in the URL,
 # so the page number can be retrieved
-    paginator = Paginator(allcomments, 10)
-# The comments are paginated with 10 comments per page.
-# Using the Paginator class from Django.
+    sort = comment_sort(request)
+    paginator = EstimatedCountPaginator(
+        thread_roots(allcomments, sort), THREADS_PER_PAGE)
+# The comments are paginated by thread, with 10 top level comments per page,
+# so a thread is never split across pages. The paginator counts the threads
+# with the database's estimate once there are too many to count on every
+# request, see post_hub/paginators.py. They are ordered by the sort mode in
+# ?comment_sort=best|top|new|controversial, using the rankings stored on
+# each comment.
     try:
         comments = paginator.page(page)
 # The page method is called on the paginator object to retrieve the
@@ -235,6 +346,10 @@ def post_detail(request, slug):
         comments = paginator.page(paginator.num_pages)
 # The PageNotAnInteger and EmptyPage exceptions are handled to ensure
 # that the page number is valid.
+    load_threads(comments, allcomments, sort)
+# The replies of the threads on the page are loaded with one query through
+# the comment tree backend, so the cost of a page does not grow with the
+# total number of comments.
     user_comment = None
 # this is to store the comment that the user is going to post
 
@@ -267,6 +382,10 @@ def post_detail(request, slug):
     else:
         comment_form = CommentForm()
 # If there is no POST request, an empty comment form is created.
+    user_votes = load_vote_states(
+        request.user, posts=[post], comments=comments)
+# The user's votes on the post and on the comments of the page are loaded
+# with one query each, so the vote buttons can show them.
     context = {
         'post': post,
         'comments': comments,
@@ -274,15 +393,78 @@ def post_detail(request, slug):
         'allcomments': allcomments,
         'total_upvotes': post.total_upvotes(),
         'total_downvotes': post.total_downvotes(),
-        'comment_votes': {comment.id: {'upvotes': comment.total_upvotes(),
-                                       'downvotes': comment.total_downvotes()}
-                          for comment in allcomments}
+        'user_votes': user_votes,
+        'comment_sort': sort,
+        'comment_sorts': list(COMMENT_SORTS),
     }
     return render(request, 'post_hub/post_detail.html', context)
 # total_upvotes and total_downvotes are added to the context to display
 # the total number of upvotes and downvotes for the post.
-# comment_votes is added to the context to display the total number of upvotes
-# and downvotes for each comment using a dictionary comprehension.
+# The vote counts of each comment are read from the comments on the page.
+
+
+def comment_replies(request, comment_id):
+    """
+    Return the next replies of a comment, for the load more replies button.
+
+    Threads are only rendered to a limited depth and number of replies, see
+    post_hub/threads.py. This view returns the next slice of the direct
+    replies of a comment, each with its own replies to the same limits,
+    loaded with one query through the comment tree backend.
+
+    Args:
+        request (HttpRequest): The HTTP request object. The offset
+                            parameter is the number of replies already
+                            shown, comment_sort the sort mode of the page
+                            and format=json asks for JSON instead of HTML.
+        comment_id (int): The ID of the comment whose replies are returned.
+
+    Returns:
+        HttpResponse: The rendered replies, or a JsonResponse with the
+                    rendered replies, their data, the next offset and
+                    whether more replies are left.
+
+    Raises:
+        Http404: If the comment does not exist.
+    """
+    node = get_object_or_404(Comment, pk=comment_id, status=True)
+    sort = request.GET.get('comment_sort')
+    sort = sort if sort in COMMENT_SORTS else None
+# Without a sort mode, as on group walls, replies are in the order posted.
+    try:
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        return JsonResponse(
+            {'success': False, 'error': 'Invalid offset'}, status=400)
+    replies = thread_limits()[1]
+    comments = Comment.objects.filter(status=True).select_related('author')
+    children = list(comments.filter(parent=node).order_by(
+        *sibling_order(sort))[offset:offset + replies + 1])
+# One reply more than the limit is fetched to know if any are left.
+    nodes = load_subtrees(comments, children[:replies], sort)
+    load_vote_states(request.user, comments=nodes)
+    context = {'comments': nodes}
+    if request.GET.get('format') != 'json':
+        return render(request, 'post_hub/comment_replies.html', context)
+    return JsonResponse({
+        'success': True,
+        'html': render_to_string(
+            'post_hub/comment_replies.html', context, request=request),
+        'comments': [{
+            'id': comment.id,
+            'parent_id': comment.parent_id,
+            'author': comment.author.username,
+            'content': comment.content,
+            'level': comment.level,
+            'upvotes': comment.upvote_count,
+            'downvotes': comment.downvote_count,
+            'more_replies': comment.more_replies,
+        } for comment in nodes],
+        'next_offset': offset + len(children[:replies]),
+        'has_more': len(children) > replies,
+    })
 
 # Exempt view from cross sit request forgery protection
 
@@ -294,7 +476,8 @@ def edit_comment(request, comment_id):
     This view function allows a user to edit their own comment. It updates the
     content and optionally the image of the comment based on the data received
     from the request. The function handles both adding a new image and removing
-    an existing image.
+    an existing image. A new image is queued and replaces the current one
+    when a worker has uploaded it.
 
     Args:
         request (HttpRequest): The HTTP request object containing
@@ -320,25 +503,28 @@ def edit_comment(request, comment_id):
                 # If an image is in the request
                 image = request.FILES['image']
                 # image is retrieved from the request and stored in a variable.
-                upload_result = cloudinary.uploader.upload(
-                    # Use cloudinary api to upload the image
-                    image,
+                stage_upload(
+                    # Queue the upload to cloudinary, a worker stores the
+                    # url in the comment object when it finishes.
+                    comment, 'image', image, comment.image,
                     resource_type='image',
                     folder='comments/',
                 )
-                comment.image = upload_result['url']
-                # Take the url of the upload_result and store
-                # it in the comment object.
             elif (
                 'remove_image' in request.POST and
                 request.POST['remove_image'] == 'true'
             ):
+                cancel_uploads(comment, 'image')
                 comment.image = None
                 # If the user wants to remove the image,
                 # the image field is set to None.
 
             comment.save()
-            return JsonResponse({'success': True, 'image': comment.image})
+            return JsonResponse({
+                'success': True,
+                'image': comment.image.url if comment.image else None,
+                'image_pending': 'image' in request.FILES,
+            })
 # A JSON response is returned to indicate that
 # the comment was updated successfully.
         except ObjectDoesNotExist:
@@ -568,8 +754,8 @@ def category_list(request):
 
     This view function retrieves and displays a list of categories. If a
     search query is provided via the GET request, it filters the categories
-    based on the query. It also retrieves the top categories, top user groups,
-    and suggested categories to be displayed in the context.
+    based on the query. The top categories, top user groups and suggested
+    categories are added by the sidebar context processor.
 
     Args:
         request (HttpRequest): The HTTP request object containing
@@ -585,21 +771,83 @@ def category_list(request):
     else:
         categories = Category.objects.all()
 
-    top_categories = Category.objects.annotate(
-        post_count=Count('category_name')).order_by('post_count')
-    top_groups = UserGroup.objects.annotate(
-        num_members=Count('members')).order_by('num_members')[:8]
-    suggested_categories = Category.get_random_categories()
-
     context = {
         'categories': categories,
-        'top_categories': top_categories,
-        'top_groups': top_groups,
-        'suggested_categories': suggested_categories,
     }
+# The sidebar widgets come from the sidebar context processor.
     return render(request, 'post_hub/category_list.html', context)
 
 
+def search(request):
+    """
+    Display the full-text search results of posts, comments, groups and
+    categories.
+
+    This view function searches the rows of the kind named by the "type"
+    query string parameter, or of every kind, for the words of the "q"
+    parameter. The results are ranked best first and split into cursor
+    pages.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing
+                            the search query.
+
+    Returns:
+        HttpResponse: The rendered template displaying the search results.
+    """
+    query = request.GET.get('q', '')
+    kind = request.GET.get('type', '')
+    kinds = [kind] if kind in SEARCHABLE else list(SEARCHABLE)
+    terms = parse_query(query)
+    results = SearchPaginator(terms, kinds, 10).get_page(
+        request.GET.get('cursor'))
+    load_hits(results, terms)
+# Each page loads its rows with one query per kind on it, and the snippets
+# are marked from the loaded text.
+    return render(request, 'post_hub/search.html', {
+        'query': query, 'kind': kind if kind in SEARCHABLE else '',
+        'kinds': list(SEARCHABLE), 'results': results})
+
+
+def autocomplete(request, kind):
+    """
+    Return a page of the category or group names matching the typed text as
+    JSON.
+
+    This view function looks the "q" query string parameter up in the
+    in-memory autocomplete index of the kind. Names with a word starting
+    with the text are returned, or the names closest to it when none do,
+    and every name when there is no text. The "page" parameter selects the
+    page of PAGE_SIZE names.
+
+    Args:
+        request (HttpRequest): The HTTP request object containing
+                            the typed text.
+        kind (str): "category" or "group".
+
+    Returns:
+        JsonResponse: The matching names with their ids and slugs, whether
+                    they are fuzzy matches and whether there is a next page.
+
+    Raises:
+        Http404: If the kind is not autocompleted.
+    """
+    if kind not in AUTOCOMPLETE_KINDS:
+        raise Http404
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    entries, fuzzy = get_index(kind).suggest(
+        request.GET.get('q', ''), PAGE_SIZE + 1, (page - 1) * PAGE_SIZE)
+    return JsonResponse({
+        'results': [{'id': entry.pk, 'name': entry.name, 'slug': entry.slug}
+                    for entry in entries[:PAGE_SIZE]],
+        'fuzzy': fuzzy, 'page': page, 'has_next': len(entries) > PAGE_SIZE})
+# One name more than a page is looked up to tell whether there is a next
+# page.
+
+
 def edit_post(request, slug):
     """
     Handle the editing of an existing post.
@@ -719,10 +967,13 @@ def group_detail(request, slug):
                     updating group details.
     """
     group = get_object_or_404(UserGroup, slug=slug)
-    posts = group.group_posts.filter(status=1).order_by("-created_at")
+    sort, window = listing_sort(request)
+    posts = group.group_posts.filter(status=1).ranked(
+        sort, window).for_listing()
 # Using the group model and the post models related name group_posts to
 # retrieve the posts in the group from the post model.
-    comments = Comment.objects.filter(group=group, post__isnull=True)
+    allcomments = Comment.objects.filter(
+        group=group, post__isnull=True).select_related('author')
 # Only comments that are related to the group and not to a specific
 # post are retrieved. post__isnull=True can be used to filter comments
 # that are not related to a post. This is useful for comments that
@@ -730,10 +981,20 @@ def group_detail(request, slug):
 # ORM and is used to filter objects based on the presence or
 # absence of a related object. In this case, it is used to
 # filter comments that are not related to a post.
-
-    paginator = Paginator(posts, 4)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    comment_paginator = EstimatedCountPaginator(
+        thread_roots(allcomments, WALL_SORT), THREADS_PER_PAGE)
+    comments = load_threads(
+        comment_paginator.get_page(request.GET.get('comment_page')),
+        allcomments, None)
+# The wall is paginated by thread like the comments of a post, newest
+# threads first, under its own comment_page parameter so it does not clash
+# with the page of posts. The replies of a thread stay in the order they
+# were posted, like a conversation. Only the threads on the page are
+# loaded, to a limited depth and number of replies, the rest is fetched by
+# the load more replies button.
+
+    page_obj = cursor_page(request, posts, 4)
+# The posts are split into cursor pages, see PostList.paginate_queryset.
 
     comment_form = CommentForm()
     admin_form = GroupAdminForm(instance=group)
@@ -774,15 +1035,19 @@ def group_detail(request, slug):
                         request, 'There was an error posting your comment.'
                         ' Please try again.')
 
+    user_votes = load_vote_states(
+        request.user, posts=page_obj, comments=comments)
     context = {
         'usergroup': group,
-        'group_only_post': posts,
+        'group_only_post': page_obj,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
         'comments': comments,
+        'thread_count': comment_paginator.count,
         'comment_form': comment_form,
         'admin_form': admin_form,
-        'allcomments': comments,
+        'user_votes': user_votes,
+        **sort_context(sort, window),
     }
 # A context dicitonary is used to pass what is needed to the
 # template for rendering to the user.
@@ -822,9 +1087,10 @@ def group_index(request):
     """
     Display a list of user groups and their latest posts.
 
-    This view function retrieves all user groups and their latest posts.
-    It also handles search functionality to filter user groups based on a
-    query string provided in the URL.
+    This view function retrieves a page of user groups and their latest
+    posts. It also handles search functionality to filter user groups based
+    on a query string provided in the URL. Both lists are split into cursor
+    pages and load in a constant number of queries.
 
     Args:
         request (HttpRequest): The HTTP request object containing
@@ -834,8 +1100,8 @@ def group_index(request):
         HttpResponse: The rendered template displaying the list of user groups
                     and their latest posts.
     """
-    groups = UserGroup.objects.all()
-    group_posts = []
+    groups = cursor_page(
+        request, UserGroup.objects.for_index().order_by('name'), 10)
     query = request.GET.get('q')
 # When a form is sent by the user with "GET" , the data is stored in the URL
 # as a query string. Example : http://example.com/search?q=search_term
@@ -843,23 +1109,38 @@ def group_index(request):
 # that containes the paramters from the URL. Then the value assocciated with
 # the key 'q' is stored in the request.GET dictionary.
 
+    usergroups = None
     if query:
-        usergroups = UserGroup.objects.filter(name__icontains=query)
+        usergroups = cursor_page(request, UserGroup.objects.filter(
+            name__icontains=query).for_index().order_by('name'), 10,
+            'search_cursor')
 # *my_field*__icontains is a field lookup that is used to perform
 # case-insensitive containment test. This is used to filter the usergroups
 # based on the query string from the URL.
 # learned from =
 # https://docs.djangoproject.com/en/3.2/ref/models/querysets/#icontains
-    else:
-        usergroups = UserGroup.objects.none()
-
-    for group in groups:
-        post = group.group_posts.filter(
-            status=1).order_by('-created_at').first()
-        group_posts.append((group, post))
 
+    load_latest_posts([*groups, *(usergroups or [])])
+# Each group comes with its member count and the id of its latest approved
+# post, and the posts of both lists are then loaded with one query.
     return render(request, 'post_hub/group_index.html', {
-        'group_posts': group_posts, 'usergroups': usergroups})
+        'groups': groups, 'usergroups': usergroups, 'query': query})
+
+
+def load_latest_posts(groups):
+    """
+    Loads the latest posts of groups annotated by UserGroup.for_index(),
+    with one query.
+
+    Args:
+        groups (list): The groups, each gets a latest_post attribute set
+                    to its latest approved post or None.
+    """
+    posts = Post.objects.select_related('author').only(
+        'title', 'slug', 'author__username').in_bulk(
+            {group.latest_post_id for group in groups} - {None})
+    for group in groups:
+        group.latest_post = posts.get(group.latest_post_id)
 
 
 def remove_member(request, slug, user_id):
@@ -899,8 +1180,8 @@ class CategoryDetailView(DetailView):
     Display the details of a specific category, including its posts.
 
     This view class retrieves a category based on its slug and displays
-    its details, including the posts in the category. It also adds
-    suggested categories to the context.
+    its details, including the posts in the category. Suggested
+    categories are added by the sidebar context processor.
 
     Attributes:
         model (Model): The model to be retrieved (Category).
@@ -915,7 +1196,7 @@ class CategoryDetailView(DetailView):
 
         get_context_data(**kwargs):
             Adds additional context data to the template, including the posts
-            in the category and suggested categories.
+            in the category.
     """
     model = Category
     template_name = 'post_hub/category_detail.html'
@@ -929,12 +1210,15 @@ class CategoryDetailView(DetailView):
         context = super().get_context_data(**kwargs)
 # The get_context_data method is overridden to add
 # the posts in the category to the context.
-        category = self.get_object()
-# The category object is retrieved from the context.
-        context['posts'] = Post.objects.filter(
-            category=category, status=1).order_by("-created_at")
-# The posts in the category are retrieved and added to the context.
-        context['suggested_categories'] = Category.get_random_categories()
+        category = self.object
+# The category object was already retrieved by get_object.
+        sort, window = listing_sort(self.request)
+        posts = Post.objects.filter(
+            category=category, status=1).ranked(sort, window).for_listing()
+        context['posts'] = cursor_page(self.request, posts, 8)
+        context.update(sort_context(sort, window))
+# The posts in the category are retrieved, ordered by the sort mode in the
+# query string, and added to the context a cursor page at a time.
         return context
 
 
@@ -994,15 +1278,11 @@ def view_profile(request, username):
 
     stat_tuple = (post_count, comment_count, post_grade, comment_grade)
 
-    # Paginate user posts
-    post_paginator = Paginator(user_posts, 3)
-    post_page_number = request.GET.get('post_page')
-    post_page_obj = post_paginator.get_page(post_page_number)
-
-    # Paginate user comments
-    comment_paginator = Paginator(user_comments, 3)
-    comment_page_number = request.GET.get('comment_page')
-    comment_page_obj = comment_paginator.get_page(comment_page_number)
+    # Paginate user posts and comments by cursor
+    post_page_obj = cursor_page(
+        request, user_posts.for_listing(), 3, 'post_cursor')
+    comment_page_obj = cursor_page(
+        request, user_comments.select_related('post'), 3, 'comment_cursor')
 
     return render(request, 'post_hub/profile.html', {
         'profile': profile,
@@ -1123,9 +1403,10 @@ def send_email(request):
     """
     Handle the sending of an email from the contact form.
 
-    This view function processes the contact form submission and sends an email
-    with the provided details. If the email is sent successfully, a success
-    message is displayed.
+    This view function processes the contact form submission and queues an
+    email with the provided details in the outbox, which the send_outbox
+    worker delivers, so a slow mail server does not hold up the request. A
+    success message is displayed once the email is queued.
 
     Args:
         request (HttpRequest): The HTTP request object containing
@@ -1141,12 +1422,11 @@ def send_email(request):
 
         full_message = f"Name: {name}\nEmail: {email}\n\nMessage:\n{message}"
 
-        send_mail(
+        queue_email(
             f"Message from {name}",
             full_message,
             email,
             ['maxwise70@hotmail.co.uk'],
-            fail_silently=False,
         )
         messages.success(request, 'Your email has been sent successfully!')
         return redirect('contact')
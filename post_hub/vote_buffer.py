@@ -0,0 +1,482 @@
+"""
+This module contains the optional write-behind buffer for votes.
+
+When the VOTE_BUFFER setting is set, the vote view does not write to the
+Vote table. It works out the user's new vote from their buffered or stored
+vote and records it in a fast local buffer instead. The buffer keeps one
+entry per user and post or comment, so only the last vote wins. The
+flush_vote_buffer command later writes the buffered votes to the Vote table
+in bulk. A user's own buffered votes are read back from the buffer until
+they are flushed, so they always see their latest vote.
+
+Settings:
+    VOTE_BUFFER: None to write votes straight to the database, or a dict
+                with the dotted path of a BACKEND class and the OPTIONS
+                passed to it, for example
+                {'BACKEND': 'post_hub.vote_buffer.SQLiteVoteBuffer',
+                 'OPTIONS': {'path': '/var/run/reddit_site/votes.db'}}
+
+Classes:
+    BufferedVote: A vote waiting in the buffer.
+    BaseVoteBuffer: The interface of a vote buffer backend.
+    InMemoryVoteBuffer: A buffer kept in the process, for tests and
+                        single process deployments.
+    SQLiteVoteBuffer: A buffer kept in a local SQLite file, shared by
+                    every process on the host.
+
+Functions:
+    get_vote_buffer: Returns the configured vote buffer, or None.
+    buffered_vote: Toggles a user's vote in the buffer.
+    buffered_votes: Toggles a batch of a user's votes in the buffer.
+    pending_votes: Returns a user's buffered votes on some posts or
+                comments.
+    flush_vote_buffer: Writes buffered votes to the Vote table in bulk.
+"""
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Vote
+from .votes import (
+    VOTE_TARGETS, VoteResult, add_vote_counts, apply_vote_states,
+    drop_missing_targets, existing_targets, parse_vote_operations,
+    read_counts, vote_deltas)
+
+BufferedVote = namedtuple(
+    'BufferedVote', ['key', 'vote', 'queued_at', 'version'])
+# key is (user_id, field, target_id) and vote is True, False or None for a
+# removed vote. queued_at is when the key was first buffered and version
+# grows with every overwrite, so an entry overwritten during a flush is not
+# acknowledged with the older value.
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class BaseVoteBuffer(ABC):
+    """
+    The interface of a vote buffer backend.
+
+    Methods:
+        put(key, vote): Buffers the latest vote of a user on a target.
+        toggle(entries): Toggles buffered votes in one atomic step.
+        get_many(keys): Returns the buffered votes of the given keys.
+        peek(limit): Returns the oldest buffered votes.
+        ack(entries): Removes flushed votes that were not overwritten.
+        __len__(): Returns the number of buffered votes.
+    """
+    @abstractmethod
+    def put(self, key, vote):
+        """
+        Buffers the latest vote of a user on a post or comment, replacing
+        any vote buffered for the same key.
+
+        Args:
+            key (tuple): The (user_id, field, target_id) of the vote.
+            vote (bool): The vote to store on flush, None meaning the vote
+                    is removed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def toggle(self, entries):
+        """
+        Toggles the buffered votes of the entries, in order, as one atomic
+        step, so no other put or toggle of the same keys runs in between.
+
+        Each toggle starts from the buffered vote of its key, or from the
+        stored vote when none is buffered, and buffers the result.
+
+        Args:
+            entries (list): (key, stored, is_upvote) tuples, where stored
+                    is the vote in the Vote table, None for no vote.
+
+        Returns:
+            list: One (old_vote, new_vote) tuple per entry, None meaning no
+                vote.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many(self, keys):
+        """
+        Returns the buffered votes of the given keys.
+
+        Args:
+            keys (list): (user_id, field, target_id) tuples.
+
+        Returns:
+            dict: Maps each buffered key to its vote, None meaning a
+                removed vote. Keys without a buffered vote are left out.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def peek(self, limit):
+        """
+        Returns the oldest buffered votes without removing them.
+
+        Args:
+            limit (int): The most votes to return.
+
+        Returns:
+            list: BufferedVote tuples, oldest first.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def ack(self, entries):
+        """
+        Removes flushed votes from the buffer. An entry whose key was
+        overwritten since it was peeked, so its version changed, is kept.
+
+        Args:
+            entries (list): BufferedVote tuples returned by peek.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self):
+        """
+        Returns:
+            int: The number of buffered votes.
+        """
+        raise NotImplementedError
+
+
+class InMemoryVoteBuffer(BaseVoteBuffer):
+    """
+    A vote buffer kept in a dict in the current process.
+
+    Buffered votes are lost when the process exits and are not shared
+    between worker processes, so this backend is meant for tests and
+    single process deployments.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, vote):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = BufferedVote(key, vote, time.time(), 1)
+            else:
+                self._entries[key] = entry._replace(
+                    vote=vote, version=entry.version + 1)
+
+    def toggle(self, entries):
+        votes = []
+        with self._lock:
+            for key, stored, is_upvote in entries:
+                entry = self._entries.get(key)
+                old_vote = stored if entry is None else entry.vote
+                new_vote = None if old_vote == is_upvote else is_upvote
+                if entry is None:
+                    self._entries[key] = BufferedVote(
+                        key, new_vote, time.time(), 1)
+                else:
+                    self._entries[key] = entry._replace(
+                        vote=new_vote, version=entry.version + 1)
+                votes.append((old_vote, new_vote))
+        return votes
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self._entries[key].vote
+                    for key in keys if key in self._entries}
+
+    def peek(self, limit):
+        with self._lock:
+            return sorted(self._entries.values(),
+                          key=lambda entry: entry.queued_at)[:limit]
+
+    def ack(self, entries):
+        with self._lock:
+            for entry in entries:
+                current = self._entries.get(entry.key)
+                if current is not None and current.version == entry.version:
+                    del self._entries[entry.key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteVoteBuffer(BaseVoteBuffer):
+    """
+    A vote buffer kept in a local SQLite file.
+
+    Every process on the host that opens the same file shares the buffer,
+    and buffered votes survive a restart. Each thread uses its own
+    connection, as SQLite connections cannot be shared between threads.
+
+    Args:
+        path (str): The path of the SQLite file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS vote_buffer ('
+                'user_id INTEGER NOT NULL, field TEXT NOT NULL, '
+                'target_id INTEGER NOT NULL, vote INTEGER, '
+                'queued_at REAL NOT NULL, version INTEGER NOT NULL, '
+                'PRIMARY KEY (user_id, field, target_id))')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS vote_buffer_queued_at '
+                'ON vote_buffer (queued_at)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def put(self, key, vote):
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT INTO vote_buffer VALUES (?, ?, ?, ?, ?, 1) '
+                'ON CONFLICT (user_id, field, target_id) DO UPDATE SET '
+                'vote = excluded.vote, version = version + 1',
+                (*key, vote, time.time()))
+
+    def toggle(self, entries):
+        votes = []
+        with self._connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for key, stored, is_upvote in entries:
+                pending = connection.execute(
+                    'SELECT vote FROM vote_buffer WHERE user_id = ? AND '
+                    'field = ? AND target_id = ?', key).fetchone()
+                new_vote, = connection.execute(
+                    'INSERT INTO vote_buffer VALUES (?, ?, ?, ?, ?, 1) '
+                    'ON CONFLICT (user_id, field, target_id) DO UPDATE SET '
+                    'vote = CASE WHEN vote IS ? THEN NULL ELSE ? END, '
+                    'version = version + 1 RETURNING vote',
+                    (*key, None if stored == is_upvote else is_upvote,
+                     time.time(), is_upvote, is_upvote)).fetchone()
+                old_vote = stored if pending is None else pending[0]
+                votes.append((None if old_vote is None else bool(old_vote),
+                              None if new_vote is None else bool(new_vote)))
+        return votes
+# BEGIN IMMEDIATE takes the write lock before the pending votes are read,
+# and the upsert toggles the stored row itself, so two requests of the same
+# user never toggle from the same vote.
+
+    def get_many(self, keys):
+        groups = {}
+        for user_id, field, target_id in keys:
+            groups.setdefault((user_id, field), []).append(target_id)
+        votes = {}
+        connection = self._connection()
+        for (user_id, field), target_ids in groups.items():
+            placeholders = ', '.join('?' * len(target_ids))
+            rows = connection.execute(
+                f'SELECT target_id, vote FROM vote_buffer WHERE user_id = ? '
+                f'AND field = ? AND target_id IN ({placeholders})',
+                (user_id, field, *target_ids))
+            for target_id, vote in rows:
+                votes[user_id, field, target_id] = (
+                    None if vote is None else bool(vote))
+        return votes
+
+    def peek(self, limit):
+        rows = self._connection().execute(
+            'SELECT user_id, field, target_id, vote, queued_at, version '
+            'FROM vote_buffer ORDER BY queued_at LIMIT ?', (limit,))
+        return [BufferedVote((user_id, field, target_id),
+                             None if vote is None else bool(vote),
+                             queued_at, version)
+                for user_id, field, target_id, vote, queued_at, version
+                in rows]
+
+    def ack(self, entries):
+        with self._connection() as connection:
+            connection.executemany(
+                'DELETE FROM vote_buffer WHERE user_id = ? AND field = ? '
+                'AND target_id = ? AND version = ?',
+                [(*entry.key, entry.version) for entry in entries])
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM vote_buffer').fetchone()[0]
+
+
+def get_vote_buffer():
+    """
+    Returns the vote buffer configured by the VOTE_BUFFER setting.
+
+    Returns:
+        BaseVoteBuffer: The shared buffer instance, or None when votes are
+                    written straight to the database.
+    """
+    global _buffer
+    config = getattr(settings, 'VOTE_BUFFER', None)
+    if not config:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            backend = import_string(config['BACKEND'])
+            _buffer = backend(**config.get('OPTIONS', {}))
+    return _buffer
+
+
+@receiver(setting_changed)
+def reset_vote_buffer(setting, **kwargs):
+    """
+    Drops the shared buffer when the VOTE_BUFFER setting is overridden.
+    """
+    global _buffer
+    if setting == 'VOTE_BUFFER':
+        _buffer = None
+
+
+def buffered_vote(buffer, user, field, target_id, is_upvote):
+    """
+    Toggles a user's vote in the buffer instead of the Vote table.
+
+    The user's current vote is their buffered vote if they have one,
+    otherwise their stored vote. The returned counts are the stored counts
+    with this user's vote applied, which is what they will be once the
+    buffer is flushed if nobody else votes in the meantime.
+
+    Args:
+        buffer (BaseVoteBuffer): The vote buffer.
+        user (User): The user casting the vote.
+        field (str): 'post' or 'comment'.
+        target_id (int): The id of the post or comment.
+        is_upvote (bool): Whether the vote is an upvote.
+
+    Returns:
+        VoteResult: The previous and the resulting vote and the counts.
+
+    Raises:
+        DoesNotExist: If the post or comment does not exist.
+        ValueError: If target_id is not a valid id.
+    """
+    model = VOTE_TARGETS[field]
+    target_id = int(target_id)
+    is_upvote = bool(is_upvote)
+    counts = model.objects.filter(pk=target_id).values_list(
+        'upvote_count', 'downvote_count').first()
+    if counts is None:
+        raise model.DoesNotExist(f'{field} {target_id} does not exist')
+    stored = Vote.objects.filter(
+        user=user, **{f'{field}_id': target_id}).values_list(
+            'is_upvote', flat=True).first()
+    (old_vote, new_vote), = buffer.toggle(
+        [((user.pk, field, target_id), stored, is_upvote)])
+    upvotes, downvotes = vote_deltas(stored, new_vote)
+    return VoteResult(old_vote, new_vote,
+                      counts[0] + upvotes, counts[1] + downvotes)
+
+
+def buffered_votes(buffer, user, operations):
+    """
+    Toggles a batch of a user's votes in the buffer instead of the Vote
+    table, as the batch endpoint's counterpart of buffered_vote.
+
+    Each operation starts from the user's buffered vote if they have one,
+    otherwise their stored vote, and the batch's final votes are written
+    to the buffer. The posts, comments, stored votes and buffered votes
+    are loaded with one query each, whatever the batch size.
+
+    Args:
+        buffer (BaseVoteBuffer): The vote buffer.
+        user (User): The user casting the votes.
+        operations (list): Dicts with a post_id or comment_id key and an
+                        is_upvote key.
+
+    Returns:
+        list: One dict per operation, as returned by cast_votes. The counts
+            are the stored counts with the user's final votes applied.
+    """
+    parsed, results = parse_vote_operations(operations)
+    existing = existing_targets(op[:2] for op in parsed if op)
+    stored = {}
+    for field in VOTE_TARGETS:
+        stored.update(
+            ((user.pk, field, target_id), is_upvote)
+            for target_id, is_upvote in Vote.objects.filter(
+                user=user, **{f'{field}_id__in': existing[field]}
+            ).values_list(f'{field}_id', 'is_upvote'))
+    drop_missing_targets(parsed, results, existing)
+    toggles = [(index, (user.pk, *op[:2]), op[2])
+               for index, op in enumerate(parsed) if op]
+    votes = buffer.toggle([(key, stored.get(key), is_upvote)
+                           for _, key, is_upvote in toggles])
+    state = {}
+    for (index, key, _), (_, new_vote) in zip(toggles, votes):
+        results[index]['user_vote'] = state[key] = new_vote
+    counts = read_counts(existing)
+    for key, vote in state.items():
+        upvotes, downvotes = vote_deltas(stored.get(key), vote)
+        old = counts[key[1]][key[2]]
+        counts[key[1]][key[2]] = (old[0] + upvotes, old[1] + downvotes)
+    add_vote_counts(parsed, results, counts)
+    return results
+# The whole batch is toggled in one step of the buffer, so a concurrent
+# vote of the same user lands either before or after the batch.
+
+
+def pending_votes(user, field, target_ids):
+    """
+    Returns a user's buffered votes on some posts or comments, so reads
+    of the user's own votes can see votes that are not flushed yet.
+
+    Args:
+        user (User): The voting user.
+        field (str): 'post' or 'comment'.
+        target_ids (list): The ids of the posts or comments.
+
+    Returns:
+        dict: Maps the ids with a buffered vote to the vote, None meaning
+            the vote was removed. Empty when no buffer is configured.
+    """
+    buffer = get_vote_buffer()
+    if buffer is None or not user.is_authenticated:
+        return {}
+    pending = buffer.get_many(
+        [(user.pk, field, target_id) for target_id in target_ids])
+    return {key[2]: vote for key, vote in pending.items()}
+
+
+def flush_vote_buffer(buffer, batch_size=500, max_batches=None):
+    """
+    Writes buffered votes to the Vote table in bulk, oldest first.
+
+    Each batch is applied in one transaction with apply_vote_states() and
+    only then removed from the buffer, so a failed flush loses nothing and
+    a retried one applies the same final votes again.
+
+    Args:
+        buffer (BaseVoteBuffer): The vote buffer.
+        batch_size (int): Buffered votes written per transaction.
+        max_batches (int): Stop after this many batches, None to flush
+                        until the buffer is empty.
+
+    Returns:
+        list: A (size, applied, lag) tuple per batch, where lag is how long
+            the oldest vote of the batch waited in seconds.
+    """
+    batches = []
+    while max_batches is None or len(batches) < max_batches:
+        entries = buffer.peek(batch_size)
+        if not entries:
+            break
+        lag = time.time() - min(entry.queued_at for entry in entries)
+        applied = apply_vote_states(
+            {entry.key: entry.vote for entry in entries})
+        buffer.ack(entries)
+        batches.append((len(entries), applied, lag))
+    return batches
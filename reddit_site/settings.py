@@ -82,6 +82,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'post_hub.context_processors.sidebar',
             ],
         },
     },
@@ -103,6 +104,81 @@ if 'test' in sys.argv:
         }
     }
 
+# The cache is shared by the web processes and the workers, so an entry
+# dropped by one process is dropped for all of them. The table is created
+# by manage.py createcachetable, which the release phase of the Procfile
+# runs on each deploy. Tests keep the cache in memory, so the query counts
+# of the tests leave out the cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'post_hub_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    }
+}
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Write-behind vote buffer, see post_hub/vote_buffer.py. Votes are written
+# straight to the database unless VOTE_BUFFER_PATH is set, in which case
+# they are buffered in that SQLite file until flush_vote_buffer runs.
+VOTE_BUFFER = None
+if os.getenv('VOTE_BUFFER_PATH'):
+    VOTE_BUFFER = {
+        'BACKEND': 'post_hub.vote_buffer.SQLiteVoteBuffer',
+        'OPTIONS': {'path': os.getenv('VOTE_BUFFER_PATH')},
+    }
+
+# Comment threads are rendered to this many levels of replies and this many
+# replies per comment, see post_hub/threads.py. The rest is loaded by the
+# load more replies button.
+COMMENT_THREAD_DEPTH = 3
+COMMENT_THREAD_REPLIES = 5
+
+# Storage of the comment trees, see post_hub/tree_backends.py. The closure
+# table backend suits threads with many concurrent replies. Run
+# manage.py convert_comment_tree after switching.
+COMMENT_TREE_BACKEND = os.getenv(
+    'COMMENT_TREE_BACKEND', 'post_hub.tree_backends.MPTTTreeBackend')
+
+# Paginators with page numbers use the database's row estimate instead of
+# an exact COUNT(*) once the estimate reaches this many rows, and cache
+# large exact counts for this many seconds, see post_hub/paginators.py.
+ESTIMATED_COUNT_THRESHOLD = 1_000_000
+COUNT_CACHE_SECONDS = 60
+
+# The sidebar widgets are cached for this many seconds, and dropped from the
+# cache as soon as their data changes, see post_hub/sidebar.py.
+SIDEBAR_CACHE_SECONDS = 300
+
+# Full-text search ranks only this many of the newest matches of a query,
+# see post_hub/search.py.
+SEARCH_MAX_RANKED = 10_000
+
+# Images are queued in the database and uploaded by the workers of
+# manage.py run_workers, see post_hub/uploads.py. A failed upload is retried
+# after UPLOAD_RETRY_SECONDS, doubled on each attempt, up to
+# UPLOAD_MAX_ATTEMPTS times. Tests copy the images to MEDIA_ROOT instead of
+# uploading them to Cloudinary.
+UPLOAD_STORAGE_CLIENT = os.getenv(
+    'UPLOAD_STORAGE_CLIENT', 'post_hub.uploads.CloudinaryStorageClient')
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_RETRY_SECONDS = 30
+UPLOAD_LEASE_SECONDS = 300
+if 'test' in sys.argv:
+    UPLOAD_STORAGE_CLIENT = 'post_hub.uploads.LocalStorageClient'
+
+# Emails are queued in the outbox and sent by manage.py send_outbox, see
+# post_hub/outbox.py. A failed email is retried after OUTBOX_RETRY_SECONDS,
+# doubled on each attempt, up to OUTBOX_MAX_ATTEMPTS times.
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_SECONDS = 60
+OUTBOX_LEASE_SECONDS = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -1,5 +1,6 @@
 /*global $, document, setTimeout, localStorage, location, FormData,
- fetch, console, alert, window */
+ fetch, console, alert, window, clearTimeout, URLSearchParams,
+ Option */
 
 function formExit() {
   $("#newForm").remove();
@@ -316,6 +317,29 @@ document.addEventListener("DOMContentLoaded", function () {
   hideCreatedAtIfUpdated();
 });
 
+function updateVoteCounts(kind, id, data) {
+  const upvotes = document.getElementById(`${kind}-upvotes-${id}`);
+  const downvotes = document.getElementById(`${kind}-downvotes-${id}`);
+  // kind is "post" or "comment", the counters are spans rendered with
+  // ids like post-upvotes-1 and comment-downvotes-7
+  if (upvotes) {
+    upvotes.textContent = data.upvotes;
+  }
+  if (downvotes) {
+    downvotes.textContent = data.downvotes;
+  }
+  document.querySelectorAll(`[data-vote="${kind}-${id}-up"]`)
+    .forEach(function (button) {
+      button.setAttribute("aria-pressed", data.user_vote === true);
+    });
+  document.querySelectorAll(`[data-vote="${kind}-${id}-down"]`)
+    .forEach(function (button) {
+      button.setAttribute("aria-pressed", data.user_vote === false);
+    });
+  // user_vote is true for an upvote, false for a downvote and null when
+  // the vote was removed, aria-pressed marks the button of the current vote
+}
+
 function votePost(postId, isUpvote) {
   const csrfToken = document.querySelector(
     "input[name='csrfmiddlewaretoken']"
@@ -342,11 +366,9 @@ function votePost(postId, isUpvote) {
     .then(function (data) {
       // data comes out as JSON and we can use it to update the page
       if (data.success) {
-        location.reload();
-        // I have only learnt of the reload method
-        // today and it is very useful
-        // https://stackoverflow.com/questions/3715047/
-        // how-to-reload-a-page-using-javascript
+        updateVoteCounts("post", postId, data);
+        // The response carries the fresh counts, so only the counters
+        // are patched instead of reloading the whole page
       } else {
         alert("Error voting on post");
       }
@@ -378,15 +400,145 @@ function voteComment(commentId, isUpvote) {
     .then((response) => response.json())
     .then(function (data) {
       if (data.success) {
-        location.reload();
+        updateVoteCounts("comment", commentId, data);
       } else {
         alert("Error voting on comment");
       }
     });
 }
 
+function loadMoreReplies(commentId) {
+  const button = document.getElementById(`more-replies-${commentId}`);
+  const threads = document.getElementById("comment-threads");
+  const params = new URLSearchParams({
+    comment_sort: threads ? threads.dataset.commentSort : "",
+    format: "json",
+    offset: button.dataset.offset
+  });
+  // offset is the number of replies already shown, the view returns the
+  // next replies in the same sort mode as the rest of the page
+  fetch(`/comment/${commentId}/replies/?${params}`)
+    .then((response) => response.json())
+    .then(function (data) {
+      if (!data.success) {
+        alert("Error loading replies");
+        return;
+      }
+      let replies = document.getElementById(`replies-${commentId}`);
+      if (!replies) {
+        replies = document.createElement("div");
+        replies.className = "children nested-comment pl-2 pl-md-5";
+        replies.id = `replies-${commentId}`;
+        button.before(replies);
+      }
+      replies.insertAdjacentHTML("beforeend", data.html);
+      if (data.has_more) {
+        button.dataset.offset = data.next_offset;
+      } else {
+        button.remove();
+      }
+    });
+}
+
 $(function () {
   $("#day-night").on("change", function (event) {
     $("body").toggleClass("night-mode", event.target.checked);
   });
 });
+
+document.addEventListener("DOMContentLoaded", function () {
+  document
+    .querySelectorAll("input[data-autocomplete-url]")
+    .forEach(function (input) {
+      const list = document.createElement("datalist");
+      let timer;
+      list.id = `${input.id}-suggestions`;
+      input.setAttribute("list", list.id);
+      input.after(list);
+      input.addEventListener("input", function () {
+        clearTimeout(timer);
+        // Waits for a pause in typing so each word sends one request
+        timer = setTimeout(function () {
+          const params = new URLSearchParams({ q: input.value });
+          fetch(`${input.dataset.autocompleteUrl}?${params}`)
+            .then((response) => response.json())
+            .then(function (data) {
+              list.replaceChildren(
+                ...data.results.map(function (result) {
+                  const option = document.createElement("option");
+                  option.value = result.name;
+                  return option;
+                })
+              );
+            });
+        }, 150);
+      });
+    });
+  /* Suggests existing names under inputs with a data-autocomplete-url, such
+     as the new category field of the post form */
+});
+
+document.addEventListener("DOMContentLoaded", function () {
+  document
+    .querySelectorAll("select[data-autocomplete-url]")
+    .forEach(function (select) {
+      const search = document.createElement("input");
+      const more = document.createElement("button");
+      let query = "";
+      let page = 1;
+      let timer;
+      search.type = "search";
+      search.className = "form-control mb-1";
+      search.placeholder = "Search...";
+      search.setAttribute("aria-label", `Search ${select.name}`);
+      more.type = "button";
+      more.className = "btn btn-link p-0";
+      more.textContent = "More";
+      more.hidden = true;
+      select.before(search);
+      select.after(more);
+
+      function load(reset) {
+        const params = new URLSearchParams({ q: query, page: page });
+        fetch(`${select.dataset.autocompleteUrl}?${params}`)
+          .then((response) => response.json())
+          .then(function (data) {
+            if (reset) {
+              Array.from(select.options).forEach(function (option) {
+                if (option.value && !option.selected) {
+                  option.remove();
+                }
+              });
+            }
+            data.results.forEach(function (result) {
+              if (!select.querySelector(`option[value="${result.id}"]`)) {
+                select.add(new Option(result.name, result.id));
+              }
+            });
+            more.hidden = !data.has_next;
+          });
+      }
+      // The selected option is kept while other names are searched
+
+      search.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+          query = search.value;
+          page = 1;
+          load(true);
+        }, 150);
+      });
+      select.addEventListener("focus", function () {
+        if (page === 1 && !query) {
+          load(false);
+        }
+      }, { once: true });
+      more.addEventListener("click", function () {
+        page += 1;
+        load(false);
+      });
+    });
+  /* The category and group selects of the post form only render their
+     selected option, and load a page of names at a time from the
+     autocomplete endpoint when they are focused or searched */
+});